@@ -13,6 +13,10 @@ Example Usage:
 
 
 More example usages are implemented in each submodule as __main__ function.
+
+Connections to a device are kept open between calls and shared by clients (RMAPIClientSessionPool). The results of
+zones.get, programs.get, parsers.get, restrictions.globally and mixer.get are cached for a few seconds
+(RMAPIClientCache, client.rest.cache), POST calls drop the cached results they change.
 """
 # To generate the documentation:
 # PYTHONPATH=. pdoc API4Client --all-submodules --html-dir /tmp/rmclient/ && cd /tmp/rmclient/API4Client/ && cat * > readme.md
@@ -17,25 +17,29 @@ from rmAPIClientRestrictions import *
 from rmAPIClientWatering import *
 from rmAPIClientZones import *
 
+import threading, time, copy
+
 class RMAPIClientState:
     """
     Used to cache API calls responses.
     """
     def __init__(self):
         self.cachedData = {}
+        self.lastSnapshot = None
 
 class RMAPIClient(object):
     """
     RainMachine REST API Python wrapper. All function calls returns the data as a python dictionary.
     Calls and their returns are explained here: http://docs.rainmachine.apiary.io/
     """
-    def __init__(self, host, port, protocol=RMAPIClientProtocol.HTTP):
+    def __init__(self, host, port, protocol=RMAPIClientProtocol.HTTP, timeout=None):
         self._host = host
         self._port = port
         self._protocol = protocol
 
         self.state = RMAPIClientState()
-        self.rest = RMAPIClientREST(self._host, self._port, self._protocol)
+        self.rest = RMAPIClientREST(self._host, self._port, self._protocol, timeout)
+        self.state.cachedData = self.rest.cache.entries
 
         #self.apiversion = self.rest.apiversion
 
@@ -80,6 +84,92 @@ class RMAPIClient(object):
         self.rest = RMAPIClientREST(self._host, self_protocol, self._protocol)
 
 
+    # Calls used by snapshot() when none are given (a dashboard refresh)
+    SnapshotCalls = ["zones.get", "watering.getqueue", "watering.getzone", "restrictions.currently", "programs.nextrun", "dailystats.get"]
+
+    def snapshot(self, calls = None, delta = False, concurrency = 4):
+        """
+        Runs several GET calls at the same time and returns their results in one structure:
+
+            {"timestamp": 1466669477.5, "elapsed": 0.21, "data": {"zones.get": {...}, ...}, "errors": {...}}
+
+        Calls are given as "submodule.method" or ("submodule.method", args) / ("submodule.method", args, kwargs),
+        results are keyed by the call name (with its arguments when there are any). Requests are sent by up to
+        concurrency threads on the pooled connections of the client. With delta=True only the calls with results
+        different from the previous snapshot are in data, the others are listed in unchanged.
+        """
+        if calls is None:
+            calls = RMAPIClient.SnapshotCalls
+
+        jobs = []
+        for call in calls:
+            if isinstance(call, basestring):
+                call = (call, )
+            name = call[0]
+            args = call[1] if len(call) > 1 else ()
+            kwargs = call[2] if len(call) > 2 else {}
+            key = name
+            if args or kwargs:
+                key = "%s(%s)" % (name, ", ".join([repr(arg) for arg in args] + ["%s=%r" % item for item in sorted(kwargs.items())]))
+            jobs.append((key, name, tuple(args), kwargs))
+
+        results = {}
+        lock = threading.Lock()
+        start = time.time()
+
+        def worker():
+            while True:
+                with lock:
+                    if not jobs:
+                        return
+                    key, name, args, kwargs = jobs.pop(0)
+                submodule, method = name.split(".", 1)
+                try:
+                    data = getattr(getattr(self, submodule), method)(*args, **kwargs)
+                except Exception, e:
+                    log.error("Snapshot: %s failed: %s" % (name, e))
+                    data = RMAPIClientErrors.CALL
+                with lock:
+                    results[key] = data
+
+        threads = [threading.Thread(target = worker) for i in xrange(max(1, min(concurrency, len(jobs))))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        snapshot = {"timestamp": start, "elapsed": time.time() - start, "data": {}, "errors": {}}
+        for key, data in results.iteritems():
+            if RMAPIClientErrors.isError(data):
+                snapshot["errors"][key] = data
+            else:
+                snapshot["data"][key] = data
+
+        previous = self.state.lastSnapshot
+        self.state.lastSnapshot = snapshot
+
+        if not delta:
+            return snapshot
+
+        # Calls that failed now keep their previous result for the next delta
+        if previous is not None:
+            for key in snapshot["errors"]:
+                if key in previous["data"]:
+                    snapshot["data"].setdefault(key, previous["data"][key])
+
+        result = copy.copy(snapshot)
+        result["data"] = {}
+        result["unchanged"] = []
+        result["since"] = previous["timestamp"] if previous is not None else None
+        for key, data in snapshot["data"].iteritems():
+            if key in snapshot["errors"]:
+                continue
+            if previous is not None and previous["data"].get(key, None) == data:
+                result["unchanged"].append(key)
+            else:
+                result["data"][key] = data
+        return result
+
     def getAllMethods(self):
         """
         Returns all methods from all submodules. This is used in RMRules to build actions.
@@ -0,0 +1,206 @@
+# Copyright (c) 2016 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Ciprian Misaila <ciprian.misaila@mini-box.com>
+
+import threading, Queue, random, time
+
+from rmAPIClient import *
+
+
+class RMAPIClientFleetResult(dict):
+    """
+    Results of a fleet call: host (or "host:port") -> returned data. Hosts that failed (after retries) or didn't answer in time have
+    a RMAPIClientErrors value and are also listed in errors.
+    """
+    def __init__(self):
+        dict.__init__(self)
+        self.errors = {}
+        self.elapsed = 0
+
+    def succeeded(self):
+        return dict((host, data) for host, data in self.iteritems() if host not in self.errors)
+
+
+class RMAPIClientFleetCall(object):
+    """
+    Stands for a submodule or method of RMAPIClient (fleet.zones, fleet.zones.get, fleet.provision.wifi.get).
+    Calling it runs the method on all the fleet hosts.
+    """
+    def __init__(self, fleet, path):
+        self.__fleet = fleet
+        self.__path = path
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return RMAPIClientFleetCall(self.__fleet, self.__path + [name])
+
+    def __call__(self, *args, **kwargs):
+        return self.__fleet.call(self.__path, args, kwargs)
+
+
+class RMAPIClientFleet(object):
+    """
+    Runs RMAPIClient calls on many RainMachine devices at once, with the same submodules and methods:
+
+        fleet = RMAPIClientFleet(["192.168.1.10", ("192.168.1.11", "18080")], port="8080")
+        fleet.auth.login("admin", True)
+        zones = fleet.zones.get()           # {"192.168.1.10": {"zones": [...]}, ...}
+        print zones.errors                  # hosts that failed
+
+    Calls are run by a pool of worker threads, with at most hostConcurrency calls at the same time for each device.
+    Requests that can't be sent or answered (RMAPIClientErrors.OPEN) are retried with an exponential backoff, POST
+    requests only when retryPOST is set. Replies with an HTTP error status (RMAPIClientErrors.HTTP) are not retried. The call returns when all hosts answered or after callTimeout seconds, hosts
+    without a result get RMAPIClientErrors.TIMEOUT.
+    """
+    def __init__(self, hosts, port = "8080", protocol = RMAPIClientProtocol.HTTPS, workers = 32, hostConcurrency = 1,
+                 timeout = 10, retries = 2, backoff = 0.5, callTimeout = None, retryPOST = False):
+        self.hosts = []         # names used in results: host or "host:port" when the port is given for the host
+        self.addresses = {}     # name -> (host, port)
+        for host in hosts:
+            if isinstance(host, (tuple, list)):
+                name = "%s:%s" % tuple(host)
+                address = (host[0], str(host[1]))
+            else:
+                name = host
+                address = (host, str(port))
+            self.hosts.append(name)
+            self.addresses[name] = address
+
+        self.protocol = protocol
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.callTimeout = callTimeout
+        self.retryPOST = retryPOST
+
+        self.__clients = {}
+        self.__hostLocks = dict((host, threading.Semaphore(hostConcurrency)) for host in self.hosts)
+        self.__clientsLock = threading.Lock()
+        self.__queue = Queue.Queue()
+        self.__workers = []
+
+        for i in xrange(max(1, min(workers, len(self.hosts) * hostConcurrency))):
+            worker = threading.Thread(target = self.__run, name = "RMAPIClientFleet-%d" % i)
+            worker.daemon = True
+            worker.start()
+            self.__workers.append(worker)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return RMAPIClientFleetCall(self, [name])
+
+    def client(self, host):
+        """
+        Returns the RMAPIClient of a host, created on first use (it asks the device for its API version)
+        """
+        with self.__clientsLock:
+            client = self.__clients.get(host, None)
+            if client is not None:
+                return client
+
+        address, port = self.addresses[host]
+        client = RMAPIClient(address, port, self.protocol, self.timeout)
+        with self.__clientsLock:
+            return self.__clients.setdefault(host, client)
+
+    def call(self, path, args = (), kwargs = None, hosts = None):
+        """
+        Calls the method with the given path (["zones", "get"]) on each host and returns a RMAPIClientFleetResult
+        """
+        if hosts is None:
+            hosts = self.hosts
+
+        result = RMAPIClientFleetResult()
+        pending = [len(hosts)]
+        done = threading.Condition()
+        start = time.time()
+
+        def finished(host, data):
+            with done:
+                if host in result:
+                    return
+                result[host] = data
+                if RMAPIClientErrors.isError(data):
+                    result.errors[host] = data
+                pending[0] -= 1
+                if pending[0] == 0:
+                    done.notify()
+
+        for host in hosts:
+            self.__queue.put((host, path, args, kwargs or {}, finished))
+
+        with done:
+            deadline = None if self.callTimeout is None else start + self.callTimeout
+            while pending[0] > 0:
+                if deadline is None:
+                    done.wait(1)
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                done.wait(remaining)
+
+            for host in hosts:
+                if host not in result:
+                    result[host] = result.errors[host] = RMAPIClientErrors.TIMEOUT
+                    log.error("Fleet: %s didn't answer %s in time" % (host, ".".join(path)))
+
+        result.elapsed = time.time() - start
+        return result
+
+    def close(self):
+        for worker in self.__workers:
+            self.__queue.put(None)
+        for worker in self.__workers:
+            worker.join()
+        self.__workers = []
+
+    def __run(self):
+        while True:
+            job = self.__queue.get()
+            if job is None:
+                break
+
+            host, path, args, kwargs, finished = job
+            with self.__hostLocks[host]:
+                data = self.__callWithRetries(host, path, args, kwargs)
+            finished(host, data)
+
+    def __callWithRetries(self, host, path, args, kwargs):
+        attempt = 0
+        while True:
+            try:
+                client = self.client(host)
+                if client.rest.apiversion is None:
+                    # Device not reachable yet, nothing was sent for this call
+                    data = RMAPIClientErrors.OPEN
+                    retry = True
+                else:
+                    method = client
+                    for name in path:
+                        method = getattr(method, name)
+                    data = method(*args, **kwargs)
+                    retry = self.retryPOST or client.rest.lastRequestType == "GET"
+            except Exception, e:
+                log.error("Fleet: %s %s failed: %s" % (host, ".".join(path), e))
+                return RMAPIClientErrors.CALL
+
+            if data is not RMAPIClientErrors.OPEN or attempt >= self.retries or not retry:
+                return data
+
+            attempt += 1
+            delay = self.backoff * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+            log.info("Fleet: %s %s failed, retry %d in %.1f seconds" % (host, ".".join(path), attempt, delay))
+            time.sleep(delay)
+
+
+if __name__ == "__main__":
+    fleet = RMAPIClientFleet([("127.0.0.1", "18080"), ("127.0.0.2", "18080")], protocol=RMAPIClientProtocol.HTTP, timeout=5)
+    zones = fleet.zones.get()
+    print "Zones: %s" % zones
+    print "Errors: %s" % zones.errors
+    print "Queue: %s" % fleet.watering.getqueue().succeeded()
+    fleet.close()
@@ -13,15 +13,18 @@ class RMAPIClientMixer(RMAPIClientCalls):
         RMAPIClientCalls.__init__(self, restHandler)
         self.baseUrl = "mixer"
 
-    def get(self, dateStr = None, days = 30):
+    def get(self, dateStr = None, days = 30, stream = False):
         """
         Returns RainMachine weather mixer data. If dateStr (YYYY-MM-DD) is specified it returns results
-        from that date for specified number of days (default 30 days)
+        from that date for specified number of days (default 30 days). With stream=True it returns an iterable
+        RMAPIClientStream of the daily values decoded while they are received.
         """
         url = self.baseUrl
         if dateStr is not None:
             url += "/" + dateStr + "/" + str(days)
 
+        if stream:
+            return self.STREAM(url, ["mixerData", "*", "dailyValues"])
         return self.GET(url)
 
 # Test only works on localhost which doesn't require auth
@@ -25,9 +25,10 @@ class RMAPIClientParsers(RMAPIClientCalls):
 
         return self.GET(url)
 
-    def getdata(self, id, dateStr = None, days = None):
+    def getdata(self, id, dateStr = None, days = None, stream = False):
         """
-        Returns weather data from the specified parser
+        Returns weather data from the specified parser. With stream=True it returns an iterable RMAPIClientStream
+        of the daily values decoded while they are received.
         """
         url = self.baseUrl + "/" + str(id) + "/data/"
 
@@ -36,6 +37,8 @@ class RMAPIClientParsers(RMAPIClientCalls):
             if days is not None:
                 url += "/" + str(days)
 
+        if stream:
+            return self.STREAM(url, ["parserData", "*", "dailyValues"])
         return self.GET(url)
 
     def activate(self, id, enabled = True):
@@ -3,7 +3,7 @@
 # Authors: Nicu Pavel <npavel@mini-box.com>
 #          Ciprian Misaila <ciprian.misaila@mini-box.com>
 
-import urllib2, os, ssl, json
+import httplib, socket, os, ssl, json, re, time, threading
 from RMUtilsFramework.rmLogging import log
 
 class RMAPIClientProtocol:
@@ -28,6 +28,7 @@ class RMAPIClientCalls(object):
         self.GET = restHandler.get
         self.POST = restHandler.post
         self.REST = restHandler.rest
+        self.STREAM = restHandler.stream
 
     @classmethod
     def callList(cls):
@@ -43,6 +44,260 @@ class RMAPIClientErrors:
     JSON    = {"statusCode": 902, "message": "Can't parse JSON"}
     ID      = {"statusCode": 903, "message": "No ID specified"}
     PARAMS  = {"statusCode": 904, "message": "No parameters specified"}
+    TIMEOUT = {"statusCode": 905, "message": "No reply in time"}
+    CALL    = {"statusCode": 906, "message": "Call failed with an exception"}
+    HTTP    = {"statusCode": 907, "message": "HTTP error status"}
+
+    @staticmethod
+    def isError(data):
+        return isinstance(data, dict) and data.get("statusCode", 0) >= 900
+
+
+class RMAPIClientSessionPool(object):
+    """
+    Keeps the HTTP(S) connections to RainMachine devices open between calls (HTTP/1.1 keep-alive). Connections are
+    shared by all clients of the same protocol/host/port, at most maxIdle connections per host are kept.
+    """
+    def __init__(self, maxIdle = 4):
+        self.maxIdle = maxIdle
+        self.__lock = threading.Lock()
+        self.__idle = {} # key=(protocol, host, port), value=list of connections
+
+    def acquire(self, protocol, host, port, context = None, timeout = None):
+        """
+        Returns (connection, reused). The connection must be given back with release() after the response was read.
+        """
+        key = (protocol, host, port)
+        with self.__lock:
+            connections = self.__idle.get(key, None)
+            if connections:
+                connection = connections.pop()
+                connection.timeout = timeout
+                if connection.sock is not None:
+                    connection.sock.settimeout(timeout)
+                return connection, True
+
+        if timeout is None:
+            timeout = socket._GLOBAL_DEFAULT_TIMEOUT
+
+        if protocol == RMAPIClientProtocol.HTTPS:
+            if context is not None:
+                return httplib.HTTPSConnection(host, int(port), timeout=timeout, context=context), False
+            return httplib.HTTPSConnection(host, int(port), timeout=timeout), False
+        return httplib.HTTPConnection(host, int(port), timeout=timeout), False
+
+    def release(self, protocol, host, port, connection):
+        key = (protocol, host, port)
+        with self.__lock:
+            connections = self.__idle.setdefault(key, [])
+            if len(connections) < self.maxIdle:
+                connections.append(connection)
+                return
+        connection.close()
+
+    def clear(self):
+        with self.__lock:
+            idle = self.__idle
+            self.__idle = {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+globalSessionPool = RMAPIClientSessionPool()
+
+
+class RMAPIClientCache(object):
+    """
+    TTL cache for the read-mostly GET calls (zones, programs, parsers, global restrictions and mixer data).
+    The response body is kept and decoded on each hit so callers can change the returned data. A POST to a resource
+    drops the cached responses of that resource and of the resources it changes (see invalidates).
+    """
+    # (apiCall pattern, resource, seconds)
+    cachedCalls = [
+        (re.compile(r"^zone(/\d+)?$"), "zone", 10),
+        (re.compile(r"^program(/\d+)?$"), "program", 30),
+        (re.compile(r"^parser(/\d+)?$"), "parser", 60),
+        (re.compile(r"^restrictions/global$"), "restrictions", 60),
+        (re.compile(r"^mixer(/[\d-]+/\d+)?$"), "mixer", 300)
+    ]
+
+    # POSTs to the key resource change the listed resources, None clears the whole cache
+    invalidates = {
+        "zone": ["zone"],
+        "program": ["program", "zone"],
+        "watering": ["zone", "program"],
+        "parser": ["parser", "mixer"],
+        "restrictions": ["restrictions"],
+        "provision": None
+    }
+
+    def __init__(self, enabled = True):
+        self.enabled = enabled
+        self.entries = {} # key=apiCall, value=(resource, expire timestamp, body)
+        self.hits = 0
+        self.misses = 0
+        self.__lock = threading.Lock()
+
+    def getResource(self, apiCall):
+        """
+        Returns (resource, ttl) for a cached call or (None, None)
+        """
+        for pattern, resource, ttl in RMAPIClientCache.cachedCalls:
+            if pattern.match(apiCall):
+                return resource, ttl
+        return None, None
+
+    def get(self, apiCall):
+        if not self.enabled:
+            return None
+        with self.__lock:
+            entry = self.entries.get(apiCall, None)
+            if entry is not None and entry[1] > time.time():
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+        return None
+
+    def set(self, apiCall, resource, ttl, body):
+        if self.enabled:
+            with self.__lock:
+                self.entries[apiCall] = (resource, time.time() + ttl, body)
+
+    def invalidate(self, apiCall):
+        resource = apiCall.split("/", 1)[0]
+        resources = RMAPIClientCache.invalidates.get(resource, [resource])
+        with self.__lock:
+            if resources is None:
+                self.entries.clear()
+            else:
+                for key in [key for key, entry in self.entries.iteritems() if entry[0] in resources]:
+                    del self.entries[key]
+
+    def clear(self):
+        with self.__lock:
+            self.entries.clear()
+
+
+class RMAPIClientJSONStream(object):
+    """
+    Incremental JSON decoder: reads a JSON document from a file like object in chunks and yields the elements of the
+    array found at path, each decoded with json.loads when its closing bracket is read. Only one element is kept in
+    memory. Path elements are object keys or "*" for any element of an array:
+
+        ["waterLog", "days"]                {"waterLog": {"days": [day, day, ...]}}
+        ["mixerData", "*", "dailyValues"]   {"mixerData": [{"dailyValues": [values, ...]}, ...]}
+
+    Array elements that are not objects or arrays are skipped.
+    """
+    # Strings are matched whole so brackets inside them are skipped, a lone quote is a string not read completely yet
+    token = re.compile(r'"(?:[^"\\]|\\.)*"|[{}\[\]:]|"', re.S)
+    elementToken = re.compile(r'"(?:[^"\\]|\\.)*"|[{}\[\]]|"', re.S)
+
+    def __init__(self, fileObject, path, chunkSize = 65536):
+        self.fileObject = fileObject
+        self.path = [None] + list(path) # None is the key of the document root
+        self.chunkSize = chunkSize
+        self.bytesRead = 0
+
+    def __iter__(self):
+        token = RMAPIClientJSONStream.token
+        elementToken = RMAPIClientJSONStream.elementToken
+
+        buffer = ""
+        position = 0
+        keys = []               # key in the parent container of each open container ("*" in arrays)
+        kinds = []              # "{" or "[" for each open container
+        lastString = None
+        nextKey = None
+        atPath = False          # the innermost open container is the array at path
+        elementStart = None     # offset of the element being read
+        elementDepth = 0
+
+        while True:
+            chunk = self.fileObject.read(self.chunkSize)
+            if not chunk:
+                break
+            self.bytesRead += len(chunk)
+            buffer += chunk
+
+            while True:
+                if elementStart is None:
+                    match = token.search(buffer, position)
+                else:
+                    match = elementToken.search(buffer, position)
+                if match is None:
+                    position = len(buffer)
+                    break
+
+                char = match.group()
+                if char[0] == '"':
+                    if len(char) == 1:
+                        position = match.start() # string continues in the next chunk
+                        break
+                    lastString = char
+                    position = match.end()
+                    continue
+
+                index = match.start()
+                position = index + 1
+
+                if elementStart is not None:
+                    # Inside an element, only the nesting is followed
+                    if char == "{" or char == "[":
+                        elementDepth += 1
+                    else:
+                        elementDepth -= 1
+                        if elementDepth == 0:
+                            yield json.loads(buffer[elementStart:position])
+                            elementStart = None
+                    continue
+
+                if char == "{" or char == "[":
+                    if atPath:
+                        elementStart = index
+                        elementDepth = 1
+                        continue
+                    if not kinds:
+                        key = None
+                    elif kinds[-1] == "[":
+                        key = "*"
+                    else:
+                        key = nextKey
+                    keys.append(key)
+                    kinds.append(char)
+                    atPath = char == "[" and keys == self.path
+                elif char == "}" or char == "]":
+                    if keys:
+                        keys.pop()
+                        kinds.pop()
+                    atPath = bool(kinds) and kinds[-1] == "[" and keys == self.path
+                elif char == ":":
+                    nextKey = json.loads(lastString)
+
+            # Keep only the unread data and the element being read
+            start = position if elementStart is None else elementStart
+            if start > 0:
+                buffer = buffer[start:]
+                position -= start
+                if elementStart is not None:
+                    elementStart = 0
+
+
+class RMAPIClientStream(object):
+    """
+    Result of a streamed call: iterate it to get the elements as they are received. If the request fails nothing is
+    returned and error is set to a RMAPIClientErrors value.
+    """
+    def __init__(self, restHandler, apiCall, path, chunkSize):
+        self.restHandler = restHandler
+        self.apiCall = apiCall
+        self.path = path
+        self.chunkSize = chunkSize
+        self.error = None
+        self.bytesRead = 0
+
+    def __iter__(self):
+        return self.restHandler._streamElements(self)
 
 
 class RMAPIClientREST(object):
@@ -59,47 +314,90 @@ class RMAPIClientREST(object):
     def rest(self, type, apiCall, data = None, isBinary = False, extraHeaders = None,  asJSON = True):
         return self.__rest(type, apiCall, data, isBinary, extraHeaders, self._majorversion, asJSON)
 
-    def __rest(self, type, apiCall, data = None, isBinary = False, extraHeaders = None, majorVersion="", asJSON = True):
-
-        protocol = RMAPIClientProtocol.getAsString(self._protocol)
+    def stream(self, apiCall, path, chunkSize = 65536):
+        """
+        GET call that decodes the reply while it is received, see RMAPIClientJSONStream for path.
+        """
+        return RMAPIClientStream(self, apiCall, path, chunkSize)
 
-        apiUrl = protocol + self._host + ":" + self._port + "/api/" + majorVersion + "/"
+    def _streamElements(self, stream):
+        path = "/api/" + self._majorversion + "/" + stream.apiCall + self._tokenQuery
+        headers = {"Content-type": "text/plain", "User-Agent": "RMAPIClient"}
 
-        if self.token is None:
-            url = apiUrl + apiCall
-        else:
-            url = apiUrl + apiCall + "?access_token=" + self.token
+        log.info("REST: GET : %s%s:%s%s (stream)" % (RMAPIClientProtocol.getAsString(self._protocol), self._host, self._port, path))
+        self.__local.lastRequestType = "GET"
 
+        connection = None
+        completed = False
         try:
-            req = urllib2.Request(url)
-            req.get_method = lambda: type # Force GET/POST depending on type
-        except:
-            return RMAPIClientErrors.REQ
+            connection, response = self.__request("GET", path, None, headers, False)
+            if response.status >= 400:
+                log.error("Cannot OPEN URL: HTTP Error %d" % response.status)
+                stream.error = RMAPIClientErrors.HTTP
+                return
 
-        if data is not None:
-            if isBinary:
-                req.add_data(data=data)
-            else:
-                req.add_data(data=json.dumps(data))
+            decoder = RMAPIClientJSONStream(response, stream.path, stream.chunkSize)
+            try:
+                for element in decoder:
+                    stream.bytesRead = decoder.bytesRead
+                    yield element
+            except ValueError, e:
+                log.info("Cannot convert reply to JSON: %s" % e)
+                stream.error = RMAPIClientErrors.JSON
+                return
+
+            stream.bytesRead = decoder.bytesRead
+            completed = True
+        except (httplib.HTTPException, socket.error), e:
+            log.error("Cannot OPEN URL: %s" % e)
+            stream.error = RMAPIClientErrors.OPEN
+        finally:
+            if connection is not None:
+                if completed and not response.will_close:
+                    self.sessionPool.release(self._protocol, self._host, self._port, connection)
+                else:
+                    connection.close()
+
+    def __rest(self, type, apiCall, data = None, isBinary = False, extraHeaders = None, majorVersion="", asJSON = True):
 
-        req.add_header("Content-type", "text/plain")
-        req.add_header('User-Agent', "RMAPIClient")
+        path = "/api/" + majorVersion + "/" + apiCall + self._tokenQuery
 
+        # Read-mostly calls are answered from cache, POSTs drop the cached data they change
+        cacheResource = None
+        if type == "GET" and asJSON and data is None and extraHeaders is None:
+            cacheResource, cacheTTL = self.cache.getResource(apiCall)
+            if cacheResource is not None:
+                cached = self.cache.get(apiCall)
+                if cached is not None:
+                    log.debug("REST: %s : %s (cached)" % (type, apiCall))
+                    return json.loads(cached)
+        elif type != "GET":
+            self.cache.invalidate(apiCall)
+
+        if data is not None and not isBinary:
+            data = json.dumps(data)
+
+        headers = {"Content-type": "text/plain", "User-Agent": "RMAPIClient"}
         if extraHeaders is not None:
             for header in extraHeaders:
-                req.add_header(header)
+                headers[header[0]] = header[1]
+
+        log.info("REST: %s : %s%s:%s%s" % (type, RMAPIClientProtocol.getAsString(self._protocol), self._host, self._port, path))
+        self.__local.lastRequestType = type
 
         try:
-            log.info("REST: %s : %s" % (req.get_method(), req.get_full_url()))
-            if self.context is not None:
-                r = urllib2.urlopen(req, context=self.context)
-            else:
-                r = urllib2.urlopen(req)
-            data = r.read()
+            status, data = self.__request(type, path, data, headers)
         except Exception, e:
             log.error("Cannot OPEN URL: %s" % e)
             return RMAPIClientErrors.OPEN
 
+        if status >= 400:
+            log.error("Cannot OPEN URL: HTTP Error %d" % status)
+            return RMAPIClientErrors.HTTP
+
+        if cacheResource is not None and status == 200:
+            self.cache.set(apiCall, cacheResource, cacheTTL, data)
+
         if asJSON:
             try:
                 data = json.loads(data)
@@ -110,6 +408,35 @@ class RMAPIClientREST(object):
 
         return  data
 
+    def __request(self, type, path, body, headers, read = True):
+        """
+        Sends the request on a pooled connection and returns (status, body). A kept-alive connection may have been
+        closed by the device since it was used, in that case the request is sent again on a new connection (POSTs only
+        when the device didn't answer at all). With read=False it returns (connection, response) without reading the
+        body, the connection must be released or closed by the caller.
+        """
+        while True:
+            connection, reused = self.sessionPool.acquire(self._protocol, self._host, self._port, self.context, self.timeout)
+            try:
+                connection.request(type, path, body, headers)
+                response = connection.getresponse()
+                if not read:
+                    return connection, response
+                data = response.read()
+            except (httplib.HTTPException, socket.error), e:
+                connection.close()
+                if reused and (type == "GET" or isinstance(e, httplib.BadStatusLine)):
+                    log.debug("REST: connection to %s closed (%s), retrying" % (self._host, e))
+                    continue
+                raise
+
+            if response.will_close:
+                connection.close()
+            else:
+                self.sessionPool.release(self._protocol, self._host, self._port, connection)
+
+            return response.status, data
+
     def __getApiVer(self):
         data = self.__rest("GET", "apiVer")
         if data is not None:
@@ -125,8 +452,10 @@ class RMAPIClientREST(object):
 
         return None
 
-    def __init__(self, host="127.0.0.1", port="8080", protocol=RMAPIClientProtocol.HTTPS):
-        self.token = None
+    def __init__(self, host="127.0.0.1", port="8080", protocol=RMAPIClientProtocol.HTTPS, timeout=None):
+        self._token = None
+        self._tokenQuery = ""
+        self.timeout = timeout
         self._host = host
         self._port = port
         self._protocol = protocol
@@ -135,12 +464,31 @@ class RMAPIClientREST(object):
         self._minorversion = ""
         self._patchversion = ""
         self.context = self.__getContext()
+        self.sessionPool = globalSessionPool
+        self.cache = RMAPIClientCache()
+        self.__local = threading.local()
         self.apiversion = self.__getApiVer()
 
+    @property
+    def token(self):
+        return self._token
+
+    @token.setter
+    def token(self, value):
+        self._token = value
+        self._tokenQuery = "" if value is None else "?access_token=" + value
+
+    @property
+    def lastRequestType(self):
+        """
+        GET/POST type of the last request sent by the calling thread
+        """
+        return getattr(self.__local, "lastRequestType", None)
+
     @property
     def apiversion(self):
         if self._apiversion is None:
-            self._apiversion = self.__getApiVer()
+            self.apiversion = self.__getApiVer()
 
         return self._apiversion
 
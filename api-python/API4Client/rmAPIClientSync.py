@@ -0,0 +1,336 @@
+# Copyright (c) 2016 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Ciprian Misaila <ciprian.misaila@mini-box.com>
+
+import os, re, json, datetime, threading
+
+from rmAPIClient import *
+
+
+class RMAPIClientSyncDataset(object):
+    """
+    History call that is synced: method is the client "submodule.method" taking dateStr and days, records the reply
+    key with the history (the first list in the reply when None) and dayColumn the column with the day of each row
+    (found from the column names when None).
+    """
+    def __init__(self, name, method, records = None, kwargs = None, dayColumn = None):
+        self.name = name
+        self.method = method
+        self.records = records
+        self.kwargs = kwargs or {}
+        self.dayColumn = dayColumn
+
+
+class RMAPIClientSyncStore(object):
+    """
+    Append-only columnar files of one device: directory/<dataset>/<column>.jsonl with one JSON value per row and
+    line, and directory/state.json with the synced days (high-water mark), rows and column file sizes of each
+    dataset. The state is written after the columns, data appended by an interrupted sync is cut on the next open.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.stateFile = os.path.join(directory, "state.json")
+        self.state = {"datasets": {}}
+        self.__checked = set()
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        if os.path.exists(self.stateFile):
+            with open(self.stateFile) as f:
+                self.state = json.load(f)
+
+    def dataset(self, name):
+        """
+        Returns the state of a dataset: {"lastDay": "YYYY-MM-DD" or None, "rows": 0, "columns": [], "sizes": {}}
+        """
+        dataset = self.state["datasets"].setdefault(name, {"lastDay": None, "rows": 0, "columns": [], "sizes": {}})
+        if name not in self.__checked:
+            self.__truncate(name, dataset)
+            self.__checked.add(name)
+        return dataset
+
+    def lastDay(self, name):
+        return self.dataset(name)["lastDay"]
+
+    def append(self, name, rows, lastDay):
+        """
+        Appends rows (dicts column -> value) to the dataset and moves its high-water mark to lastDay. Columns seen for the
+        first time are filled with null for the rows already stored.
+        """
+        dataset = self.dataset(name)
+        datasetDir = os.path.join(self.directory, name)
+        if not os.path.exists(datasetDir):
+            os.makedirs(datasetDir)
+
+        columns = dataset["columns"]
+        known = set(columns)
+        for row in rows:
+            for column in row:
+                if column not in known:
+                    known.add(column)
+                    columns.append(column)
+
+        for column in columns:
+            path = self.__columnPath(name, column)
+            # A column without a recorded size has no committed rows, anything in its file is from an interrupted sync
+            with open(path, "ab" if column in dataset["sizes"] else "wb") as f:
+                if column not in dataset["sizes"]:
+                    f.write("null\n" * dataset["rows"])
+                f.write("".join([json.dumps(row.get(column, None)) + "\n" for row in rows]))
+                f.flush()
+                os.fsync(f.fileno())
+                dataset["sizes"][column] = f.tell()
+
+        dataset["rows"] += len(rows)
+        dataset["lastDay"] = lastDay
+        self.__saveState()
+
+    def read(self, name, columns = None):
+        """
+        Returns the stored columns of a dataset: {column: [values]}
+        """
+        dataset = self.dataset(name)
+        result = {}
+        for column in columns or dataset["columns"]:
+            if column not in dataset["sizes"]:
+                result[column] = [None] * dataset["rows"]
+                continue
+            with open(self.__columnPath(name, column), "rb") as f:
+                result[column] = [json.loads(line) for line in f.read(dataset["sizes"][column]).splitlines()]
+        return result
+
+    def __columnPath(self, name, column):
+        return os.path.join(self.directory, name, re.sub(r"[^\w.-]", "_", column) + ".jsonl")
+
+    def __truncate(self, name, dataset):
+        paths = set()
+        for column, size in dataset["sizes"].iteritems():
+            path = self.__columnPath(name, column)
+            paths.add(path)
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                log.info("Sync: removing data of an interrupted sync from %s" % path)
+                with open(path, "r+b") as f:
+                    f.truncate(size)
+
+        # Columns first created by an interrupted sync
+        datasetDir = os.path.join(self.directory, name)
+        if os.path.isdir(datasetDir):
+            for fileName in os.listdir(datasetDir):
+                path = os.path.join(datasetDir, fileName)
+                if fileName.endswith(".jsonl") and path not in paths:
+                    log.info("Sync: removing column of an interrupted sync %s" % path)
+                    os.remove(path)
+
+    def __saveState(self):
+        tempFile = self.stateFile + ".tmp"
+        with open(tempFile, "w") as f:
+            json.dump(self.state, f, indent = 4, sort_keys = True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tempFile, self.stateFile)
+
+
+class RMAPIClientSync(object):
+    """
+    Incremental export of the device history to RMAPIClientSyncStore files, one directory for each device:
+
+        sync = RMAPIClientSync("/var/lib/rmsync")
+        print sync.syncDevice("garden", client)
+        print sync.syncFleet(fleet)
+
+    Only days up to yesterday (device date) are synced, they don't change anymore. The first sync gets initialDays
+    days, the next ones request only the days after the last synced day, in windows of at most maxDays days.
+    Nested replies (days -> programs -> zones -> cycles) are flattened to one row for each record with the fields of
+    the parent records, named by their path ("days.programs.zones.uid").
+    """
+    Datasets = [
+        RMAPIClientSyncDataset("waterlog", "watering.getlog", "waterLog", {"withDetails": True}, "waterLog.days.date"),
+        RMAPIClientSyncDataset("past", "watering.getpast", "pastValues"),
+        RMAPIClientSyncDataset("available", "watering.getaw"),
+        RMAPIClientSyncDataset("mixer", "mixer.get", "mixerData", None, "mixerData.dailyValues.day")
+    ]
+
+    DayFields = ["date", "day", "dateTime", "dateTimeStr"]
+
+    def __init__(self, directory, datasets = None, initialDays = 30, maxDays = 30):
+        self.directory = directory
+        self.datasets = datasets or RMAPIClientSync.Datasets
+        self.initialDays = initialDays
+        self.maxDays = maxDays
+
+    def store(self, device):
+        return RMAPIClientSyncStore(os.path.join(self.directory, re.sub(r"[^\w.-]", "_", device)))
+
+    def syncDevice(self, device, client, until = None):
+        """
+        Syncs the datasets of a device up to until (datetime.date, default yesterday on device). Returns for each
+        dataset {"rows", "requests", "lastDay", "error"}. A dataset that fails keeps its last synced day.
+        """
+        if until is None:
+            until = self.__deviceYesterday(client)
+
+        store = self.store(device)
+        results = {}
+        for dataset in self.datasets:
+            results[dataset.name] = self.__syncDataset(store, dataset, client, until)
+        return results
+
+    def syncFleet(self, fleet, concurrency = 8, until = None):
+        """
+        Syncs all hosts of a RMAPIClientFleet (with their fleet names as device names), returns {host: results}
+        """
+        hosts = list(fleet.hosts)
+        results = {}
+        lock = threading.Lock()
+
+        def worker():
+            while True:
+                with lock:
+                    if not hosts:
+                        return
+                    host = hosts.pop(0)
+                try:
+                    result = self.syncDevice(host, fleet.client(host), until)
+                except Exception, e:
+                    log.error("Sync: %s failed: %s" % (host, e))
+                    result = RMAPIClientErrors.CALL
+                with lock:
+                    results[host] = result
+
+        threads = [threading.Thread(target = worker) for i in xrange(max(1, min(concurrency, len(hosts))))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def __syncDataset(self, store, dataset, client, until):
+        result = {"rows": 0, "requests": 0, "lastDay": None, "error": None}
+
+        lastDay = store.lastDay(dataset.name)
+        if lastDay is None:
+            start = until - datetime.timedelta(days = self.initialDays - 1)
+        else:
+            start = RMAPIClientSync.parseDay(lastDay) + datetime.timedelta(days = 1)
+
+        submodule, method = dataset.method.split(".", 1)
+        call = getattr(getattr(client, submodule), method)
+
+        while start <= until:
+            days = min(self.maxDays, (until - start).days + 1)
+            end = start + datetime.timedelta(days = days - 1)
+
+            data = call(dateStr = start.strftime("%Y-%m-%d"), days = days, **dataset.kwargs)
+            result["requests"] += 1
+            if RMAPIClientErrors.isError(data):
+                log.error("Sync: %s from %s failed: %s" % (dataset.method, start, data))
+                result["error"] = data
+                break
+
+            rows = self.__rows(dataset, data, start, end)
+            store.append(dataset.name, rows, end.strftime("%Y-%m-%d"))
+            result["rows"] += len(rows)
+            start = end + datetime.timedelta(days = 1)
+
+        result["lastDay"] = store.lastDay(dataset.name)
+        return result
+
+    def __rows(self, dataset, data, start, end):
+        records = dataset.records
+        if records is None:
+            records = [key for key in sorted(data) if isinstance(data[key], list)][:1]
+            if not records:
+                return []
+            records = records[0]
+
+        rows = RMAPIClientSync.flatten(data.get(records, None), records)
+        dayColumn = dataset.dayColumn
+
+        result = []
+        for row in rows:
+            if dayColumn is None:
+                dayColumn = RMAPIClientSync.findDayColumn(row)
+            day = RMAPIClientSync.parseDay(row.get(dayColumn, None))
+            # Replies can have days outside the window (mixer forecast), they are synced in their window
+            if day is not None and start <= day <= end:
+                result.append(row)
+        return result
+
+    @staticmethod
+    def flatten(value, prefix = ""):
+        """
+        Returns the rows of a nested reply: scalar fields become columns, dicts are merged with their key as prefix and
+        each record of a list of dicts gets its own row with the fields of its parents. Lists of values are kept as
+        JSON strings.
+        """
+        if isinstance(value, list):
+            rows = []
+            for item in value:
+                rows.extend(RMAPIClientSync.flatten(item, prefix))
+            return rows
+
+        if not isinstance(value, dict):
+            return [{prefix: value}]
+
+        row = {}
+        children = []
+        for key, item in value.iteritems():
+            name = prefix + "." + key if prefix else key
+            if isinstance(item, dict):
+                itemRows = RMAPIClientSync.flatten(item, name)
+                if len(itemRows) == 1:
+                    row.update(itemRows[0])
+                else:
+                    children.append(itemRows)
+            elif isinstance(item, list) and item and all(isinstance(element, dict) for element in item):
+                children.append(RMAPIClientSync.flatten(item, name))
+            elif isinstance(item, list):
+                row[name] = json.dumps(item)
+            else:
+                row[name] = item
+
+        if not children:
+            return [row]
+
+        rows = []
+        for childRows in children:
+            for childRow in childRows:
+                childRow.update(row)
+                rows.append(childRow)
+        return rows
+
+    @staticmethod
+    def findDayColumn(row):
+        for field in RMAPIClientSync.DayFields:
+            for column in sorted(row, key = len):
+                if column == field or column.endswith("." + field):
+                    return column
+        return None
+
+    @staticmethod
+    def parseDay(value):
+        if not isinstance(value, basestring) or len(value) < 10:
+            return None
+        try:
+            return datetime.datetime.strptime(value[:10], "%Y-%m-%d").date()
+        except ValueError:
+            return None
+
+    def __deviceYesterday(self, client):
+        data = client.machine.gettime()
+        today = None
+        if not RMAPIClientErrors.isError(data):
+            today = RMAPIClientSync.parseDay(data.get("appDate", None))
+        if today is None:
+            log.info("Sync: cannot get the device date, using the local date")
+            today = datetime.date.today()
+        return today - datetime.timedelta(days = 1)
+
+
+if __name__ == "__main__":
+    client = RMAPIClient(host="127.0.0.1", port="18080", protocol=RMAPIClientProtocol.HTTP)
+    sync = RMAPIClientSync("/tmp/rmsync")
+    print sync.syncDevice("127.0.0.1_18080", client)
+    print sync.store("127.0.0.1_18080").read("waterlog").keys()
@@ -50,9 +50,10 @@ class RMAPIClientWatering(RMAPIClientCalls):
             url += "/" + dateStr + "/" + str(days)
         return self.GET(url)
 
-    def getlog(self, withDetails = False, simulated = False, dateStr = None, days = 30):
+    def getlog(self, withDetails = False, simulated = False, dateStr = None, days = 30, stream = False):
         """
-        Returns the past watering log.
+        Returns the past watering log. With stream=True it returns an iterable RMAPIClientStream of the waterLog days
+        decoded while they are received.
         """
         url = self.baseUrl + "/log"
 
@@ -63,6 +64,8 @@ class RMAPIClientWatering(RMAPIClientCalls):
         if dateStr is not None:
             url += "/" + dateStr + "/" + str(days)
 
+        if stream:
+            return self.STREAM(url, ["waterLog", "days"])
         return self.GET(url)
 
     def stopall(self):
@@ -0,0 +1,44 @@
+# Copyright (c) 2016 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Ciprian Misaila <ciprian.misaila@mini-box.com>
+
+#
+# Offline check of the RMAPIClientSync column store: a sync interrupted after writing the columns and before
+# saving the state is retried and all columns must have the same rows.
+#
+
+import sys, shutil, tempfile
+
+from API4Client.rmAPIClientSync import RMAPIClientSyncStore
+
+class Interrupted(Exception):
+    pass
+
+def interrupt():
+    raise Interrupted()
+
+directory = tempfile.mkdtemp(prefix = "rmsync-")
+try:
+    store = RMAPIClientSyncStore(directory)
+    store.append("x", [{"a": 1}], "2016-01-01")
+
+    # Column b is first created by the interrupted batch
+    batch = [{"a": 2, "b": 20}, {"a": 3, "b": 30}]
+    store._RMAPIClientSyncStore__saveState = interrupt
+    try:
+        store.append("x", batch, "2016-01-02")
+    except Interrupted:
+        pass
+
+    # Retry after a restart
+    store = RMAPIClientSyncStore(directory)
+    store.append("x", batch, "2016-01-02")
+    data = RMAPIClientSyncStore(directory).read("x")
+finally:
+    shutil.rmtree(directory, ignore_errors = True)
+
+print data
+if data != {"a": [1, 2, 3], "b": [None, 20, 30]}:
+    print "*** columns out of alignment after an interrupted sync"
+    sys.exit(1)
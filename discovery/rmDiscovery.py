@@ -0,0 +1,327 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+import os
+import sys
+import time
+import errno
+import fcntl
+import select
+import struct
+import logging
+import threading
+from socket import *
+from urlparse import urlparse
+
+
+ADVERTISE_PORT = 15800
+RESPONSE_PORT = 15900
+BROADCAST = '255.255.255.255'
+SCAN_INTERVAL = 20 # seconds between discover broadcasts
+SCAN_EXPIRE = 60 # a sprinkler is lost when it didn't answer for this many seconds
+
+SIOCGIFFLAGS = 0x8913
+SIOCGIFBRDADDR = 0x8919
+IFF_BROADCAST = 0x2
+IFF_UP = 0x1
+
+log = logging.getLogger("rmDiscovery")
+
+#-----------------------------------------------------------------------------------------------
+#
+# Broadcast address of each interface that is up (Linux), 255.255.255.255 only leaves on the
+# interface of the default route.
+#
+def getBroadcastAddresses():
+    addresses = [BROADCAST]
+    try:
+        interfaces = os.listdir("/sys/class/net")
+    except OSError:
+        return addresses
+
+    s = socket(AF_INET, SOCK_DGRAM)
+    try:
+        for interface in sorted(interfaces):
+            request = struct.pack("256s", interface[:15])
+            try:
+                flags = struct.unpack("H", fcntl.ioctl(s.fileno(), SIOCGIFFLAGS, request)[16:18])[0]
+                if not (flags & IFF_UP) or not (flags & IFF_BROADCAST):
+                    continue
+                address = inet_ntoa(fcntl.ioctl(s.fileno(), SIOCGIFBRDADDR, request)[20:24])
+            except IOError:
+                continue # no IPv4 address
+            if address not in addresses:
+                addresses.append(address)
+    finally:
+        s.close()
+    return addresses
+
+
+class RMDiscoveredSprinkler(object):
+    def __init__(self, mac, name, http, wizard, address):
+        self.mac = mac
+        self.name = name
+        self.http = http
+        self.wizard = wizard
+        self.address = address
+        self.firstSeen = self.lastSeen = time.time()
+
+    @property
+    def configured(self):
+        return self.wizard == "1"
+
+    def clientArgs(self):
+        """
+        Returns (host, port, https) of the sprinkler API from the advertised url
+        """
+        url = urlparse(self.http)
+        https = url.scheme != "http"
+        host = url.hostname or self.address
+        port = url.port or (443 if https else 80)
+        return host, str(port), https
+
+    def createClient(self, timeout = None):
+        """
+        Returns an API4Client RMAPIClient for this sprinkler, api-python must be in the python path.
+        """
+        from API4Client.rmAPIClient import RMAPIClient, RMAPIClientProtocol
+
+        host, port, https = self.clientArgs()
+        protocol = RMAPIClientProtocol.HTTPS if https else RMAPIClientProtocol.HTTP
+        return RMAPIClient(host, port, protocol, timeout)
+
+    def __repr__(self):
+        return "RMDiscoveredSprinkler(%s, %s, %s)" % (self.mac, self.name, self.http)
+
+    @staticmethod
+    def parse(data, address):
+        """
+        Parses a discover reply: proto||mac||name||http[||wizard] (wizard is missing on SPK1). Returns None if invalid.
+        """
+        props = data.split("||")
+        if len(props) > 4: # SPK2/3
+            proto, mac, name, http, wizard = props[:5]
+        elif len(props) == 4: # SPK 1
+            proto, mac, name, http = props
+            wizard = "1"
+        else:
+            return None
+        return RMDiscoveredSprinkler(mac, name, http, wizard, address)
+
+
+class RMDiscovery(object):
+    """
+    Discovers sprinklers on the LAN: the discover request is sent every interval seconds on the broadcast address
+    of each interface, the answers are kept by MAC and a sprinkler is removed when it didn't answer for ttl seconds.
+
+        discovery = RMDiscovery()
+        for sprinkler in discovery.discover(5):
+            client = sprinkler.createClient()
+
+        discovery.onFound = lambda sprinkler: ...       # also onUpdated and onLost
+        discovery.start()                               # or run() / events() in the current thread
+
+    Errors that don't stop the discovery (a broadcast that can't be sent, an invalid reply) are given to
+    onError(message), they are logged with the rmDiscovery logger when it is not set.
+    """
+
+    FOUND = "found"
+    UPDATED = "updated" # name, url, address or wizard changed
+    LOST = "lost"
+
+    def __init__(self, interval = SCAN_INTERVAL, ttl = SCAN_EXPIRE, broadcasts = None, advertisePort = ADVERTISE_PORT,
+                 responsePort = RESPONSE_PORT):
+        self.interval = interval
+        self.ttl = ttl
+        self.broadcasts = broadcasts
+        self.advertisePort = advertisePort
+        self.responsePort = responsePort
+
+        self.onFound = None
+        self.onUpdated = None
+        self.onLost = None
+        self.onError = None
+
+        self.__sprinklers = {}
+        self.__lock = threading.Lock()
+        self.__socket = None
+        self.__nextDiscover = 0
+        self.__running = False
+        self.__thread = None
+        self.__wakeupRead = self.__wakeupWrite = None
+
+    def open(self):
+        if self.__socket is not None:
+            return
+
+        if self.__wakeupRead is None:
+            self.__wakeupRead, self.__wakeupWrite = os.pipe()
+
+        # Same socket for sending and receiving, answers come on responsePort
+        s = socket(AF_INET, SOCK_DGRAM)
+        s.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+        s.setsockopt(SOL_SOCKET, SO_BROADCAST, 1)
+        s.bind(('', self.responsePort))
+        s.setblocking(0)
+        self.__socket = s
+
+    def close(self):
+        if self.__socket is not None:
+            self.__socket.close()
+            self.__socket = None
+        if self.__wakeupRead is not None:
+            os.close(self.__wakeupRead)
+            os.close(self.__wakeupWrite)
+            self.__wakeupRead = self.__wakeupWrite = None
+
+    def sprinklers(self):
+        with self.__lock:
+            return sorted(self.__sprinklers.values(), key = lambda sprinkler: sprinkler.name)
+
+    def sendDiscover(self):
+        broadcasts = self.broadcasts
+        if broadcasts is None:
+            broadcasts = getBroadcastAddresses()
+        for address in broadcasts:
+            try:
+                self.__socket.sendto('python discover', (address, self.advertisePort))
+            except error, e:
+                self.__error("Cannot send discover to %s: %s" % (address, e))
+        self.__nextDiscover = time.time() + self.interval
+
+    def poll(self, timeout = None):
+        """
+        Sends the discover request when due, waits at most timeout seconds (until the next discover when None) for
+        answers and returns the (event, sprinkler) changes. Callbacks are called from here.
+        """
+        self.open()
+        now = time.time()
+        if now >= self.__nextDiscover:
+            self.sendDiscover()
+
+        wait = max(0, min(self.__nextDiscover, self.__nextExpire()) - now)
+        if timeout is not None:
+            wait = min(wait, timeout)
+
+        try:
+            ready = select.select([self.__socket, self.__wakeupRead], [], [], wait)[0]
+        except select.error, e:
+            if e.args[0] != errno.EINTR:
+                raise
+            ready = []
+
+        if self.__wakeupRead in ready:
+            os.read(self.__wakeupRead, 512)
+
+        events = []
+        if self.__socket in ready:
+            events += self.__receive()
+        events += self.__expire()
+
+        for event, sprinkler in events:
+            callback = {RMDiscovery.FOUND: self.onFound, RMDiscovery.UPDATED: self.onUpdated, RMDiscovery.LOST: self.onLost}[event]
+            if callback is not None:
+                callback(sprinkler)
+        return events
+
+    def events(self, duration = None):
+        """
+        Iterator of (event, sprinkler), runs for duration seconds or until stop()
+        """
+        end = None if duration is None else time.time() + duration
+        if self.__thread is None:
+            self.__running = True # set by start() for the background thread
+        while self.__running:
+            timeout = None
+            if end is not None:
+                timeout = end - time.time()
+                if timeout <= 0:
+                    break
+            for event in self.poll(timeout):
+                yield event
+
+    def discover(self, duration = 5, repeat = 3):
+        """
+        One-shot discovery: sends the request repeat times during duration seconds and returns the sprinklers found
+        """
+        interval = self.interval
+        self.interval = float(duration) / repeat
+        self.__nextDiscover = 0
+        try:
+            for event in self.events(duration):
+                pass
+        finally:
+            self.interval = interval
+        return self.sprinklers()
+
+    def run(self):
+        for event in self.events():
+            pass
+
+    def start(self):
+        self.open()
+        self.__running = True
+        self.__thread = threading.Thread(target = self.run, name = "RMDiscovery")
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):
+        self.__running = False
+        if self.__wakeupWrite is not None:
+            os.write(self.__wakeupWrite, "x")
+        if self.__thread is not None and self.__thread is not threading.current_thread():
+            self.__thread.join()
+            self.__thread = None
+
+    def __receive(self):
+        events = []
+        while True:
+            try:
+                data, addr = self.__socket.recvfrom(1024)
+            except error, e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    break
+                raise
+
+            sprinkler = RMDiscoveredSprinkler.parse(data, addr[0])
+            if sprinkler is None:
+                if data != 'python discover': # our own broadcast
+                    self.__error("Cannot parse discover reply from %s: %r" % (addr[0], data))
+                continue
+
+            with self.__lock:
+                known = self.__sprinklers.get(sprinkler.mac, None)
+                if known is None:
+                    self.__sprinklers[sprinkler.mac] = sprinkler
+                    events.append((RMDiscovery.FOUND, sprinkler))
+                    continue
+
+                known.lastSeen = sprinkler.lastSeen
+                if (known.name, known.http, known.wizard, known.address) != (sprinkler.name, sprinkler.http, sprinkler.wizard, sprinkler.address):
+                    known.name, known.http, known.wizard, known.address = sprinkler.name, sprinkler.http, sprinkler.wizard, sprinkler.address
+                    events.append((RMDiscovery.UPDATED, known))
+        return events
+
+    def __error(self, message):
+        if self.onError is not None:
+            self.onError(message)
+        else:
+            log.warning(message)
+
+    def __nextExpire(self):
+        with self.__lock:
+            if not self.__sprinklers:
+                return sys.maxint
+            return min(sprinkler.lastSeen for sprinkler in self.__sprinklers.itervalues()) + self.ttl
+
+    def __expire(self):
+        events = []
+        now = time.time()
+        with self.__lock:
+            for mac, sprinkler in self.__sprinklers.items():
+                if sprinkler.lastSeen + self.ttl <= now:
+                    del self.__sprinklers[mac]
+                    events.append((RMDiscovery.LOST, sprinkler))
+        return events
@@ -0,0 +1,5 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
@@ -0,0 +1,179 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+#
+# Checks RMDailyAggregator against daily values computed from the full lists of observations: mean, min and max,
+# rain total, mean wind speed and the wind vector mean. The aggregator is saved and loaded again (a parser restart)
+# in the middle of each day and the size of its saved state is reported, it doesn't grow with the observations.
+# A day that started without observations is neither saved nor reported after a restart, an ended day that was
+# reported isn't reported again after a restart.
+#
+#   python RMBenchmarkFramework/rmAggregatorCheck.py [--days 3] [--observations 1440] [--verbose]
+#
+
+import os, sys, math, time, random, shutil, tempfile, argparse, logging
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")))
+
+from RMDataFramework.rmWeatherData import RMWeatherDataType
+from RMDataFramework.rmObservationAggregator import RMDailyAggregator, RMAggregateField, RMStatsAggregate, \
+    RMRainAggregate, RMWindAggregate
+from RMUtilsFramework.rmTimeUtils import rmGetStartOfDay
+from RMUtilsFramework.rmLogging import log
+
+Fields = [
+    RMAggregateField("temperature", RMStatsAggregate, mean = RMWeatherDataType.TEMPERATURE,
+                     min = RMWeatherDataType.MINTEMP, max = RMWeatherDataType.MAXTEMP),
+    RMAggregateField("rain", RMRainAggregate, total = RMWeatherDataType.RAIN),
+    RMAggregateField("wind", RMWindAggregate, speed = RMWeatherDataType.WIND)
+]
+
+##-----------------------------------------------------------------------------------------------------
+##
+##
+##
+def makeObservations(days, count):
+    start = rmGetStartOfDay(time.time()) - days * 86400
+    step = 86400.0 / count
+    observations = []
+    for day in xrange(days):
+        for i in xrange(count):
+            timestamp = start + day * 86400 + i * step + 1
+            temperature = 15 + 10 * math.sin(i * math.pi / count) + random.uniform(-1, 1)
+            rain = random.choice([0, 0, 0, 0.2, 0.5])
+            observations.append((timestamp, temperature, rain, random.uniform(0, 12), random.uniform(0, 360)))
+    return observations
+
+def reference(observations):
+    days = {}
+    for timestamp, temperature, rain, speed, direction in observations:
+        days.setdefault(rmGetStartOfDay(timestamp), []).append((temperature, rain, speed, direction))
+
+    result = {}
+    for day, values in days.iteritems():
+        temperatures = [value[0] for value in values]
+        east = sum(value[2] * math.sin(math.radians(value[3])) for value in values) / len(values)
+        north = sum(value[2] * math.cos(math.radians(value[3])) for value in values) / len(values)
+        result[day] = {
+            RMWeatherDataType.TEMPERATURE: sum(temperatures) / len(temperatures),
+            RMWeatherDataType.MINTEMP: min(temperatures),
+            RMWeatherDataType.MAXTEMP: max(temperatures),
+            RMWeatherDataType.RAIN: sum(value[1] for value in values),
+            RMWeatherDataType.WIND: sum(value[2] for value in values) / len(values),
+            "direction": math.degrees(math.atan2(east, north)) % 360,
+            "variance": sum((t - sum(temperatures) / len(temperatures)) ** 2 for t in temperatures) / (len(temperatures) - 1)
+        }
+    return result
+
+def aggregate(observations, stateFile):
+    aggregator = RMDailyAggregator(Fields, stateFile)
+    reported = {}
+    restarts = 0
+    stateSizes = []
+    lastDay = None
+
+    for timestamp, temperature, rain, speed, direction in observations:
+        day = rmGetStartOfDay(timestamp)
+        if day != lastDay:
+            lastDay = day
+            halfDay = day + 43200
+
+        if timestamp >= halfDay:
+            # Restart in the middle of the day: the day totals are loaded from the saved state
+            aggregator.save()
+            stateSizes.append(os.path.getsize(stateFile))
+            aggregator = RMDailyAggregator(Fields, stateFile)
+            halfDay = sys.maxint
+            restarts += 1
+
+        aggregator.add(timestamp, "temperature", temperature)
+        aggregator.add(timestamp, "rain", rain)
+        aggregator.add(timestamp, "wind", speed, direction)
+
+        for reportedDay in aggregator.report():
+            reported[reportedDay.day] = (reportedDay.observations(), reportedDay["wind"].direction, reportedDay["temperature"].variance)
+
+    return reported, restarts, stateSizes
+
+def checkEmptyDay(stateFile):
+    problems = []
+    now = time.time()
+    aggregator = RMDailyAggregator(Fields, stateFile)
+    aggregator.add(now - 86400, "temperature", 20)
+    aggregator.day(now)             # new day without observations
+    aggregator.save()
+
+    reported = RMDailyAggregator(Fields, stateFile).report()
+    if [day.day for day in reported] != [rmGetStartOfDay(now - 86400)]:
+        problems.append("empty day restored: %s" % [(day.day, day.lastTimestamp) for day in reported])
+    for day in reported:
+        if day.lastTimestamp is None:
+            problems.append("day %s reported without observations" % day.day)
+    return problems
+
+def checkReportedDay(stateFile):
+    problems = []
+    now = time.time()
+    aggregator = RMDailyAggregator(Fields, stateFile)
+    aggregator.add(now - 86400, "temperature", 20)
+    aggregator.report()
+    aggregator.add(now, "temperature", 21)
+    aggregator.report()             # yesterday is reported, restart before saveInterval
+
+    reported = RMDailyAggregator(Fields, stateFile).report()
+    if [day.day for day in reported] != [rmGetStartOfDay(now)]:
+        problems.append("reported day restored: %s" % [day.day for day in reported])
+    return problems
+
+def main():
+    argParser = argparse.ArgumentParser(description = "Check the streaming daily aggregates against full lists of observations.")
+    argParser.add_argument("--days", type = int, default = 3, help = "days of observations (default 3)")
+    argParser.add_argument("--observations", type = int, default = 1440, help = "observations per day (default 1440)")
+    argParser.add_argument("--verbose", action = "store_true", help = "show log output")
+    args = argParser.parse_args()
+
+    if not args.verbose:
+        log.setLevel(logging.CRITICAL)
+
+    random.seed(1)
+    observations = makeObservations(args.days, args.observations)
+    expected = reference(observations)
+
+    stateDir = tempfile.mkdtemp(prefix = "rm-aggregates-")
+    problems = []
+    try:
+        start = time.time()
+        reported, restarts, stateSizes = aggregate(observations, os.path.join(stateDir, "aggregates.json"))
+        elapsed = time.time() - start
+        problems += checkEmptyDay(os.path.join(stateDir, "empty.json"))
+        problems += checkReportedDay(os.path.join(stateDir, "reported.json"))
+    finally:
+        shutil.rmtree(stateDir, ignore_errors = True)
+
+    print "%d observations in %.3fs (%.0f/s), %d restarts, saved state %s bytes" % (len(observations), elapsed,
+                                                                                   len(observations) / elapsed,
+                                                                                   restarts, stateSizes)
+    for day in sorted(expected):
+        if day not in reported:
+            problems.append("day %s not reported" % day)
+            continue
+        values, direction, variance = reported[day]
+        print "day %s: %s direction %.1f" % (day, ", ".join("%s %.3f" % (key, values[key]) for key in sorted(values)), direction)
+        for key, value in expected[day].iteritems():
+            actual = {"direction": direction, "variance": variance}.get(key, values.get(key, None))
+            if actual is None or abs(actual - value) > 1e-6 * max(1, abs(value)):
+                problems.append("day %s %s: %s, expected %s" % (day, key, actual, value))
+
+    if stateSizes and max(stateSizes) > 2 * min(stateSizes):
+        problems.append("saved state grows with the observations: %s" % stateSizes)
+
+    for problem in problems:
+        print "*** %s" % problem
+    if problems:
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+
+import math
+from collections import OrderedDict
+
+from RMUtilsFramework.rmTimeUtils import globalMonotonicTime
+from RMUtilsFramework.rmMemoryUsageStats import RMMemoryUsageStats
+
+##-----------------------------------------------------------------------------------------------------
+##
+## One measured stage (parse, addRecords, ...). Latencies are kept in seconds, memory in KB as
+## reported by /proc/self/status.
+##
+class RMBenchmarkStage:
+
+    Percentiles = [50, 90, 99]
+
+    def __init__(self, group, name):
+        self.group = group
+        self.name = name
+        self.samples = []
+        self.records = 0
+        self.bytes = 0
+
+        self.peakRss = 0
+        self.hwmGrowth = 0
+
+        self.__memoryStats = RMMemoryUsageStats()
+
+    def measure(self, command, *args, **kwargs):
+        hwm = self.__memoryStats.getFromProc()["hwm"]
+
+        start = globalMonotonicTime.get(False)
+        result = command(*args, **kwargs)
+        self.samples.append(globalMonotonicTime.get(False) - start)
+
+        memory = self.__memoryStats.getFromProc()
+        self.peakRss = max(self.peakRss, memory["rss"])
+        self.hwmGrowth += max(0, memory["hwm"] - hwm)
+
+        return result
+
+    def addRecords(self, count):
+        self.records += count
+
+    def addBytes(self, count):
+        self.bytes += count
+
+    def total(self):
+        return sum(self.samples)
+
+    def percentile(self, p):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        rank = int(math.ceil(p / 100.0 * len(ordered)))
+        return ordered[max(0, min(rank, len(ordered)) - 1)]
+
+    def asDict(self):
+        total = self.total()
+        result = OrderedDict()
+        result["group"] = self.group
+        result["stage"] = self.name
+        result["runs"] = len(self.samples)
+        result["records"] = self.records
+        result["bytes"] = self.bytes
+        result["total"] = total
+        result["opsPerSec"] = len(self.samples) / total if total > 0 else None
+        result["recordsPerSec"] = self.records / total if total > 0 else None
+        result["bytesPerSec"] = self.bytes / total if total > 0 else None
+        result["min"] = min(self.samples) if self.samples else None
+        result["max"] = max(self.samples) if self.samples else None
+        for p in RMBenchmarkStage.Percentiles:
+            result["p%d" % p] = self.percentile(p)
+        result["peakRss"] = self.peakRss
+        result["hwmGrowth"] = self.hwmGrowth
+        return result
+
+##-----------------------------------------------------------------------------------------------------
+##
+## A collection of stages grouped by what is being measured (usually the parser name).
+##
+class RMBenchmark:
+    def __init__(self, name):
+        self.name = name
+        self.stages = OrderedDict()
+
+    def stage(self, group, name):
+        key = (group, name)
+        stage = self.stages.get(key, None)
+        if stage is None:
+            stage = self.stages[key] = RMBenchmarkStage(group, name)
+        return stage
+
+    def asDict(self):
+        result = OrderedDict()
+        result["benchmark"] = self.name
+        result["stages"] = [stage.asDict() for stage in self.stages.values()]
+        return result
+
+    def report(self):
+        lines = []
+        header = "%-24s %-14s %5s %8s %10s %10s %10s %9s %9s %9s %9s %9s %11s %8s" % \
+                 ("Group", "Stage", "Runs", "Records", "Total(s)", "Ops/s", "Rec/s", "MB/s", "p50(ms)", "p90(ms)", "p99(ms)", "Max(ms)", "PeakRSS(KB)", "HWM+(KB)")
+        lines.append(self.name)
+        lines.append("-" * len(header))
+        lines.append(header)
+        lines.append("-" * len(header))
+        for stage in self.stages.values():
+            s = stage.asDict()
+            lines.append("%-24s %-14s %5d %8d %10.3f %10s %10s %9s %9s %9s %9s %9s %11d %8d" % \
+                         (s["group"][:24], s["stage"][:14], s["runs"], s["records"], s["total"],
+                          self.__fmt(s["opsPerSec"], 1), self.__fmt(s["recordsPerSec"], 0),
+                          self.__fmt(s["bytesPerSec"] / 1048576.0 if s["bytes"] and s["bytesPerSec"] else None, 2),
+                          self.__ms(s["p50"]), self.__ms(s["p90"]), self.__ms(s["p99"]), self.__ms(s["max"]), s["peakRss"], s["hwmGrowth"]))
+        lines.append("-" * len(header))
+        return lines
+
+    def __fmt(self, value, decimals):
+        if value is None:
+            return "-"
+        return "%.*f" % (decimals, value)
+
+    def __ms(self, value):
+        if value is None:
+            return "-"
+        return "%.2f" % (value * 1000.0)
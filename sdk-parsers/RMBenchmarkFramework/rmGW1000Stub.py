@@ -0,0 +1,226 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+#
+# Local stub of an Ecowitt GW1000 gateway (UDP CMD_BROADCAST discovery and TCP CMD_GW1000_LIVE_DATA) and a check of
+# the gw1000-parser polling through the listener service. The parser discovers the stub, keeps one connection for
+# all live data requests, reconnects without discovering again when the stub drops the connection and a new parser
+# instance uses the address cached in its params.
+#
+#   python RMBenchmarkFramework/rmGW1000Stub.py [--runs 5] [--verbose]
+#
+
+import os, sys, imp, time, socket, struct, select, argparse, logging, threading
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")))
+
+from RMParserFramework.rmParser import RMParser
+from RMParserFramework.rmListenerService import globalListenerService
+from RMUtilsFramework.rmLogging import log
+
+PARSER_FILE = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "RMParserFramework", "parsers", "gw1000-parser.py"))
+
+##-----------------------------------------------------------------------------------------------------
+##
+##
+def checksum(data):
+    return sum(ord(b) for b in data) & 0xFF
+
+def packet(command, payload):
+    # HEADER, COMMAND, SIZE (2 bytes, from command to checksum), PAYLOAD, CHECKSUM
+    body = chr(command) + struct.pack(">H", len(payload) + 4) + payload
+    return "\xFF\xFF" + body + chr(checksum(body))
+
+class RMGW1000Stub:
+    def __init__(self, name = "GW1000-WIFI1234"):
+        self.name = name
+        self.temperatures = []
+        self.discoveries = 0
+        self.connections = 0
+        self.requests = 0
+        self.__clients = []
+        self.__running = True
+        self.__drop = threading.Event()
+
+        self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp.bind(("127.0.0.1", 0))
+        self.tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.tcp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.tcp.bind(("127.0.0.1", 0))
+        self.tcp.listen(5)
+
+        self.discoverPort = self.udp.getsockname()[1]
+        self.port = self.tcp.getsockname()[1]
+
+        self.__thread = threading.Thread(target = self.__run)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def liveData(self):
+        temperature = 150 + 10 * (self.requests % 5)   # 15.0 - 19.0 C
+        self.temperatures.append(temperature / 10.0)
+        payload = "\x02" + struct.pack(">h", temperature) + \
+                  "\x07" + struct.pack(">B", 60 + self.requests % 10) + \
+                  "\x09" + struct.pack(">H", 10130) + \
+                  "\x0B" + struct.pack(">H", 25) + \
+                  "\x10" + struct.pack(">H", self.requests) + \
+                  "\x15" + struct.pack(">I", 500000) + \
+                  "\x17" + struct.pack(">B", 3)
+        return packet(0x27, payload)
+
+    def dropConnections(self):
+        # Closed by the stub thread before its next select
+        self.__drop.set()
+
+    def stop(self):
+        self.__running = False
+        self.__thread.join()
+        self.__closeClients()
+        self.udp.close()
+        self.tcp.close()
+
+    def __closeClients(self):
+        for client in self.__clients:
+            client.close()
+        self.__clients = []
+
+    def __run(self):
+        while self.__running:
+            if self.__drop.is_set():
+                self.__closeClients()
+                self.__drop.clear()
+
+            sockets = [self.udp, self.tcp] + self.__clients
+            ready = select.select(sockets, [], [], 0.05)[0]
+
+            for s in ready:
+                if s is self.udp:
+                    request, address = self.udp.recvfrom(1024)
+                    if request == "\xff\xff\x12\x03\x15":
+                        self.discoveries += 1
+                        # MAC, IP, PORT, NAME LENGTH, NAME
+                        payload = "\x00\x11\x22\x33\x44\x55" + socket.inet_aton("127.0.0.1") + struct.pack(">H", self.port) + \
+                                  chr(len(self.name)) + self.name
+                        self.udp.sendto(packet(0x12, payload), address)
+                elif s is self.tcp:
+                    client, address = self.tcp.accept()
+                    self.connections += 1
+                    self.__clients.append(client)
+                else:
+                    try:
+                        request = s.recv(1024)
+                    except socket.error:
+                        request = ""
+                    if request == "\xFF\xFF\x27\x03\x2A":
+                        self.requests += 1
+                        s.sendall(self.liveData())
+                    elif not request:
+                        s.close()
+                        self.__clients.remove(s)
+
+##-----------------------------------------------------------------------------------------------------
+##
+##
+def loadParser():
+    module = imp.load_source("gw1000_parser", PARSER_FILE)
+    return module.GW1000
+
+def createParser(parserClass, stub, listenPort):
+    parser = parserClass()
+    parser.params = {"_ip": None, "_port": None}
+    parser.discover_address = "127.0.0.1"
+    parser.discover_port = stub.discoverPort
+    parser.discover_listen_port = listenPort
+    parser.poll_interval = 0.05
+    return parser
+
+def freeUdpPort():
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+def runParser(parser, runs):
+    for run in xrange(runs):
+        parser.clearValues()
+        parser.perform()
+        time.sleep(0.2)
+    parser.subscription.close()
+    return parser.getValues()
+
+def main():
+    argParser = argparse.ArgumentParser(description = "Run the GW1000 parser against a local stub gateway.")
+    argParser.add_argument("--runs", type = int, default = 5, help = "parser runs (default 5)")
+    argParser.add_argument("--verbose", action = "store_true", help = "show log output")
+    args = argParser.parse_args()
+
+    if not args.verbose:
+        log.setLevel(logging.CRITICAL)
+
+    parserClass = loadParser()
+    stub = RMGW1000Stub()
+    problems = []
+
+    try:
+        parser = createParser(parserClass, stub, freeUdpPort())
+        for run in xrange(args.runs):
+            parser.clearValues()
+            parser.perform()
+            if run == args.runs // 2:
+                stub.dropConnections()
+            time.sleep(0.2)
+        subscription = parser.subscription
+        subscription.close()
+
+        values = parser.getValues()
+        print "stub: %d discoveries, %d connections, %d live data requests" % (stub.discoveries, stub.connections, stub.requests)
+        print "params: %s" % parser.params
+        print "subscription: %d packets, %d errors, %d connections, %d dropped" % (subscription.packets, subscription.errors,
+                                                                                 subscription.connections, subscription.observations.dropped)
+
+        if stub.discoveries != 1:
+            problems.append("expected one discovery, got %d" % stub.discoveries)
+        if stub.connections != 2:
+            problems.append("expected 2 connections (one after the stub dropped it), got %d" % stub.connections)
+        if parser.params["_port"] != stub.port:
+            problems.append("discovered port not cached in params")
+        if len(values) != 1:
+            problems.append("expected values for one day, got %d" % len(values))
+
+        # Live data received after the last run is still buffered, the aggregates then have all received packets
+        parser._add_samples(subscription.observations.drain())
+        observations = parser.aggregator.current.observations()
+        temperatures = stub.temperatures[:parser.aggregator.current.samples] # the reply to the last request can be lost on close
+        temperature = observations[RMParser.dataType.TEMPERATURE]
+        expected = sum(temperatures) / len(temperatures)
+        print "day: %d samples, temperature %.2f (expected %.2f) min %s max %s rain %s" % (parser.aggregator.current.samples, temperature, expected,
+                                                                                       observations[RMParser.dataType.MINTEMP],
+                                                                                       observations[RMParser.dataType.MAXTEMP],
+                                                                                       observations[RMParser.dataType.RAIN])
+        if abs(temperature - expected) > 1e-9 or observations[RMParser.dataType.MINTEMP] != min(temperatures) or \
+                observations[RMParser.dataType.MAXTEMP] != max(temperatures):
+            problems.append("wrong temperature aggregates")
+        if subscription.errors:
+            problems.append("%d invalid packets" % subscription.errors)
+
+        # A new parser instance with the cached address doesn't discover again
+        cachedParser = createParser(parserClass, stub, freeUdpPort())
+        cachedParser.params = dict(parser.params)
+        runParser(cachedParser, 1)
+        if stub.discoveries != 1:
+            problems.append("cached address not used, discovered again")
+    finally:
+        globalListenerService.stop()
+        stub.stop()
+
+    for problem in problems:
+        print "*** %s" % problem
+    if problems:
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,189 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+#
+# Imports a generated Sprinkler V1 water log with RMWaterLogTable.importFromSprinklerV1Db() and with the
+# previous implementation (all rows collected in memory, one executemany). An import interrupted after a
+# few chunks is then resumed and the result is checked: same rows as the source, one token per day and
+# water_log_daily equal to a rebuild.
+#
+#   python RMBenchmarkFramework/rmHistoryImportBenchmark.py [--days 1095] [--zones 12] [--chunk 2000]
+#
+
+import os, sys, json, uuid, random, shutil, sqlite3, tempfile, argparse, logging
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")))
+
+from RMDatabaseFramework.rmDatabase import RMDatabase
+from RMDatabaseFramework.rmDatabaseManager import globalDbManager
+from RMDatabaseFramework.rmHistoryImport import RMHistoryImport
+from RMDatabaseFramework.rmMainDataTable import RMWaterLogTable
+from RMUtilsFramework.rmCommandThread import RMCommand, RMCommandThread
+from RMUtilsFramework.rmLogging import log
+from RMUtilsFramework.rmTimeUtils import rmCurrentDayTimestamp, rmGetStartOfDay
+
+from RMBenchmarkFramework.rmBenchmark import RMBenchmark
+
+##-----------------------------------------------------------------------------------------------------
+##
+## Previous importFromSprinklerV1Db(), kept here as the reference for the benchmark.
+##
+def legacyImport(database, tableName, filePath):
+    v1DB = RMDatabase(filePath)
+    if not v1DB.open():
+        return False
+
+    data = OrderedDict()
+    valuesToInsert = []
+
+    rows = v1DB.execute("SELECT ts_started, usersch_id, zid, user_sec, machine_sec, real_sec, flag FROM %s ORDER BY ts_started, zid" % tableName)
+    for row in rows:
+        dayTimestamp = rmGetStartOfDay(int(row[0]))
+
+        dayData = data.get(dayTimestamp, None)
+        if dayData is None:
+            dayData = {
+                "token": uuid.uuid4().hex,
+                "tokenTimestamp": dayTimestamp
+            }
+            data[dayTimestamp] = dayData
+
+        valuesToInsert.append([row[0], row[1], row[2], row[3], row[4], row[5], row[6], dayData["token"], dayData["tokenTimestamp"], dayData["tokenTimestamp"]])
+
+    if valuesToInsert:
+        database.execute("DELETE FROM %s" % tableName)
+        database.executeMany("INSERT INTO %s(ts_started, usersch_id, zid, user_sec, machine_sec, real_sec, flag, token, tokenTimestamp, tokenTimestampInt) "\
+                             "VALUES(?,?,?,?,?,?,?,?,?,?)" % tableName, valuesToInsert)
+        database.commit()
+
+    v1DB.close()
+    return True
+
+##-----------------------------------------------------------------------------------------------------
+##
+##
+class StopImport(Exception):
+    pass
+
+def onCommandThread(name, function, *args):
+    cmd = RMCommand(name, True)
+    cmd.command = lambda: function(*args)
+    return RMCommandThread.instance.executeCommand(cmd)
+
+def createV1Database(filePath, days, zones):
+    connection = sqlite3.connect(filePath)
+    connection.execute("CREATE TABLE water_log (ts_started INTEGER NOT NULL, usersch_id INTEGER NOT NULL, zid INTEGER NOT NULL, "\
+                       "user_sec INTEGER NOT NULL, machine_sec INTEGER NOT NULL, real_sec INTEGER NOT NULL DEFAULT 0, flag INTEGER NOT NULL DEFAULT 0, "\
+                       "PRIMARY KEY(ts_started, usersch_id, zid))")
+
+    firstDay = rmCurrentDayTimestamp() - days * 86400
+    rows = []
+    for day in xrange(days):
+        start = firstDay + day * 86400 + 5 * 3600
+        for zid in xrange(1, zones + 1):
+            for cycle in xrange(2):
+                duration = random.randint(60, 900)
+                rows.append((start, 1, zid, duration, duration, duration - random.randint(0, 30), 0))
+                start += duration
+    connection.executemany("INSERT INTO water_log VALUES(?, ?, ?, ?, ?, ?, ?)", rows)
+    connection.commit()
+    connection.close()
+    return len(rows)
+
+def checkImport(database, count):
+    errors = []
+    if database.execute("SELECT COUNT(*) FROM water_log").fetchone()[0] != count:
+        errors.append("row count differs from the V1 database")
+    if database.execute("SELECT COUNT(*) FROM (SELECT tokenTimestampInt FROM water_log GROUP BY tokenTimestampInt HAVING COUNT(DISTINCT token)>1)").fetchone()[0]:
+        errors.append("days with more than one token")
+    if database.execute("SELECT COUNT(*) FROM historyImport").fetchone()[0]:
+        errors.append("import position left after the import finished")
+
+    query = "SELECT day, usersch_id, zid, user_sec, real_sec, cycles FROM water_log_daily ORDER BY day, usersch_id, zid"
+    maintained = database.execute(query).fetchall()
+    RMWaterLogTable(database).rebuildDaily()
+    if maintained != database.execute(query).fetchall():
+        errors.append("water_log_daily differs from a rebuild")
+    return errors
+
+def main():
+    argParser = argparse.ArgumentParser(description = "Compare the chunked V1 water log import with the previous one.")
+    argParser.add_argument("--days", type = int, default = 1095, help = "days of V1 water log (default 1095)")
+    argParser.add_argument("--zones", type = int, default = 12, help = "zones watered each day, two cycles each (default 12)")
+    argParser.add_argument("--chunk", type = int, default = RMHistoryImport.ChunkSize, help = "rows per chunk (default %d)" % RMHistoryImport.ChunkSize)
+    argParser.add_argument("--json", default = None, help = "also write the results to this file")
+    args = argParser.parse_args()
+
+    log.setLevel(logging.ERROR)
+    random.seed(1)
+
+    if not RMCommandThread.createInstance():
+        print "Error initializing Command Thread"
+        return 2
+
+    RMHistoryImport.ChunkSize = args.chunk
+    benchmark = RMBenchmark("V1 water log import (%d days, %d zones, chunks of %d rows)" % (args.days, args.zones, args.chunk))
+    dbDir = tempfile.mkdtemp(prefix = "rm-import-")
+    v1Path = os.path.join(dbDir, "sprinkler-v1.sqlite")
+    ok = True
+
+    try:
+        count = createV1Database(v1Path, args.days, args.zones)
+
+        globalDbManager.initialize(dbDir)
+        database = globalDbManager.mainDatabase
+        waterLogTable = RMWaterLogTable(database)
+
+        # Chunked import first so its memory high water mark isn't hidden by the previous one
+        stage = benchmark.stage("import", "chunked")
+        ok &= stage.measure(waterLogTable.importFromSprinklerV1Db, v1Path) == True
+        stage.addRecords(count)
+
+        stage = benchmark.stage("import", "previous")
+        ok &= stage.measure(onCommandThread, "legacyImport", legacyImport, database, "water_log", v1Path) == True
+        stage.addRecords(count)
+
+        # Interrupted after 3 chunks, then resumed
+        chunks = []
+        def stopAfterChunks(imported, total):
+            chunks.append(imported)
+            if len(chunks) == 3:
+                raise StopImport()
+
+        stage = benchmark.stage("import", "interrupted")
+        if stage.measure(waterLogTable.importFromSprinklerV1Db, v1Path, stopAfterChunks):
+            print "*** import wasn't interrupted"
+            ok = False
+        interruptedAt = chunks[-1] if chunks else 0
+
+        del chunks[:]
+        stage = benchmark.stage("import", "resumed")
+        ok &= stage.measure(waterLogTable.importFromSprinklerV1Db, v1Path, lambda imported, total: chunks.append(imported)) == True
+        stage.addRecords(count - interruptedAt)
+
+        errors = onCommandThread("checkImport", checkImport, database, count)
+        for error in errors:
+            print "*** %s" % error
+        ok &= not errors
+
+        for line in benchmark.report():
+            print line
+        print "%d rows, interrupted at %d rows and resumed in %d chunks" % (count, interruptedAt, len(chunks))
+
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(benchmark.asDict(), f, indent = 4)
+    finally:
+        RMCommandThread.instance.stop()
+        RMCommandThread.instance.join()
+        shutil.rmtree(dbDir, ignore_errors = True)
+
+    if ok:
+        return 0
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
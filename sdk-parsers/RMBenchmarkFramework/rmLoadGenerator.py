@@ -0,0 +1,372 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+#
+# Synthetic load generator for the parser history and mixer tables.
+#
+# N virtual parsers derived from SimulatorParser produce periodic/cumulative series at hourly or 4-hourly
+# density. Years of history are backfilled day by day through the same RMForecastTable/RMParserDataTable
+# sequence used by RMParserManager.run() (clearHistory() condenses each past day like on a real device) and
+# the mixer tables are fed from the stored values. Optionally the real RMParserManager.run() is then driven
+# with the virtual parsers on top of the backfilled database.
+#
+#   python RMBenchmarkFramework/rmLoadGenerator.py [--parsers 20] [--density 4hourly] [--years 1] [--live-runs 10]
+#
+
+import os, sys, imp, json, random, shutil, tempfile, argparse, logging
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")))
+
+from RMParserFramework.rmParser import RMParser
+from RMDataFramework.rmForecastInfo import RMForecastInfo
+from RMDataFramework.rmMixerData import RMMixerData
+from RMDataFramework.rmUserSettings import globalSettings
+from RMDatabaseFramework.rmDatabaseManager import globalDbManager
+from RMDatabaseFramework.rmForecastInfoTable import RMForecastTable
+from RMDatabaseFramework.rmMixerDataTable import RMMixerDataTable
+from RMDatabaseFramework.rmUserDataTypeTable import RMUserDataTypeTable
+from RMDatabaseFramework.rmHistoryRetention import globalHistoryRetention
+from RMDatabaseFramework.rmParserDataTable import RMParserTable, RMParserUserDataTable, RMParserDataTable
+from RMUtilsFramework.rmCommandThread import RMCommand, RMCommandThread
+from RMUtilsFramework.rmLogging import log
+from RMUtilsFramework.rmTimeUtils import rmCurrentDayTimestamp, rmGetStartOfDay, rmTimestampToDateAsString
+
+from RMBenchmarkFramework.rmBenchmark import RMBenchmark
+
+PARSERS_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "RMParserFramework", "parsers"))
+
+SimulatorParser = imp.load_source("simulator-parser", os.path.join(PARSERS_DIR, "simulator-parser.py")).SimulatorParser
+
+##-----------------------------------------------------------------------------------------------------
+##
+## A SimulatorParser with configurable density that generates data for the day set in
+## runtime[RuntimeDayTimestamp] instead of the current day, so history can be backfilled.
+##
+class RMLoadParser(SimulatorParser):
+    parserName = "Load Parser"
+    parserDescription = "Synthetic parser used to load the history and mixer tables"
+    parserForecast = True
+    parserHistorical = True
+    parserEnabled = False
+    parserDebug = False
+    parserInterval = 3 * 3600
+    params = {
+        "minTemp" : 5,
+        "maxTemp" : 25,
+        "density": 3600,
+        "forecastDays": 6
+    }
+
+    Densities = {
+        "hourly": 3600,
+        "4hourly": 4 * 3600
+    }
+
+    fileName = "load-parser.py"
+
+    def __init__(self, index = 0, density = 3600, forecastDays = 6):
+        SimulatorParser.__init__(self)
+        self.parserName = "%s %03d" % (self.__class__.parserName, index)
+
+        # Spread the parsers a bit so the mixer has something to average
+        self.params = {
+            "minTemp": 5 + index % 7,
+            "maxTemp": 25 + index % 5,
+            "density": density,
+            "forecastDays": forecastDays
+        }
+
+    def perform(self):
+        self.tempMin = self.params["minTemp"]
+        self.tempMax = self.params["maxTemp"]
+
+        density = self.params["density"]
+        stepsPerDay = 86400 / density
+
+        startDayTimestamp = self.runtime[RMParser.RuntimeDayTimestamp] or self._currentDayTimestamp()
+        arrTimestamps = range(startDayTimestamp, startDayTimestamp + self.params["forecastDays"] * 86400, density)
+
+        self.addValues(RMParser.dataType.TEMPERATURE, self._generatePeriodicalData(arrTimestamps, self.tempMin, self.tempMax, stepsPerDay, -stepsPerDay / 2.4))
+        self.addValues(RMParser.dataType.MINTEMP, self._generateCumulativeData(arrTimestamps, self.tempMin / 2.0, self.tempMin * 2.0))
+        self.addValues(RMParser.dataType.MAXTEMP, self._generateCumulativeData(arrTimestamps, self.tempMax / 2.0, self.tempMax * 2.0))
+        self.addValues(RMParser.dataType.DEWPOINT, self._generateCumulativeData(arrTimestamps, self.dewMin, self.dewMax))
+        self.addValues(RMParser.dataType.WIND, self._generateCumulativeData(arrTimestamps, self.windMin, self.windMax))
+        self.addValues(RMParser.dataType.POP, self._generateCumulativeData(arrTimestamps, self.popMin, self.popMax))
+        self.addValues(RMParser.dataType.QPF, self._generateCumulativeData(arrTimestamps, self.qpfMin, self.qpfMax))
+        self.addValues(RMParser.dataType.RH, self._generatePeriodicalData(arrTimestamps, self.humidityMin, self.humidityMax, stepsPerDay, 0))
+
+        # Observed values for yesterday, like a historical parser
+        startYesterday = startDayTimestamp - 86400
+        self.addValue(RMParser.dataType.TEMPERATURE, startYesterday, (self.tempMax + self.tempMin) / 2.0)
+        self.addValue(RMParser.dataType.RAIN, startYesterday, max(0.0, random.random() - 0.7) * 20)
+
+##-----------------------------------------------------------------------------------------------------
+##
+##
+class RMLoadGenerator:
+    def __init__(self, parsersCount = 10, density = 3600, forecastDays = 6, runsPerDay = 1):
+        self.parsersCount = parsersCount
+        self.density = density
+        self.forecastDays = forecastDays
+        self.runsPerDay = runsPerDay
+
+        self.benchmark = RMBenchmark("Load generator (%d parsers, %d values/day, %d runs/day)" % (parsersCount, 86400 / density, runsPerDay))
+
+        self.parsers = OrderedDict() # parserConfig -> RMLoadParser
+
+        self.parserTable = None
+        self.parserDataTable = None
+        self.forecastTable = None
+        self.userDataTypeTable = None
+        self.parserUserDataTypeTable = None
+        self.mixerDataTable = None
+
+    def open(self):
+        # Same table creation order as RMParserManager
+        self.parserTable = RMParserTable(globalDbManager.parserDatabase)
+        self.parserDataTable = RMParserDataTable(globalDbManager.parserDatabase)
+        self.forecastTable = RMForecastTable(globalDbManager.parserDatabase)
+        self.userDataTypeTable = RMUserDataTypeTable(globalDbManager.parserDatabase)
+        self.parserUserDataTypeTable = RMParserUserDataTable(globalDbManager.parserDatabase)
+        self.mixerDataTable = RMMixerDataTable(globalDbManager.mixerDatabase)
+
+        self.userDataTypeTable.buildCache()
+
+        for index in xrange(self.parsersCount):
+            parser = RMLoadParser(index, self.density, self.forecastDays)
+            parserConfig, isNew = self.parserTable.addParser(RMLoadParser.fileName, parser.parserName, True, parser.params)
+            parserConfig.userDataTypes = self.userDataTypeTable.addRecords(parser.userDataTypes)
+            self.parserUserDataTypeTable.addRecords(parserConfig.dbID, parserConfig.userDataTypes)
+            self.parsers[parserConfig] = parser
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    # Fill the database with the given number of days of history, oldest day first.
+    #
+    def backfill(self, days, progress = None):
+        todayTimestamp = rmCurrentDayTimestamp()
+        interval = 86400 / self.runsPerDay
+
+        for day in xrange(days, 0, -1):
+            dayTimestamp = todayTimestamp - day * 86400
+
+            # History sweeps run once a day, each backfilled day gets its own
+            globalHistoryRetention.reset()
+
+            for run in xrange(self.runsPerDay):
+                self.runAt(dayTimestamp + run * interval + 3600)
+
+            if progress:
+                progress(days - day + 1, days, dayTimestamp)
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    # One parser run at the given (simulated) time, same sequence as RMParserManager.run() followed
+    # by a mixer pass that reads the stored values back.
+    #
+    def runAt(self, timestamp):
+        forecast = self.forecastTable.addRecordEx(RMForecastInfo(None, timestamp))
+        dayTimestamp = rmGetStartOfDay(timestamp)
+
+        perform = self.benchmark.stage("backfill", "perform")
+        addRecords = self.benchmark.stage("backfill", "addRecords")
+
+        for parserConfig, parser in self.parsers.iteritems():
+            parser.settings = globalSettings.getSettings()
+            parser.runtime[RMParser.RuntimeDayTimestamp] = dayTimestamp
+
+            perform.measure(parser.perform)
+            values = parser.getValues()
+            perform.addRecords(len(values))
+
+            if not globalSettings.vibration:
+                self.parserDataTable.removeEntriesWithParserIdAndTimestamp(parserConfig.dbID, values)
+
+            addRecords.measure(self.parserDataTable.addRecords, forecast.id, parserConfig.dbID, values)
+            addRecords.addRecords(len(values))
+
+            parser.clearValues()
+
+        self.mix(forecast, dayTimestamp, "backfill")
+        return forecast
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    # Daily average of all parsers for the forecast, stored and trimmed the way the mixer does.
+    #
+    def mix(self, forecast, dayTimestamp, group):
+        read = self.benchmark.stage(group, "mixer read")
+        write = self.benchmark.stage(group, "mixer addRecords")
+        history = self.benchmark.stage(group, "mixer history")
+
+        days = OrderedDict()
+        for parserConfig in self.parsers:
+            values = read.measure(self.parserDataTable.getRecordsForKey, (forecast.id, parserConfig.dbID))
+            read.addRecords(len(values))
+            for value in values:
+                day = rmGetStartOfDay(value.timestamp)
+                if day < dayTimestamp:
+                    continue
+                days.setdefault(day, []).append(value)
+
+        mixerValues = []
+        for day in sorted(days):
+            values = days[day]
+            mixerData = RMMixerData(day)
+            mixerData.temperature = self.__avg([v.temperature for v in values])
+            mixerData.rh = self.__avg([v.rh for v in values])
+            mixerData.wind = self.__avg([v.wind for v in values])
+            mixerData.pop = self.__avg([v.pop for v in values])
+            mixerData.qpf = self.__avg([v.qpf for v in values])
+            mixerData.dewPoint = self.__avg([v.dewPoint for v in values])
+            mixerData.minTemp = self.__avg([v.minTemperature for v in values])
+            mixerData.maxTemp = self.__avg([v.maxTemperature for v in values])
+            mixerData.minRH = self.__avg([v.minRh for v in values])
+            mixerData.maxRH = self.__avg([v.maxRh for v in values])
+            mixerValues.append(mixerData)
+
+        write.measure(self.mixerDataTable.addRecords, forecast.id, forecast.timestamp, mixerValues)
+        write.addRecords(len(mixerValues))
+
+        history.measure(self.__clearMixerHistory, dayTimestamp)
+
+        self.forecastTable.markRecordsAsProcessed([forecast.id])
+        forecast.processed = True
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    # Drive the real RMParserManager with the virtual parsers. Other parsers are disabled in memory
+    # so nothing goes to the network.
+    #
+    def attachToManager(self, manager):
+        for parserConfig in manager.parsers:
+            parserConfig.enabled = False
+
+        for parserConfig, parser in self.parsers.iteritems():
+            parserConfig.enabled = True
+            manager.parsers[parserConfig] = parser
+
+    def runManager(self, manager):
+        run = self.benchmark.stage("live", "manager.run")
+
+        forecast, mixerValues = run.measure(manager.run)
+        if forecast is None or forecast.id is None:
+            return None
+
+        run.addRecords(self.parsersCount)
+        self.mix(forecast, rmCurrentDayTimestamp(), "live")
+        return forecast
+
+    def countRecords(self):
+        def count():
+            result = OrderedDict()
+            for table in ["forecast", "parserData"]:
+                result[table] = globalDbManager.parserDatabase.execute("SELECT COUNT(*) FROM %s" % table).fetchone()[0]
+            result["mixerData"] = globalDbManager.mixerDatabase.execute("SELECT COUNT(*) FROM mixerData").fetchone()[0]
+            return result
+
+        cmd = RMCommand("loadGeneratorCountRecords", True)
+        cmd.command = count
+        return RMCommandThread.instance.executeCommand(cmd)
+
+    def __clearMixerHistory(self, dayTimestamp):
+        if globalSettings.mixerHistorySize > 0:
+            self.mixerDataTable.deleteRecordsByDayThreshold(dayTimestamp - globalSettings.mixerHistorySize * 86400, False)
+        self.mixerDataTable.deleteRecordsHistoryByDayThreshold(dayTimestamp)
+
+    def __avg(self, values):
+        values = [v for v in values if v is not None]
+        if not values:
+            return None
+        return round(sum(values) / len(values), 2)
+
+##-----------------------------------------------------------------------------------------------------
+##
+##
+def main():
+    argParser = argparse.ArgumentParser(description = "Load the parser history and mixer tables with synthetic parsers.")
+    argParser.add_argument("--parsers", type = int, default = 10, help = "number of virtual parsers (default 10)")
+    argParser.add_argument("--density", choices = sorted(RMLoadParser.Densities.keys()), default = "hourly", help = "values per parser run (default hourly)")
+    argParser.add_argument("--forecast-days", type = int, default = 6, help = "days returned by each parser run (default 6)")
+    argParser.add_argument("--years", type = float, default = 1.0, help = "years of history to backfill (default 1)")
+    argParser.add_argument("--runs-per-day", type = int, default = 1, help = "parser runs per backfilled day (default 1, device default is 8)")
+    argParser.add_argument("--live-runs", type = int, default = 0, help = "RMParserManager.run() calls after the backfill (default 0)")
+    argParser.add_argument("--history-size", type = int, default = None, help = "parser and mixer history retention in days (default from settings)")
+    argParser.add_argument("--seed", type = int, default = 1, help = "random seed (default 1)")
+    argParser.add_argument("--db-dir", default = None, help = "keep the databases in this folder instead of a temporary one")
+    argParser.add_argument("--json", default = None, help = "also write the results to this file")
+    argParser.add_argument("--verbose", action = "store_true", help = "show log output")
+    args = argParser.parse_args()
+
+    if not args.verbose:
+        log.setLevel(logging.ERROR)
+
+    random.seed(args.seed)
+
+    if args.history_size is not None:
+        globalSettings.parserHistorySize = args.history_size
+        globalSettings.mixerHistorySize = args.history_size
+
+    days = int(round(args.years * 365))
+
+    if not RMCommandThread.createInstance():
+        print "Error initializing Command Thread"
+        return 2
+
+    dbDir = args.db_dir
+    if dbDir:
+        if not os.path.exists(dbDir):
+            os.makedirs(dbDir)
+    else:
+        dbDir = tempfile.mkdtemp(prefix = "rm-load-")
+
+    try:
+        globalDbManager.initialize(dbDir)
+
+        generator = RMLoadGenerator(args.parsers, RMLoadParser.Densities[args.density], args.forecast_days, args.runs_per_day)
+        generator.open()
+
+        def progress(day, days, dayTimestamp):
+            if day % 30 == 0 or day == days:
+                counts = generator.countRecords()
+                print "  %s: day %d/%d, %s" % (rmTimestampToDateAsString(dayTimestamp, "%Y-%m-%d"), day, days,
+                                                ", ".join(["%s=%d" % (k, v) for k, v in counts.iteritems()]))
+
+        print "Backfilling %d days for %d parsers in %s" % (days, args.parsers, dbDir)
+        generator.backfill(days, progress)
+
+        if args.live_runs > 0:
+            from RMParserFramework.rmParserManager import RMParserManager
+            manager = RMParserManager()
+            generator.attachToManager(manager)
+            for run in xrange(args.live_runs):
+                generator.runManager(manager)
+
+        for line in generator.benchmark.report():
+            print line
+
+        counts = generator.countRecords()
+        for name, count in counts.iteritems():
+            print "%-12s %10d rows" % (name, count)
+        for fileName in sorted(os.listdir(dbDir)):
+            print "%-32s %10d KB" % (fileName, os.path.getsize(os.path.join(dbDir, fileName)) / 1024)
+
+        if args.json:
+            result = generator.benchmark.asDict()
+            result["records"] = counts
+            with open(args.json, "w") as f:
+                json.dump(result, f, indent = 4)
+    finally:
+        RMCommandThread.instance.stop()
+        RMCommandThread.instance.join()
+
+        if not args.db_dir:
+            shutil.rmtree(dbDir, ignore_errors = True)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
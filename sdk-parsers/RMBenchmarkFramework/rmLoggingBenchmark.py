@@ -0,0 +1,122 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+#
+# Compares the time spent by the logging thread with synchronous file logging and with the RMLogger
+# background thread (RMLogger.AsyncHandler). A small rotate size makes the compressed rotation happen
+# often, its cost shows up in the max latency of the synchronous logger. Checks that all the messages
+# logged with the asynchronous logger are in the log files after shutdown() when the queue doesn't overflow,
+# and that dropped messages are counted when it does. The last run samples the messages
+# (RMLogger.setModuleSampling) and checks the suppressed messages counter.
+#
+#   python RMBenchmarkFramework/rmLoggingBenchmark.py [--messages 50000] [--rotate-size 200000] [--sample 20]
+#
+
+import os, sys, json, gzip, shutil, tempfile, argparse, logging
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")))
+
+from RMUtilsFramework.rmLogging import RMLogger
+
+from RMBenchmarkFramework.rmBenchmark import RMBenchmark
+
+BATCH = 100
+
+##-----------------------------------------------------------------------------------------------------
+##
+##
+def createLogger(name, fileName, useQueue, queueSize, sample):
+    RMLogger.ENABLE_ASYNC = useQueue
+    RMLogger.ASYNC_QUEUE_SIZE = queueSize
+
+    logger = RMLogger(name)
+    logger.logger.removeHandler(logger.stdoutHandler)
+    if sample:
+        logger.setModuleSampling(os.path.splitext(os.path.basename(__file__))[0], sample, logging.INFO)
+    logger.enableFileLogging(fileName)
+    return logger
+
+def logBatch(log, start):
+    for index in xrange(start, start + BATCH):
+        log.info("Observation %d: temperature %.2f rh %d wind %.1f" % (index, 20.5, 64, 3.2))
+
+def countMessages(fileName):
+    count = 0
+    for path, opener in ((fileName, open), (fileName + ".1.gz", gzip.open)):
+        if os.path.exists(path):
+            with opener(path) as f:
+                count += sum(1 for line in f if "Observation" in line)
+    return count
+
+def runLogger(benchmark, logDir, name, useQueue, queueSize, messages, sample = None):
+    fileName = os.path.join(logDir, name, "rainmachine.log")
+    logger = createLogger("bench-" + name, fileName, useQueue, queueSize, sample)
+
+    stage = benchmark.stage("log", name)
+    for start in xrange(0, messages, BATCH):
+        stage.measure(logBatch, logger.logger, start)
+        stage.addRecords(BATCH)
+
+    flushStage = benchmark.stage("shutdown", name)
+    flushStage.measure(logger.shutdown)
+
+    stats = logger.getStats()
+    logger.fileHandler.close()
+    return stats, countMessages(fileName)
+
+def main():
+    argParser = argparse.ArgumentParser(description = "Compare synchronous and asynchronous RMLogger file logging.")
+    argParser.add_argument("--messages", type = int, default = 50000, help = "messages to log (default 50000)")
+    argParser.add_argument("--rotate-size", type = int, default = 200000, help = "log rotate size in bytes (default 200000)")
+    argParser.add_argument("--sample", type = int, default = 20, help = "keep one of this many messages in the sampled run (default 20)")
+    argParser.add_argument("--json", default = None, help = "also write the results to this file")
+    args = argParser.parse_args()
+
+    messages = args.messages - args.messages % BATCH
+    RMLogger.ROTATE_FILE_SIZE = args.rotate_size
+
+    benchmark = RMBenchmark("RMLogger file logging (%d messages, rotate at %d bytes)" % (messages, args.rotate_size))
+    logDir = tempfile.mkdtemp(prefix = "rm-logging-")
+    ok = True
+    lines = []
+
+    try:
+        runLogger(benchmark, logDir, "sync", False, 0, messages)
+
+        # Queue big enough for all messages, only the last rotation can lose messages (backupCount=1)
+        stats, count = runLogger(benchmark, logDir, "async", True, messages + 1, messages)
+        lines.append("async: written %d, dropped %d, in log files %d" % (stats["written"], stats["dropped"], count))
+        if stats["dropped"] or stats["written"] != messages:
+            print "*** async logger dropped messages with a queue big enough for all of them"
+            ok = False
+
+        stats, count = runLogger(benchmark, logDir, "async-small", True, 100, messages)
+        lines.append("async-small: written %d, dropped %d %s" % (stats["written"], stats["dropped"], stats["droppedByLevel"]))
+        if stats["written"] + stats["dropped"] != messages:
+            print "*** async logger lost messages without counting them"
+            ok = False
+
+        stats, count = runLogger(benchmark, logDir, "sampled", True, messages + 1, messages, args.sample)
+        suppressed = sum(stats["suppressed"].values())
+        lines.append("sampled: written %d, suppressed %d, in log files %d" % (stats["written"], suppressed, count))
+        if stats["written"] + suppressed != messages or stats["written"] != (messages + args.sample - 1) // args.sample:
+            print "*** sampled logger kept %d of %d messages, suppressed %d" % (stats["written"], messages, suppressed)
+            ok = False
+
+        for line in benchmark.report() + lines:
+            print line
+
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(benchmark.asDict(), f, indent = 4)
+    finally:
+        shutil.rmtree(logDir, ignore_errors = True)
+
+    if ok:
+        return 0
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
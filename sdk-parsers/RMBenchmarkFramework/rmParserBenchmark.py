@@ -0,0 +1,251 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+#
+# Offline parser pipeline benchmark.
+#
+# Replays recorded provider payloads (fixtures/) through the real parser classes with openURL() replaced
+# by RMPayloadReplay, then pushes the results through RMParserDataTable.addRecords() and clearHistory()
+# on a temporary SQLite file. Reports throughput, latency percentiles and memory for each stage.
+#
+#   python RMBenchmarkFramework/rmParserBenchmark.py [--iterations N] [--history-days N] [--parsers NOAA,DWD] [--json out.json]
+#
+
+import os, sys, imp, json, copy, shutil, tempfile, argparse, logging
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")))
+
+from RMParserFramework.rmParser import RMParser
+from RMDataFramework.rmForecastInfo import RMForecastInfo
+from RMDataFramework.rmUserSettings import globalSettings
+from RMDatabaseFramework.rmDatabase import RMParsersDatabase
+from RMDatabaseFramework.rmForecastInfoTable import RMForecastTable
+from RMDatabaseFramework.rmUserDataTypeTable import RMUserDataTypeTable
+from RMDatabaseFramework.rmParserDataTable import RMParserTable, RMParserUserDataTable, RMParserDataTable
+from RMUtilsFramework.rmCommandThread import RMCommand, RMCommandThread
+from RMUtilsFramework.rmLogging import log
+from RMUtilsFramework.rmTimeUtils import rmCurrentTimestamp, rmCurrentDayTimestamp
+
+from RMBenchmarkFramework.rmBenchmark import RMBenchmark
+from RMBenchmarkFramework.rmPayloadReplay import RMPayloadReplay
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+PARSERS_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "RMParserFramework", "parsers"))
+
+##-----------------------------------------------------------------------------------------------------
+##
+##
+class RMParserBenchmark:
+    def __init__(self, databasePath, iterations = 20, historyDays = 30):
+        self.databasePath = databasePath
+        self.iterations = iterations
+        self.historyDays = historyDays
+
+        self.benchmark = RMBenchmark("Parser pipeline (%d iterations, %d days history)" % (iterations, historyDays))
+
+        self.database = None
+        self.parserTable = None
+        self.parserDataTable = None
+        self.forecastTable = None
+        self.userDataTypeTable = None
+        self.parserUserDataTypeTable = None
+
+    def open(self):
+        self.database = RMParsersDatabase(self.databasePath)
+        if not self.database.open():
+            return False
+
+        # Same table creation order as RMParserManager
+        self.parserTable = RMParserTable(self.database)
+        self.parserDataTable = RMParserDataTable(self.database)
+        self.forecastTable = RMForecastTable(self.database)
+        self.userDataTypeTable = RMUserDataTypeTable(self.database)
+        self.parserUserDataTypeTable = RMParserUserDataTable(self.database)
+
+        self.userDataTypeTable.buildCache()
+        return True
+
+    def close(self):
+        if self.database:
+            self.database.close()
+            self.database = None
+
+    def loadParser(self, fixture):
+        parserPath = os.path.join(PARSERS_DIR, fixture["file"])
+        parsersCount = len(RMParser.parsers)
+
+        imp.load_source(os.path.splitext(fixture["file"])[0], parserPath)
+
+        parser = None
+        for instance in RMParser.parsers[parsersCount:]:
+            if instance.__class__.__name__ == fixture["class"]:
+                parser = instance
+        if parser is None:
+            log.error("*** Benchmark: parser class %s not found in %s" % (fixture["class"], parserPath))
+            return None, None
+
+        # Measure parsing, not debug logging
+        parser.parserDebug = False
+        parser.params = copy.deepcopy(parser.params)
+        parser.params.update(fixture["params"])
+
+        parserConfig, isNew = self.parserTable.addParser(fixture["file"], parser.parserName, True, parser.params)
+        parserConfig.userDataTypes = self.userDataTypeTable.addRecords(parser.userDataTypes)
+        self.parserUserDataTypeTable.addRecords(parserConfig.dbID, parserConfig.userDataTypes)
+
+        return parser, parserConfig
+
+    def run(self, fixtures, recordedDay):
+        for fixture in fixtures:
+            name = fixture["name"]
+
+            globalSettings.location.__dict__.update(fixture["location"])
+
+            parser, parserConfig = self.loadParser(fixture)
+            if parser is None:
+                continue
+
+            replay = RMPayloadReplay(FIXTURES_DIR, fixture.get("recordedDay", recordedDay), fixture["payloads"])
+            replay.prepare(rmCurrentDayTimestamp())
+            parser.openURL = replay.openURL
+
+            parse = self.benchmark.stage(name, "parse")
+            addRecords = self.benchmark.stage(name, "addRecords")
+            clearHistory = self.benchmark.stage(name, "clearHistory")
+
+            for iteration in xrange(self.iterations):
+                parser.clearValues()
+                parser.lastKnownError = ""
+                parser.settings = globalSettings.getSettings()
+                parser.runtime[RMParser.RuntimeDayTimestamp] = rmCurrentDayTimestamp()
+                replay.reset()
+
+                parse.measure(parser.perform)
+                values = parser.getValues()
+
+                parse.addRecords(len(values))
+                parse.addBytes(replay.bytes)
+
+                if replay.unmatched or not values:
+                    log.error("*** Benchmark: %s returned %d values (unmatched requests: %s, error: %s)" % \
+                              (name, len(values), replay.unmatched, parser.lastKnownError))
+                    break
+
+                if iteration == 0:
+                    self.__seedHistory(parserConfig.dbID, values)
+
+                # Same sequence as RMParserManager.run(), only addRecords() is measured
+                forecast = self.forecastTable.addRecordEx(RMForecastInfo(None, rmCurrentTimestamp()))
+                self.parserDataTable.removeEntriesWithParserIdAndTimestamp(parserConfig.dbID, values)
+
+                addRecords.measure(self.parserDataTable.addRecords, forecast.id, parserConfig.dbID, values)
+                addRecords.addRecords(len(values))
+
+                clearHistory.measure(self.__clearHistory, parserConfig.dbID)
+                clearHistory.addRecords(self.__countRecords(parserConfig.dbID))
+
+            parser.clearValues()
+
+        return self.benchmark
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    # Fill the table with past forecasts built from today's values so clearHistory() has archived
+    # days and a realistic number of rows to scan.
+    #
+    def __seedHistory(self, parserID, values):
+        now = rmCurrentTimestamp()
+        for day in xrange(self.historyDays, 0, -1):
+            forecast = self.forecastTable.addRecordEx(RMForecastInfo(None, now - day * 86400))
+            pastValues = []
+            for value in values:
+                pastValue = copy.copy(value)
+                pastValue.timestamp = value.timestamp - day * 86400
+                pastValues.append(pastValue)
+            self.parserDataTable.addRecords(forecast.id, parserID, pastValues)
+
+    def __clearHistory(self, parserID):
+        self.parserDataTable.clearHistory(parserID, False)
+        self.parserDataTable.commit()
+
+    def __countRecords(self, parserID):
+        def count():
+            return self.database.execute("SELECT COUNT(*) FROM parserData WHERE parserID=?", (parserID, )).fetchone()[0]
+
+        cmd = RMCommand("benchmarkCountRecords", True)
+        cmd.command = count
+        return RMCommandThread.instance.executeCommand(cmd)
+
+##-----------------------------------------------------------------------------------------------------
+##
+##
+def loadFixtures(fileName):
+    def toStr(value):
+        if isinstance(value, unicode):
+            return value.encode("utf-8")
+        if isinstance(value, list):
+            return [toStr(v) for v in value]
+        if isinstance(value, dict):
+            return dict((toStr(k), toStr(v)) for k, v in value.iteritems())
+        return value
+
+    with open(fileName) as f:
+        return toStr(json.load(f))
+
+def main():
+    argParser = argparse.ArgumentParser(description = "Replay recorded weather service payloads through the parser pipeline.")
+    argParser.add_argument("--iterations", type = int, default = 20, help = "runs per parser (default 20)")
+    argParser.add_argument("--history-days", type = int, default = 30, help = "days of past forecasts to seed (default 30)")
+    argParser.add_argument("--parsers", default = None, help = "comma separated fixture names (default all)")
+    argParser.add_argument("--fixtures", default = os.path.join(FIXTURES_DIR, "fixtures.json"), help = "fixtures description file")
+    argParser.add_argument("--json", default = None, help = "also write the results to this file")
+    argParser.add_argument("--keep-db", action = "store_true", help = "do not delete the temporary database")
+    argParser.add_argument("--verbose", action = "store_true", help = "show parser log output")
+    args = argParser.parse_args()
+
+    if not args.verbose:
+        log.setLevel(logging.ERROR)
+
+    fixtures = loadFixtures(args.fixtures)
+    selected = fixtures["parsers"]
+    if args.parsers:
+        names = [n.strip().lower() for n in args.parsers.split(",")]
+        selected = [f for f in selected if f["name"].lower() in names]
+
+    if not RMCommandThread.createInstance():
+        print "Error initializing Command Thread"
+        return 2
+
+    tempDir = tempfile.mkdtemp(prefix = "rm-benchmark-")
+    bench = RMParserBenchmark(os.path.join(tempDir, "rainmachine-parser.sqlite"), args.iterations, args.history_days)
+
+    try:
+        if not bench.open():
+            print "Cannot open database in %s" % tempDir
+            return 2
+
+        benchmark = bench.run(selected, fixtures["recordedDay"])
+        bench.close()
+
+        for line in benchmark.report():
+            print line
+
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(benchmark.asDict(), f, indent = 4)
+    finally:
+        bench.close()
+        RMCommandThread.instance.stop()
+        RMCommandThread.instance.join()
+
+        if args.keep_db:
+            print "Database kept in %s" % tempDir
+        else:
+            shutil.rmtree(tempDir, ignore_errors = True)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,170 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+#
+# Compares saving parser params after every run with the previous storage (the whole dict pickled in
+# parser.params) and the parserParams table (RMParserParamsTable, one typed row per key, cached).
+# The params are modelled on the simulator and weather rules parsers: a few settings that don't change
+# and state keys (_lastTS, _rain6qpf, _observations) that change on some of the runs.
+#
+#   python RMBenchmarkFramework/rmParserParamsBenchmark.py [--parsers 10] [--runs 200] [--observations 48]
+#
+
+import os, sys, json, random, shutil, sqlite3, tempfile, argparse, logging
+from cStringIO import StringIO
+import pickle
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")))
+
+from RMDatabaseFramework.rmDatabaseManager import globalDbManager
+from RMDatabaseFramework.rmParserDataTable import RMParserTable
+from RMUtilsFramework.rmCommandThread import RMCommand, RMCommandThread
+from RMUtilsFramework.rmLogging import log
+
+from RMBenchmarkFramework.rmBenchmark import RMBenchmark
+
+##-----------------------------------------------------------------------------------------------------
+##
+## Previous storage, the params dict pickled in one column and rewritten on each save.
+##
+class LegacyParamsStore:
+    def __init__(self, fileName):
+        self.connection = sqlite3.connect(fileName, check_same_thread = False)
+        self.connection.text_factory = str
+        self.connection.execute("CREATE TABLE parser (ID INTEGER PRIMARY KEY, params TEXT DEFAULT NULL)")
+        self.bytesWritten = 0
+
+    def setParams(self, parserID, params):
+        outputStream = StringIO()
+        pickle.Pickler(outputStream).dump(params)
+        data = outputStream.getvalue()
+        self.connection.execute("INSERT OR REPLACE INTO parser (ID, params) VALUES(?, ?)", (parserID, data))
+        self.connection.commit()
+        self.bytesWritten += len(data)
+        return 1
+
+    def getParams(self, parserID):
+        row = self.connection.execute("SELECT params FROM parser WHERE ID=?", (parserID, )).fetchone()
+        return pickle.Unpickler(StringIO(row[0])).load()
+
+    def close(self):
+        self.connection.close()
+
+##-----------------------------------------------------------------------------------------------------
+##
+##
+def onCommandThread(name, function, *args):
+    cmd = RMCommand(name, True)
+    cmd.command = lambda: function(*args)
+    return RMCommandThread.instance.executeCommand(cmd)
+
+def makeParams(observations):
+    return {
+        "minTemp": 5,
+        "maxTemp": 25,
+        "apiKey": "0123456789abcdef",
+        "useCustomStation": False,
+        "stationName": u"Station \u00e9",
+        "_lastTS": [],
+        "_rain6qpf": [],
+        "_observations": dict([("%d" % (1500000000 + hour * 3600), None) for hour in xrange(observations)]),
+    }
+
+#-----------------------------------------------------------------------------------------------
+#
+# Advances the state keys the way the parsers do: the simulator shifts its series once a day
+# (every 8th run with a 3 hour interval), weather rules replace one observation on half of the runs.
+#
+def runParser(params, run, observations):
+    if run % 8 == 0:
+        day = 1500000000 + (run / 8) * 86400
+        params["_lastTS"] = [day + idx * 86400 for idx in xrange(7)]
+        params["_rain6qpf"] = [round(random.uniform(0, 10), 2) for idx in xrange(7)]
+    if run % 2 == 0:
+        observed = params["_observations"]
+        observed.pop(min(observed), None)
+        observed["%d" % (1500000000 + (observations + run) * 3600)] = round(random.uniform(0, 5), 2)
+
+def saveRuns(stage, store, allParams, runs, observations):
+    written = 0
+    for run in xrange(runs):
+        for parserID, params in allParams.iteritems():
+            runParser(params, run, observations)
+            written += stage.measure(store.setParams, parserID, params)
+            stage.addRecords(1)
+    return written
+
+def readAll(stage, store, allParams, iterations):
+    ok = True
+    for iteration in xrange(iterations):
+        for parserID, params in allParams.iteritems():
+            ok &= stage.measure(store.getParams, parserID) == params
+            stage.addRecords(1)
+    return ok
+
+def main():
+    argParser = argparse.ArgumentParser(description = "Compare the parserParams table with the pickled params column.")
+    argParser.add_argument("--parsers", type = int, default = 10, help = "number of parsers (default 10)")
+    argParser.add_argument("--runs", type = int, default = 200, help = "parser runs, params are saved after each one (default 200)")
+    argParser.add_argument("--observations", type = int, default = 48, help = "entries in _observations (default 48)")
+    argParser.add_argument("--json", default = None, help = "also write the results to this file")
+    args = argParser.parse_args()
+
+    log.setLevel(logging.ERROR)
+
+    if not RMCommandThread.createInstance():
+        print "Error initializing Command Thread"
+        return 2
+
+    benchmark = RMBenchmark("Parser params storage (%d parsers, %d runs)" % (args.parsers, args.runs))
+    dbDir = tempfile.mkdtemp(prefix = "rm-params-")
+    lines = []
+    ok = True
+
+    try:
+        globalDbManager.initialize(dbDir)
+        parserTable = RMParserTable(globalDbManager.parserDatabase)
+
+        legacy = LegacyParamsStore(os.path.join(dbDir, "legacy.sqlite"))
+        stores = [("pickle", legacy)]
+
+        parserIDs = []
+        for index in xrange(args.parsers):
+            parserConfig, isNew = parserTable.addParser("params-%d.py" % index, "Params %d" % index, True, makeParams(args.observations))
+            parserIDs.append(parserConfig.dbID)
+        stores.append(("parserParams", onCommandThread("paramsTable", lambda: parserTable.paramsTable)))
+
+        for name, store in stores:
+            random.seed(1)
+            allParams = dict([(parserID, makeParams(args.observations)) for parserID in parserIDs])
+
+            # Both run on the command thread like RMParserManager does
+            written = onCommandThread("save", saveRuns, benchmark.stage("save after run", name), store, allParams, args.runs, args.observations)
+            if not onCommandThread("read", readAll, benchmark.stage("read", name), store, allParams, 5):
+                print "*** %s: params read back differ from the saved ones" % name
+                ok = False
+
+            lines.append("%s: %d rows written for %d saves" % (name, written, args.runs * args.parsers))
+
+        lines.append("pickle: %.1f KB written" % (legacy.bytesWritten / 1024.0))
+        legacy.close()
+
+        for line in benchmark.report() + lines:
+            print line
+
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(benchmark.asDict(), f, indent = 4)
+    finally:
+        RMCommandThread.instance.stop()
+        RMCommandThread.instance.join()
+        shutil.rmtree(dbDir, ignore_errors = True)
+
+    if ok:
+        return 0
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+
+import os, re, zipfile, urllib
+import calendar
+from datetime import date, datetime, timedelta
+from cStringIO import StringIO
+
+from RMUtilsFramework.rmLogging import log
+
+##-----------------------------------------------------------------------------------------------------
+##
+## Payload dates are rebased by whole days so that a recording made on "recordedDay" looks like it
+## was downloaded today. Parsers reject data in the past or too far in the future so replaying the
+## raw file would produce nothing after a few days.
+##
+__isoDateExpr = re.compile(r"(?<!\d)(\d{4})-(\d{2})-(\d{2})(?!\d)")
+__compactDateExpr = re.compile(r"(?<!\d)(\d{4})(\d{2})(\d{2})(\d{6})(?!\d)")
+__epochExpr = re.compile(r"(?<![\d.])(1\d{9})(?![\d.])")
+
+# Only unix timestamps this close to the recording day are considered dates
+EPOCH_WINDOW = 60 * 86400
+
+def rmShiftPayloadDays(data, deltaDays, recordedDayTimestamp):
+    if not deltaDays:
+        return data
+
+    def shiftDate(y, m, d):
+        return date(int(y), int(m), int(d)) + timedelta(days = deltaDays)
+
+    def isoDate(match):
+        try:
+            return shiftDate(match.group(1), match.group(2), match.group(3)).strftime("%Y-%m-%d")
+        except ValueError:
+            return match.group(0)
+
+    def compactDate(match):
+        try:
+            return shiftDate(match.group(1), match.group(2), match.group(3)).strftime("%Y%m%d") + match.group(4)
+        except ValueError:
+            return match.group(0)
+
+    def epoch(match):
+        timestamp = int(match.group(1))
+        if abs(timestamp - recordedDayTimestamp) > EPOCH_WINDOW:
+            return match.group(0)
+        return str(timestamp + deltaDays * 86400)
+
+    data = __isoDateExpr.sub(isoDate, data)
+    data = __compactDateExpr.sub(compactDate, data)
+    data = __epochExpr.sub(epoch, data)
+    return data
+
+##-----------------------------------------------------------------------------------------------------
+##
+## Serves recorded payloads in place of RMParser.openURL(). Payloads are matched by a substring of the
+## full request URL, the first match wins.
+##
+class RMPayloadReplay:
+    def __init__(self, fixturesDir, recordedDay, payloads):
+        self.fixturesDir = fixturesDir
+        self.recordedDay = recordedDay
+        self.payloads = payloads
+
+        self.requests = 0
+        self.bytes = 0
+        self.unmatched = []
+
+        self.__data = []
+
+    def prepare(self, dayTimestamp):
+        recorded = datetime.strptime(self.recordedDay, "%Y-%m-%d")
+        recordedDayTimestamp = calendar.timegm(recorded.timetuple())
+        deltaDays = (date.fromtimestamp(dayTimestamp) - recorded.date()).days
+
+        self.__data = []
+        for payload in self.payloads:
+            with open(os.path.join(self.fixturesDir, payload["file"]), "rb") as f:
+                data = f.read()
+
+            data = rmShiftPayloadDays(data, deltaDays, recordedDayTimestamp)
+
+            # Some services send zip archives, we keep the fixture readable and compress it here
+            archiveName = payload.get("zip", None)
+            if archiveName:
+                buffer = StringIO()
+                archive = zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED)
+                archive.writestr(archiveName, data)
+                archive.close()
+                data = buffer.getvalue()
+
+            self.__data.append((payload["match"], data))
+
+    def openURL(self, url, params = None, encodeParameters = True, headers = {}):
+        if params:
+            if encodeParameters:
+                query_string = urllib.urlencode(params)
+            else:
+                query_string = params
+            url = "?" . join([url, query_string])
+
+        for match, data in self.__data:
+            if match in url:
+                self.requests += 1
+                self.bytes += len(data)
+                return StringIO(data)
+
+        log.error("*** Replay: no recorded payload for %s" % url)
+        self.unmatched.append(url)
+        return None
+
+    def reset(self):
+        self.requests = 0
+        self.bytes = 0
+        self.unmatched = []
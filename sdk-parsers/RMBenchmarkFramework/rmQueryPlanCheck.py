@@ -0,0 +1,237 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+#
+# EXPLAIN QUERY PLAN regression check for the hot parser/mixer/water log queries.
+#
+# A database filled by RMLoadGenerator is taken back to version 16 (secondary indexes, mixerDataLatest,
+# water_log_daily and water_log.tokenTimestampInt dropped), upgraded with RMDatabaseUpdate and the plan of each query is checked. Exits with 1 if the upgrade fails or a
+# query still does a full scan of one of its tables.
+#
+#   python RMBenchmarkFramework/rmQueryPlanCheck.py [--days 30] [--verbose]
+#
+
+import os, re, sys, shutil, tempfile, argparse, logging
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")))
+
+from RMDatabaseFramework.rmDatabase import RMVersionTable
+from RMDatabaseFramework.rmDatabaseManager import globalDbManager
+from RMDatabaseFramework.rmDatabaseUpdate import RMDatabaseUpdate
+from RMDatabaseFramework.rmMainDataTable import RMWaterLogTable
+from RMUtilsFramework.rmCommandThread import RMCommand, RMCommandThread
+from RMUtilsFramework.rmLogging import log
+from RMUtilsFramework.rmTimeUtils import rmCurrentDayTimestamp
+
+from RMBenchmarkFramework.rmLoadGenerator import RMLoadGenerator, RMLoadParser
+
+# Schema objects added after database version 16 (dbUpdateScripts/updateV*.py)
+V16_DOWNGRADE = {
+    "parser": ["DROP INDEX IF EXISTS parserData_timestamp",
+               "DROP INDEX IF EXISTS parserData_parserID_timestamp"],
+    "mixer": ["DROP INDEX IF EXISTS mixerData_timestamp_forecastID",
+              "DROP INDEX IF EXISTS mixerData_forecastTimestamp",
+              "DROP TRIGGER IF EXISTS mixerDataLatest_insert",
+              "DROP TRIGGER IF EXISTS mixerDataLatest_delete",
+              "DROP TABLE IF EXISTS mixerDataLatest"],
+    "main": ["DROP TRIGGER IF EXISTS water_log_daily_insert",
+             "DROP TRIGGER IF EXISTS water_log_daily_delete",
+             "DROP TRIGGER IF EXISTS water_log_daily_update",
+             "DROP TABLE IF EXISTS water_log_daily",
+             "DROP TRIGGER IF EXISTS water_log_fake_daily_insert",
+             "DROP TRIGGER IF EXISTS water_log_fake_daily_delete",
+             "DROP TRIGGER IF EXISTS water_log_fake_daily_update",
+             "DROP TABLE IF EXISTS water_log_fake_daily",
+             "DROP INDEX IF EXISTS water_log_tokenTimestamp",
+             "DROP INDEX IF EXISTS water_log_fake_tokenTimestamp",
+             "DROP INDEX IF EXISTS water_log_tokenTimestampInt",
+             "DROP INDEX IF EXISTS water_log_fake_tokenTimestampInt",
+             "ALTER TABLE water_log DROP COLUMN tokenTimestampInt",
+             "ALTER TABLE water_log_fake DROP COLUMN tokenTimestampInt"],
+}
+
+##-----------------------------------------------------------------------------------------------------
+##
+## (database, name, query, parameters count, tables/aliases that must not be fully scanned)
+##
+## The queries are the ones from the table classes. The outer DELETE of mixer deleteRecordsHistoryByDayThreshold
+## is a correlated EXISTS over the whole table and its GROUP BY timestamp part reads every day before the
+## threshold (today), only the forecastTimestamp range is checked.
+##
+HOT_QUERIES = [
+    ("parser", "parserData deleteRecordsByDayThreshold",
+     "DELETE FROM parserData WHERE timestamp<?", 1, ["parserData"]),
+
+    ("parser", "parserData deleteRecordsByParser (range)",
+     "DELETE FROM parserData WHERE parserID=? AND timestamp<?", 2, ["parserData"]),
+
+    ("parser", "parserData deleteRecordsHistoryByDayThreshold",
+     "SELECT f.ID, f.timestamp, p.rowid, p.timestamp, p.temperature, p.rh, p.wind, p.solarRad, p.skyCover, p.rain, p.et0, p.pop, p.qpf, p.condition, p.pressure, p.dewPoint, p.archived "\
+     "FROM parserData p, forecast f WHERE f.ID=p.forecastID AND p.parserID=? ORDER BY p.timestamp DESC, p.forecastID DESC", 1, ["p", "f"]),
+
+    ("parser", "parserData getMinMax",
+     "SELECT f.timestamp, pd.timestamp, pd.temperature, pd.minTemperature, pd.maxTemperature, pd.rh, pd.minRh, pd.maxRh "\
+     "FROM forecast f, parserData pd "\
+     "WHERE pd.parserID=? AND ?<=pd.timestamp AND pd.timestamp<=? AND pd.forecastID=f.ID ORDER BY pd.forecastID DESC", 3, ["pd", "f"]),
+
+    ("mixer", "mixerData deleteRecordsByDayThreshold",
+     "DELETE FROM mixerData WHERE timestamp<?", 1, ["mixerData"]),
+
+    ("mixer", "mixerData getRecordsByThreshold",
+     "SELECT timestamp, temperature FROM mixerData WHERE ?<=timestamp AND timestamp<? ORDER BY timestamp ASC", 2, ["mixerData"]),
+
+    ("mixer", "mixerData getLastRecordsByThreshold",
+     "SELECT forecastID, timestamp, temperature FROM mixerDataLatest WHERE ?<=timestamp AND timestamp<=? ORDER BY timestamp ASC", 2, ["mixerDataLatest"]),
+
+    ("mixer", "mixerData getLastRecordForDayForSimulator",
+     "SELECT forecastID, forecastTimestamp, timestamp, temperature FROM mixerDataLatest WHERE ?<=timestamp AND timestamp<? ORDER BY forecastID DESC LIMIT 1", 2, ["mixerDataLatest"]),
+
+    ("mixer", "mixerData getLastKnownConditionForDay (latest)",
+     "SELECT condition FROM mixerDataLatest WHERE ?<=timestamp AND timestamp<? ORDER BY forecastID DESC, forecastTimestamp DESC LIMIT 1", 2, ["mixerDataLatest"]),
+
+    ("mixer", "mixerData getLastKnownConditionForDay",
+     "SELECT condition FROM mixerData WHERE ?<=timestamp AND timestamp<? AND condition IS NOT NULL ORDER BY forecastID DESC, forecastTimestamp DESC LIMIT 1", 2, ["mixerData"]),
+
+    ("mixer", "mixerData deleteRecordsHistoryByDayThreshold (forecasts)",
+     "SELECT forecastTimestamp fTs, timestamp dayTs FROM mixerData WHERE forecastTimestamp<?", 1, ["mixerData"]),
+
+    ("main", "water_log deleteRecordsByDayThreshold",
+     "DELETE FROM water_log WHERE tokenTimestampInt < ?", 1, ["water_log"]),
+
+    ("main", "water_log getRecords",
+     "SELECT ts_started, usersch_id, zid, user_sec, machine_sec, real_sec, flag, token, tokenTimestamp FROM water_log "\
+     "WHERE ?<=tokenTimestamp AND tokenTimestamp<? "\
+     "ORDER BY tokenTimestamp, usersch_id, zid", 2, ["water_log"]),
+
+    ("main", "water_log getRecordsEx (daily)",
+     "SELECT day, SUM(real_sec), SUM(user_sec) FROM water_log_daily WHERE ?<=day AND day<? AND usersch_id!=0 GROUP BY day ORDER BY day", 2, ["water_log_daily"]),
+
+    ("main", "water_log getRecordsEx",
+     "SELECT tokenTimestamp, SUM(real_sec) realDuration, SUM(user_sec) userDuration, usersch_id FROM water_log "\
+     "WHERE ?<=tokenTimestamp AND tokenTimestamp<? GROUP BY tokenTimestamp "\
+     "ORDER BY tokenTimestamp", 2, ["water_log"]),
+]
+
+# "SCAN TABLE parserData AS pd ..." before sqlite 3.36, "SCAN pd" after
+SCAN_PATTERN = re.compile(r"^SCAN (?:TABLE )?(\w+)(?: AS (\w+))?")
+
+##-----------------------------------------------------------------------------------------------------
+##
+##
+def onCommandThread(name, function, *args):
+    cmd = RMCommand(name, True)
+    cmd.command = lambda: function(*args)
+    return RMCommandThread.instance.executeCommand(cmd)
+
+def getDatabase(name):
+    return getattr(globalDbManager, name + "Database")
+
+def queryPlan(database, query, paramsCount):
+    rows = database.execute("EXPLAIN QUERY PLAN " + query, (0, ) * paramsCount).fetchall()
+    return [row[3] for row in rows]
+
+#-----------------------------------------------------------------------------------------------
+#
+# Returns the table names/aliases fully scanned in the plan. A SCAN through an index (no constraint
+# on the index columns) still visits every row so it counts too, only SEARCH steps are accepted.
+#
+def fullScans(plan):
+    scans = []
+    for detail in plan:
+        match = SCAN_PATTERN.match(detail)
+        if match:
+            scans.append(match.group(1))
+            if match.group(2):
+                scans.append(match.group(2))
+    return scans
+
+def checkQueries(title, verbose):
+    print title
+    failed = 0
+    for databaseName, name, query, paramsCount, tables in HOT_QUERIES:
+        plan = onCommandThread("queryPlan", queryPlan, getDatabase(databaseName), query, paramsCount)
+        if plan is None:
+            failed += 1
+            print "    MISSING   %s" % name
+            continue
+
+        scanned = [table for table in fullScans(plan) if table in tables]
+        if scanned:
+            failed += 1
+            print "    FULL SCAN %-55s %s" % (name, ", ".join(scanned))
+        else:
+            print "    ok        %s" % name
+
+        if scanned or verbose:
+            for detail in plan:
+                print "                  %s" % detail
+    return failed
+
+#-----------------------------------------------------------------------------------------------
+#
+# Takes the databases back to the version 16 layout.
+#
+def downgradeToV16():
+    for databaseName, queries in V16_DOWNGRADE.iteritems():
+        database = getDatabase(databaseName)
+        for query in queries:
+            database.execute(query)
+        database.commit()
+
+    globalDbManager.mainDatabase.versionTable.setVersion(16)
+
+def main():
+    argParser = argparse.ArgumentParser(description = "Check that the hot database queries don't fall back to full table scans.")
+    argParser.add_argument("--days", type = int, default = 30, help = "days of history to generate before the upgrade (default 30)")
+    argParser.add_argument("--parsers", type = int, default = 2, help = "number of virtual parsers (default 2)")
+    argParser.add_argument("--verbose", action = "store_true", help = "show all query plans and log output")
+    args = argParser.parse_args()
+
+    if not args.verbose:
+        log.setLevel(logging.ERROR)
+
+    if not RMCommandThread.createInstance():
+        print "Error initializing Command Thread"
+        return 2
+
+    dbDir = tempfile.mkdtemp(prefix = "rm-queryplan-")
+    failed = 0
+
+    try:
+        globalDbManager.initialize(dbDir)
+
+        generator = RMLoadGenerator(args.parsers, RMLoadParser.Densities["4hourly"], 6, 1)
+        generator.open()
+        generator.backfill(args.days)
+        generator.runAt(rmCurrentDayTimestamp() + 3600)
+
+        RMWaterLogTable(globalDbManager.mainDatabase, False)
+        RMWaterLogTable(globalDbManager.mainDatabase, True)
+
+        onCommandThread("downgrade", downgradeToV16)
+        checkQueries("Version 16 (before upgrade):", args.verbose)
+
+        if not RMDatabaseUpdate.update():
+            print "*** Database upgrade failed"
+            failed += 1
+
+        updateVersion, dbVersion = RMDatabaseUpdate.getVersions()
+        if dbVersion != RMVersionTable.CurrentVersion:
+            print "*** Database version is %s after the upgrade, expected %s" % (dbVersion, RMVersionTable.CurrentVersion)
+            failed += 1
+
+        failed += checkQueries("Version %s (after upgrade):" % dbVersion, args.verbose)
+    finally:
+        RMCommandThread.instance.stop()
+        RMCommandThread.instance.join()
+        shutil.rmtree(dbDir, ignore_errors = True)
+
+    if failed:
+        print "%d problem(s) found" % failed
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
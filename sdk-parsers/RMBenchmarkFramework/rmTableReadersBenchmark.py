@@ -0,0 +1,294 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+#
+# Compares the parser/mixer table readers with the previous implementation (SELECT * and column copying
+# by index) on a database filled by RMLoadGenerator. Results of both implementations are also compared.
+# The streaming readers are compared with the full readers for a pass over the whole history.
+#
+#   python RMBenchmarkFramework/rmTableReadersBenchmark.py [--parsers 5] [--days 365] [--iterations 20]
+#
+
+import os, sys, json, random, shutil, tempfile, argparse, logging
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")))
+
+from RMDataFramework.rmForecastInfo import RMForecastInfo
+from RMDataFramework.rmMixerData import RMMixerData
+from RMDataFramework.rmWeatherData import RMWeatherData
+from RMDatabaseFramework.rmDatabaseManager import globalDbManager
+from RMUtilsFramework.rmCommandThread import RMCommand, RMCommandThread
+from RMUtilsFramework.rmLogging import log
+from RMUtilsFramework.rmTimeUtils import rmCurrentDayTimestamp, rmGetStartOfDay
+
+from RMBenchmarkFramework.rmBenchmark import RMBenchmark
+from RMBenchmarkFramework.rmLoadGenerator import RMLoadGenerator, RMLoadParser
+
+##-----------------------------------------------------------------------------------------------------
+##
+## Previous readers, kept here as the reference for the benchmark.
+##
+def legacyMixerData(row, offset):
+    mixerData = RMMixerData(row[offset])
+    mixerData.temperature = row[offset + 1]
+    mixerData.rh = row[offset + 2]
+    mixerData.wind = row[offset + 3]
+    mixerData.solarRad = row[offset + 4]
+    mixerData.skyCover = row[offset + 5]
+    mixerData.rain = row[offset + 6]
+    mixerData.et0 = row[offset + 7]
+    mixerData.pop = row[offset + 8]
+    mixerData.qpf = row[offset + 9]
+    mixerData.condition = row[offset + 10]
+    mixerData.pressure = row[offset + 11]
+    mixerData.dewPoint = row[offset + 12]
+    mixerData.minTemp = row[offset + 13]
+    mixerData.maxTemp = row[offset + 14]
+    mixerData.minRH = row[offset + 15]
+    mixerData.maxRH = row[offset + 16]
+    mixerData.et0calc = row[offset + 17]
+    mixerData.et0final = row[offset + 18]
+    return mixerData
+
+def legacyWeatherData(row, offset):
+    weatherData = RMWeatherData(row[offset])
+    weatherData.temperature = row[offset + 1]
+    weatherData.minTemperature = row[offset + 2]
+    weatherData.maxTemperature = row[offset + 3]
+    weatherData.rh = row[offset + 4]
+    weatherData.minRh = row[offset + 5]
+    weatherData.maxRh = row[offset + 6]
+    weatherData.wind = row[offset + 7]
+    weatherData.solarRad = row[offset + 8]
+    weatherData.skyCover = row[offset + 9]
+    weatherData.rain = row[offset + 10]
+    weatherData.et0 = row[offset + 11]
+    weatherData.pop = row[offset + 12]
+    weatherData.qpf = row[offset + 13]
+    weatherData.condition = row[offset + 14]
+    weatherData.pressure = row[offset + 15]
+    weatherData.dewPoint = row[offset + 16]
+    weatherData.userData = row[offset + 17]
+    return weatherData
+
+def legacyGetRecordsByThreshold(minTimestamp, maxTimestamp):
+    cursor = globalDbManager.mixerDatabase.execute("SELECT * FROM mixerData WHERE ?<=timestamp AND timestamp<? ORDER BY timestamp ASC", (minTimestamp, maxTimestamp, ))
+    return [legacyMixerData(row, 2) for row in cursor]
+
+def legacyGetLastRecordsByThreshold(minTimestamp, maxTimestamp):
+    cursor = globalDbManager.mixerDatabase.execute("SELECT MAX(forecastID), * FROM mixerData WHERE ?<=timestamp AND timestamp<=? GROUP BY timestamp ORDER BY timestamp ASC", (minTimestamp, maxTimestamp, ))
+    return [legacyMixerData(row, 3) for row in cursor]
+
+# The previous query had no aggregate so GROUP BY returned any forecast of the day, MAX(forecastID) selects
+# the newest one like mixerDataLatest does.
+def legacyGetLastRecordForDayForSimulator(dayTimestamp):
+    row = globalDbManager.mixerDatabase.execute("SELECT MAX(forecastID), * FROM mixerData WHERE ?<=timestamp AND timestamp<? GROUP BY timestamp ORDER BY forecastID DESC LIMIT 1",
+                                                (dayTimestamp, dayTimestamp + 86400, )).fetchone()
+    if row:
+        mixerData = legacyMixerData(row, 3)
+        return {"forecastID": row[1], "forecastTimestamp": row[2], "data": {mixerData.timestamp: mixerData}}
+    return OrderedDict()
+
+def legacyGetLastKnownConditionForDays(dayTimestamps):
+    result = []
+    for dayTimestamp in dayTimestamps:
+        row = globalDbManager.mixerDatabase.execute("SELECT condition FROM mixerData WHERE ?<=timestamp AND timestamp<? AND condition IS NOT NULL ORDER BY forecastID DESC, forecastTimestamp DESC LIMIT 1",
+                                                    (dayTimestamp, dayTimestamp + 86400, )).fetchone()
+        result.append(row[0] if row else None)
+    return result
+
+def legacyGetRecordsByForecast():
+    result = OrderedDict()
+    cursor = globalDbManager.mixerDatabase.execute("SELECT * FROM mixerData ORDER BY forecastID DESC, timestamp ASC")
+    for row in cursor:
+        mixerData = legacyMixerData(row, 2)
+        if row[0] in result:
+            result[row[0]]["values"].append(mixerData)
+        else:
+            result[row[0]] = {"timestamp" : row[1], "values": [mixerData, ]}
+    return result
+
+def legacyGetRecordsForKey(key):
+    cursor = globalDbManager.parserDatabase.execute("SELECT * from parserData WHERE forecastID=? AND parserID=?", (key[0], key[1], ))
+    return [legacyWeatherData(row, 2) for row in cursor]
+
+def legacyGetRecordsByParserID(parserID):
+    results = OrderedDict()
+    cursor = globalDbManager.parserDatabase.execute("SELECT f.timestamp, f.processed, pd.* FROM forecast f, parserData pd "\
+                                                    "WHERE pd.parserID==? AND f.id == pd.forecastID "\
+                                                    "ORDER BY f.id DESC, pd.timestamp ASC", (parserID, ))
+    for row in cursor:
+        forecast = RMForecastInfo(row[2], row[0], row[1])
+        weatherData = legacyWeatherData(row, 4)
+        dayTimestamp = rmGetStartOfDay(weatherData.timestamp)
+        results.setdefault(forecast, OrderedDict()).setdefault(dayTimestamp, []).append(weatherData)
+    return results
+
+##-----------------------------------------------------------------------------------------------------
+##
+##
+def flatten(result):
+    if isinstance(result, dict):
+        values = []
+        for key, value in result.iteritems():
+            values.append(getattr(key, "id", key))
+            values.extend(flatten(value))
+        return values
+    if isinstance(result, (list, tuple)):
+        values = []
+        for value in result:
+            values.extend(flatten(value))
+        return values
+    if hasattr(result, "__dict__"):
+        return [sorted(result.__dict__.items())]
+    return [result]
+
+def onCommandThread(name, function, *args):
+    cmd = RMCommand(name, True)
+    cmd.command = lambda: function(*args)
+    return RMCommandThread.instance.executeCommand(cmd)
+
+def compare(benchmark, name, iterations, legacy, legacyArgs, current, currentArgs):
+    legacyStage = benchmark.stage(name, "previous")
+    currentStage = benchmark.stage(name, "mapper")
+
+    legacyResult = currentResult = None
+    for iteration in xrange(iterations):
+        legacyResult = legacyStage.measure(onCommandThread, name, legacy, *legacyArgs)
+        currentResult = currentStage.measure(current, *currentArgs)
+
+    legacyValues = flatten(legacyResult)
+    currentValues = flatten(currentResult)
+
+    records = len([value for value in currentValues if isinstance(value, list)])
+    legacyStage.addRecords(records * iterations)
+    currentStage.addRecords(records * iterations)
+
+    if legacyValues != currentValues:
+        print "*** %s: results differ from the previous implementation" % name
+        return False
+    return True
+
+def countValues(values):
+    if isinstance(values, dict):
+        if "values" in values:
+            return len(values["values"])
+        return sum([countValues(v) for v in values.itervalues()])
+    return len(values)
+
+#-----------------------------------------------------------------------------------------------
+#
+# Returns the number of forecasts and the most records held in memory at once.
+#
+def consumeStream(iterator):
+    count = 0
+    held = 0
+    for entry in iterator:
+        count += 1
+        held = max(held, countValues(entry[-1]))
+    return count, held
+
+def consumeAll(result):
+    return len(result), sum([countValues(values) for values in result.itervalues()])
+
+def compareStreaming(benchmark, name, iterations, iterate, load, args):
+    streamStage = benchmark.stage(name, "stream")
+    loadStage = benchmark.stage(name, "load all")
+
+    for iteration in xrange(iterations):
+        count, streamHeld = streamStage.measure(lambda: consumeStream(iterate(*args)))
+        streamStage.addRecords(count)
+    for iteration in xrange(iterations):
+        count, loadHeld = loadStage.measure(lambda: consumeAll(load(*args)))
+        loadStage.addRecords(count)
+
+    return "%s: stream holds at most %d records, load all holds %d" % (name, streamHeld, loadHeld)
+
+def main():
+    argParser = argparse.ArgumentParser(description = "Compare the table readers with the previous column copying code.")
+    argParser.add_argument("--parsers", type = int, default = 5, help = "number of virtual parsers (default 5)")
+    argParser.add_argument("--days", type = int, default = 365, help = "days of history to generate (default 365)")
+    argParser.add_argument("--runs-per-day", type = int, default = 1, help = "parser runs per generated day (default 1)")
+    argParser.add_argument("--iterations", type = int, default = 20, help = "runs per reader (default 20)")
+    argParser.add_argument("--json", default = None, help = "also write the results to this file")
+    argParser.add_argument("--verbose", action = "store_true", help = "show log output")
+    args = argParser.parse_args()
+
+    if not args.verbose:
+        log.setLevel(logging.ERROR)
+
+    random.seed(1)
+
+    if not RMCommandThread.createInstance():
+        print "Error initializing Command Thread"
+        return 2
+
+    dbDir = tempfile.mkdtemp(prefix = "rm-readers-")
+    ok = True
+
+    try:
+        globalDbManager.initialize(dbDir)
+
+        generator = RMLoadGenerator(args.parsers, RMLoadParser.Densities["4hourly"], 6, args.runs_per_day)
+        generator.open()
+        generator.backfill(args.days)
+        lastForecast = generator.runAt(rmCurrentDayTimestamp() + 3600)
+
+        benchmark = RMBenchmark("Table readers (%d parsers, %d days, %d iterations)" % (args.parsers, args.days, args.iterations))
+
+        mixerTable = generator.mixerDataTable
+        parserTable = generator.parserDataTable
+        parserConfig = generator.parsers.keys()[0]
+
+        maxTimestamp = rmCurrentDayTimestamp() + 7 * 86400
+        minTimestamp = maxTimestamp - (args.days + 7) * 86400
+        conditionDays = range(rmCurrentDayTimestamp() - 30 * 86400, maxTimestamp, 86400)
+
+        ok &= compare(benchmark, "getRecordsByThreshold", args.iterations,
+                      legacyGetRecordsByThreshold, (minTimestamp, maxTimestamp),
+                      mixerTable.getRecordsByThreshold, (minTimestamp, maxTimestamp))
+        ok &= compare(benchmark, "getLastRecordsByThreshold", args.iterations,
+                      legacyGetLastRecordsByThreshold, (minTimestamp, maxTimestamp),
+                      mixerTable.getLastRecordsByThreshold, (minTimestamp, maxTimestamp))
+        ok &= compare(benchmark, "getLastRecordForDayForSimulator", args.iterations,
+                      legacyGetLastRecordForDayForSimulator, (rmCurrentDayTimestamp(), ),
+                      mixerTable.getLastRecordForDayForSimulator, (rmCurrentDayTimestamp(), ))
+        ok &= compare(benchmark, "getLastKnownConditionForDay", args.iterations,
+                      legacyGetLastKnownConditionForDays, (conditionDays, ),
+                      onCommandThread, ("getLastKnownConditionForDay", lambda days: [mixerTable.getLastKnownConditionForDay(day) for day in days], conditionDays))
+        ok &= compare(benchmark, "getRecordsByForecast", args.iterations,
+                      legacyGetRecordsByForecast, (),
+                      mixerTable.getRecordsByForecast, ())
+        ok &= compare(benchmark, "getRecordsForKey", args.iterations,
+                      legacyGetRecordsForKey, ((lastForecast.id, parserConfig.dbID), ),
+                      parserTable.getRecordsForKey, ((lastForecast.id, parserConfig.dbID), ))
+        ok &= compare(benchmark, "getRecordsByParserID", args.iterations,
+                      legacyGetRecordsByParserID, (parserConfig.dbID, ),
+                      parserTable.getRecordsByParserID, (parserConfig.dbID, ))
+
+        held = []
+        held.append(compareStreaming(benchmark, "history by forecast", args.iterations,
+                                     mixerTable.iterateRecordsByForecast, mixerTable.getRecordsByForecast, (True, )))
+        held.append(compareStreaming(benchmark, "history by parser", args.iterations,
+                                     parserTable.iterateRecordsByParserID, parserTable.getRecordsByParserID, (parserConfig.dbID, )))
+
+        for line in benchmark.report() + held:
+            print line
+
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(benchmark.asDict(), f, indent = 4)
+    finally:
+        RMCommandThread.instance.stop()
+        RMCommandThread.instance.join()
+        shutil.rmtree(dbDir, ignore_errors = True)
+
+    if ok:
+        return 0
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
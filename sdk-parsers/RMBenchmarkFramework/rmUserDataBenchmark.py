@@ -0,0 +1,169 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+#
+# Compares the binary parserData.userData encoding with the previous pickle one: encode/decode speed,
+# stored size and reading rows through the RMUserData converter with and without using userData.
+# Decoded values are checked against the original ones for both formats.
+#
+#   python RMBenchmarkFramework/rmUserDataBenchmark.py [--rows 20000] [--values 6] [--iterations 5]
+#
+
+import os, sys, json, random, shutil, sqlite3, tempfile, argparse, logging
+from cStringIO import StringIO
+import pickle
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")))
+
+from RMDataFramework.rmParserUserData import RMParserUserData, RMUserData_adaptToSQLite, RMUserData_convertFromSQLite
+from RMUtilsFramework.rmLogging import log
+
+from RMBenchmarkFramework.rmBenchmark import RMBenchmark
+
+##-----------------------------------------------------------------------------------------------------
+##
+## Previous pickle adapter/converter, kept here as the reference for the benchmark.
+##
+def legacyAdaptToSQLite(userData):
+    if userData == None:
+        return None
+
+    outputStream = StringIO()
+    pickler = pickle.Pickler(outputStream)
+    pickler.dump(userData)
+    return outputStream.getvalue()
+
+def legacyConvertFromSQLite(data):
+    if data == None:
+        return None
+
+    inputStream = StringIO(data)
+    unpickler = pickle.Unpickler(inputStream)
+    return unpickler.load()
+
+##-----------------------------------------------------------------------------------------------------
+##
+##
+def makeUserData(valuesCount):
+    userData = RMParserUserData()
+    for key in xrange(1, valuesCount + 1):
+        userData.data[key] = round(random.uniform(-50, 50), 2)
+    userData.data[valuesCount + 1] = "forecast for 2015-06-01T00:00:00Z"
+    return userData
+
+def encodeAll(adapter, values):
+    return [adapter(value) for value in values]
+
+def decodeAll(converter, encoded):
+    return [converter(str(value)).data for value in encoded]
+
+def createTable(dbDir, name, adapter, converter):
+    sqlite3.register_adapter(RMParserUserData, adapter)
+    sqlite3.register_converter("RMUserData", converter)
+
+    connection = sqlite3.connect(os.path.join(dbDir, name + ".sqlite"), detect_types = sqlite3.PARSE_DECLTYPES)
+    connection.text_factory = str
+    connection.execute("CREATE TABLE parserData (timestamp INTEGER NOT NULL, temperature DECIMAL DEFAULT NULL, userData RMUserData DEFAULT NULL)")
+    return connection
+
+def insertRows(connection, values):
+    connection.executemany("INSERT INTO parserData VALUES(?, ?, ?)", [(index, 20.5, value) for index, value in enumerate(values)])
+    connection.commit()
+
+def readRows(connection, useUserData):
+    count = 0
+    for row in connection.execute("SELECT timestamp, temperature, userData FROM parserData"):
+        if useUserData:
+            count += len(row[2].data)
+        else:
+            count += 1
+    return count
+
+def compareFormat(benchmark, sizes, dbDir, name, adapter, converter, values, iterations):
+    sqlite3.register_adapter(RMParserUserData, adapter)
+
+    encodeStage = benchmark.stage("encode", name)
+    for iteration in xrange(iterations):
+        encoded = encodeStage.measure(encodeAll, adapter, values)
+        encodeStage.addRecords(len(values))
+    encodedSize = sum([len(value) for value in encoded])
+    encodeStage.addBytes(encodedSize * iterations)
+
+    decodeStage = benchmark.stage("decode", name)
+    for iteration in xrange(iterations):
+        decoded = decodeStage.measure(decodeAll, converter, encoded)
+        decodeStage.addRecords(len(values))
+
+    ok = decoded == [value.data for value in values]
+    if not ok:
+        print "*** %s: decoded values differ from the original ones" % name
+
+    connection = createTable(dbDir, name, adapter, converter)
+    insertStage = benchmark.stage("insert rows", name)
+    insertStage.measure(insertRows, connection, values)
+    insertStage.addRecords(len(values))
+    connection.close()
+
+    sizes.append("%s: %.1f bytes per value, database file %d KB" % (name, float(encodedSize) / len(values),
+                                                                   os.path.getsize(os.path.join(dbDir, name + ".sqlite")) / 1024))
+
+    for useUserData, group in ((False, "read rows"), (True, "read userData")):
+        connection = createTable(dbDir, name + "-read", adapter, converter)
+        insertRows(connection, values)
+
+        stage = benchmark.stage(group, name)
+        for iteration in xrange(iterations):
+            stage.measure(readRows, connection, useUserData)
+            stage.addRecords(len(values))
+        connection.close()
+        os.remove(os.path.join(dbDir, name + "-read.sqlite"))
+
+    return ok
+
+def main():
+    argParser = argparse.ArgumentParser(description = "Compare the binary userData encoding with pickle.")
+    argParser.add_argument("--rows", type = int, default = 20000, help = "parserData rows with userData (default 20000)")
+    argParser.add_argument("--values", type = int, default = 6, help = "numeric values per row, one text value is added (default 6)")
+    argParser.add_argument("--iterations", type = int, default = 5, help = "runs per stage (default 5)")
+    argParser.add_argument("--json", default = None, help = "also write the results to this file")
+    args = argParser.parse_args()
+
+    log.setLevel(logging.ERROR)
+    random.seed(1)
+
+    values = [makeUserData(args.values) for i in xrange(args.rows)]
+    benchmark = RMBenchmark("parserData.userData encoding (%d rows, %d values, %d iterations)" % (args.rows, args.values + 1, args.iterations))
+
+    dbDir = tempfile.mkdtemp(prefix = "rm-userdata-")
+    sizes = []
+    ok = True
+
+    try:
+        ok &= compareFormat(benchmark, sizes, dbDir, "pickle", legacyAdaptToSQLite, legacyConvertFromSQLite, values, args.iterations)
+        ok &= compareFormat(benchmark, sizes, dbDir, "binary", RMUserData_adaptToSQLite, RMUserData_convertFromSQLite, values, args.iterations)
+
+        # Rows not converted yet are still readable with the new converter
+        legacy = encodeAll(legacyAdaptToSQLite, values[:100])
+        if decodeAll(RMUserData_convertFromSQLite, legacy) != [value.data for value in values[:100]]:
+            print "*** pickled values are not decoded by the binary converter"
+            ok = False
+
+        for line in benchmark.report() + sizes:
+            print line
+
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(benchmark.asDict(), f, indent = 4)
+    finally:
+        sqlite3.register_adapter(RMParserUserData, RMUserData_adaptToSQLite)
+        sqlite3.register_converter("RMUserData", RMUserData_convertFromSQLite)
+        shutil.rmtree(dbDir, ignore_errors = True)
+
+    if ok:
+        return 0
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+#
+# Fills the water log through RMWaterLogTable.addRecord()/updateRecord() the way programs run (one token per
+# program run, a few cycles per zone) and compares getRecordsEx() reading water_log_daily with the previous
+# implementation (GROUP BY tokenTimestamp over the whole log and summing the days in Python). Results of both
+# are compared and the daily table is checked against a rebuild from the log.
+#
+#   python RMBenchmarkFramework/rmWaterLogBenchmark.py [--days 365] [--programs 3] [--zones 8] [--iterations 20]
+#
+
+import os, sys, json, uuid, random, shutil, tempfile, argparse, logging
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")))
+
+from RMDatabaseFramework.rmDatabaseManager import globalDbManager
+from RMDatabaseFramework.rmMainDataTable import RMWaterLogTable
+from RMUtilsFramework.rmCommandThread import RMCommand, RMCommandThread
+from RMUtilsFramework.rmLogging import log
+from RMUtilsFramework.rmTimeUtils import rmCurrentDayTimestamp, rmGetStartOfDay, rmTimestampToDateAsString
+
+from RMBenchmarkFramework.rmBenchmark import RMBenchmark
+
+##-----------------------------------------------------------------------------------------------------
+##
+## Previous getRecordsEx(), kept here as the reference for the benchmark.
+##
+def legacyGetRecordsEx(database, tableName, minTimestamp, maxTimestamp, withManualPrograms):
+    records = database.execute("SELECT tokenTimestamp, SUM(real_sec) realDuration, SUM(user_sec) userDuration, usersch_id FROM %s "\
+                               "WHERE ?<=tokenTimestamp AND tokenTimestamp<? GROUP BY tokenTimestamp "\
+                               "ORDER BY tokenTimestamp" % tableName, (minTimestamp, maxTimestamp))
+
+    tempResults = OrderedDict()
+    for row in records:
+        if not withManualPrograms and int(row[3]) == 0:
+            continue
+
+        dayTimestamp = rmGetStartOfDay(int(row[0]))
+        totalDurations = tempResults.get(dayTimestamp, None)
+        if totalDurations is None:
+            tempResults[dayTimestamp] = [int(row[1]), int(row[2])]
+        else:
+            totalDurations[0] += int(row[1])
+            totalDurations[1] += int(row[2])
+
+    results = {"days": []}
+    for dayTimestamp, totalDurations in tempResults.iteritems():
+        results["days"].append({
+            "dayTimestamp": dayTimestamp,
+            "date": rmTimestampToDateAsString(dayTimestamp, "%Y-%m-%d"),
+            "realDuration": totalDurations[0],
+            "userDuration": totalDurations[1]
+        })
+    return results
+
+##-----------------------------------------------------------------------------------------------------
+##
+##
+def onCommandThread(name, function, *args):
+    cmd = RMCommand(name, True)
+    cmd.command = lambda: function(*args)
+    return RMCommandThread.instance.executeCommand(cmd)
+
+#-----------------------------------------------------------------------------------------------
+#
+# Programs run once a day at different hours, program 0 (manual watering) every few days. Each zone
+# gets 1-3 cycles and its real duration is set by updateRecord() when the cycle ends.
+#
+def fillLog(stage, waterLogTable, days, programs, zones):
+    firstDay = rmCurrentDayTimestamp() - days * 86400
+    cycles = 0
+    for day in xrange(days):
+        dayTimestamp = firstDay + day * 86400
+        for pid in xrange(programs + 1):
+            if pid == 0 and day % 3:
+                continue
+            token = uuid.uuid4().hex
+            start = tokenTimestamp = dayTimestamp + 3600 * (4 + pid * 2)
+            for zid in xrange(1, zones + 1):
+                for cycle in xrange(random.randint(1, 3)):
+                    userDuration = random.randint(60, 600)
+                    stage.measure(waterLogTable.addRecord, start, pid, zid, userDuration, userDuration, 0, 0, token, tokenTimestamp)
+                    stage.measure(waterLogTable.updateRecord, start, userDuration - random.randint(0, 30), 0)
+                    stage.addRecords(1)
+                    start += userDuration
+                    cycles += 1
+    return cycles
+
+def checkDailyTable(database, tableName, waterLogTable):
+    query = "SELECT day, usersch_id, zid, user_sec, real_sec, cycles FROM %s_daily ORDER BY day, usersch_id, zid" % tableName
+    maintained = database.execute(query).fetchall()
+    waterLogTable.rebuildDaily()
+    return maintained == database.execute(query).fetchall()
+
+def main():
+    argParser = argparse.ArgumentParser(description = "Compare getRecordsEx() on water_log_daily with the previous GROUP BY reader.")
+    argParser.add_argument("--days", type = int, default = 365, help = "days of water log (default 365)")
+    argParser.add_argument("--programs", type = int, default = 3, help = "programs running each day, manual watering is added (default 3)")
+    argParser.add_argument("--zones", type = int, default = 8, help = "zones per program (default 8)")
+    argParser.add_argument("--iterations", type = int, default = 20, help = "reads per range (default 20)")
+    argParser.add_argument("--json", default = None, help = "also write the results to this file")
+    args = argParser.parse_args()
+
+    log.setLevel(logging.ERROR)
+    random.seed(1)
+
+    if not RMCommandThread.createInstance():
+        print "Error initializing Command Thread"
+        return 2
+
+    benchmark = RMBenchmark("water_log getRecordsEx (%d days, %d programs, %d zones)" % (args.days, args.programs, args.zones))
+    dbDir = tempfile.mkdtemp(prefix = "rm-waterlog-")
+    ok = True
+
+    try:
+        globalDbManager.initialize(dbDir)
+        database = globalDbManager.mainDatabase
+        waterLogTable = RMWaterLogTable(database)
+
+        cycles = fillLog(benchmark.stage("fill", "add+update"), waterLogTable, args.days, args.programs, args.zones)
+
+        today = rmCurrentDayTimestamp()
+        ranges = [("last 7 days", today - 7 * 86400), ("last 30 days", today - 30 * 86400), ("all days", today - args.days * 86400)]
+
+        for name, minTimestamp in ranges:
+            for withManualPrograms in (False, True):
+                group = name + (" +manual" if withManualPrograms else "")
+                legacyStage = benchmark.stage(group, "previous")
+                currentStage = benchmark.stage(group, "daily")
+
+                for iteration in xrange(args.iterations):
+                    legacyResult = legacyStage.measure(onCommandThread, group, legacyGetRecordsEx, database, "water_log", minTimestamp, today + 86400, withManualPrograms)
+                    currentResult = currentStage.measure(waterLogTable.getRecordsEx, minTimestamp, today + 86400, withManualPrograms)
+                    legacyStage.addRecords(len(legacyResult["days"]))
+                    currentStage.addRecords(len(currentResult["days"]))
+
+                if legacyResult != currentResult:
+                    print "*** %s: results differ from the previous implementation" % group
+                    ok = False
+
+        if not onCommandThread("check", checkDailyTable, database, "water_log", waterLogTable):
+            print "*** water_log_daily differs from a rebuild from water_log"
+            ok = False
+
+        for line in benchmark.report():
+            print line
+        print "%d cycles, %d water_log_daily rows" % (cycles, onCommandThread("count", lambda: database.execute("SELECT COUNT(*) FROM water_log_daily").fetchone()[0]))
+
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(benchmark.asDict(), f, indent = 4)
+    finally:
+        RMCommandThread.instance.stop()
+        RMCommandThread.instance.join()
+        shutil.rmtree(dbDir, ignore_errors = True)
+
+    if ok:
+        return 0
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
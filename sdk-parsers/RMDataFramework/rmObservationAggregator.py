@@ -0,0 +1,314 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+import os, math, json, time
+
+from RMUtilsFramework.rmLogging import log
+from RMUtilsFramework.rmTimeUtils import rmGetStartOfDay
+
+#----------------------------------------------------------------------------------------
+#
+# Daily aggregates of the observations of personal weather stations. Each field keeps a few
+# numbers whatever the number of observations (running mean, extremes, rain total, wind vector)
+# and the observations are added to the aggregates of their day (rmGetStartOfDay). Days that
+# ended are kept until they are reported, the aggregates can be saved to a file so the day
+# totals survive a restart:
+#
+#   aggregator = RMDailyAggregator([
+#       RMAggregateField("temperature", RMStatsAggregate, mean = RMWeatherDataType.TEMPERATURE,
+#                        min = RMWeatherDataType.MINTEMP, max = RMWeatherDataType.MAXTEMP),
+#       RMAggregateField("rain", RMRainAggregate, total = RMWeatherDataType.RAIN)
+#   ], stateFile)
+#
+#   aggregator.add(timestamp, "temperature", 21.5)
+#   for day in aggregator.report():
+#       for key, value in day.observations().iteritems(): ...
+#
+
+class RMAggregate(object):
+    __slots__ = ()
+
+    def state(self):
+        return [getattr(self, name) for name in self.__slots__]
+
+    def restore(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+
+class RMStatsAggregate(RMAggregate):
+    """
+    Mean (Welford's running mean and variance), minimum, maximum and last value
+    """
+    __slots__ = ("count", "mean", "m2", "min", "max", "last")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = None
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        self.last = None
+
+    def add(self, value):
+        value = float(value)
+        self.count += 1
+        if self.count == 1:
+            self.mean = value
+            self.min = self.max = value
+        else:
+            delta = value - self.mean
+            self.mean += delta / self.count
+            self.m2 += delta * (value - self.mean)
+            if value < self.min:
+                self.min = value
+            if value > self.max:
+                self.max = value
+        self.last = value
+
+    @property
+    def variance(self):
+        if self.count < 2:
+            return None
+        return self.m2 / (self.count - 1)
+
+
+class RMRainAggregate(RMAggregate):
+    """
+    Accumulated rain of the day, from the rain of each observation interval (add) or from a day counter of the
+    station (addDayTotal, the largest value is kept as the counter only goes up during the day)
+    """
+    __slots__ = ("count", "total", "dayTotal")
+
+    def __init__(self):
+        self.count = 0
+        self.total = None
+        self.dayTotal = None
+
+    def add(self, amount):
+        self.count += 1
+        self.total = (self.total or 0.0) + float(amount)
+
+    def addDayTotal(self, total):
+        self.count += 1
+        if self.dayTotal is None or total > self.dayTotal:
+            self.dayTotal = float(total)
+        self.total = self.dayTotal
+
+
+class RMWindAggregate(RMAggregate):
+    """
+    Mean wind speed and the vector mean of speed and direction (degrees the wind is coming from)
+    """
+    __slots__ = ("count", "mean", "max", "vectorCount", "east", "north")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = None
+        self.max = None
+        self.vectorCount = 0
+        self.east = 0.0
+        self.north = 0.0
+
+    def add(self, speed, direction = None):
+        speed = float(speed)
+        self.count += 1
+        if self.count == 1:
+            self.mean = self.max = speed
+        else:
+            self.mean += (speed - self.mean) / self.count
+            if speed > self.max:
+                self.max = speed
+
+        if direction is not None:
+            angle = math.radians(direction)
+            self.vectorCount += 1
+            self.east += (speed * math.sin(angle) - self.east) / self.vectorCount
+            self.north += (speed * math.cos(angle) - self.north) / self.vectorCount
+
+    @property
+    def speed(self):
+        return self.mean
+
+    @property
+    def vectorSpeed(self):
+        if not self.vectorCount:
+            return None
+        return math.hypot(self.east, self.north)
+
+    @property
+    def direction(self):
+        if not self.vectorCount:
+            return None
+        return math.degrees(math.atan2(self.east, self.north)) % 360
+
+
+class RMAggregateField(object):
+    """
+    Aggregated observation: outputs maps the aggregate attributes to the weather data types they are reported as
+    """
+    def __init__(self, name, aggregateClass, **outputs):
+        self.name = name
+        self.aggregateClass = aggregateClass
+        self.outputs = outputs
+
+
+class RMDayAggregates(object):
+    __slots__ = ("day", "samples", "lastTimestamp", "fields", "aggregates")
+
+    def __init__(self, day, fields):
+        self.day = day
+        self.samples = 0
+        self.lastTimestamp = None
+        self.fields = fields
+        self.aggregates = {}
+
+    def __getitem__(self, name):
+        aggregate = self.aggregates.get(name, None)
+        if aggregate is None:
+            aggregate = self.aggregates[name] = self.fields[name].aggregateClass()
+        return aggregate
+
+    def add(self, name, *args):
+        self[name].add(*args)
+
+    def observations(self):
+        """
+        Returns {weather data type: value} of the fields that have observations
+        """
+        observations = {}
+        for name, aggregate in self.aggregates.iteritems():
+            for attribute, key in self.fields[name].outputs.iteritems():
+                value = getattr(aggregate, attribute)
+                if value is not None:
+                    observations[key] = value
+        return observations
+
+    def state(self):
+        return {"day": self.day, "samples": self.samples, "lastTimestamp": self.lastTimestamp,
+                "aggregates": dict((name, aggregate.state()) for name, aggregate in self.aggregates.iteritems())}
+
+    @staticmethod
+    def fromState(state, fields):
+        day = RMDayAggregates(state["day"], fields)
+        day.samples = state["samples"]
+        day.lastTimestamp = state["lastTimestamp"]
+        for name, aggregateState in state["aggregates"].iteritems():
+            if name in fields:
+                day[name].restore(aggregateState)
+        return day
+
+
+class RMDailyAggregator(object):
+    """
+    Aggregates of the current day and of the days that ended and weren't reported yet. With a stateFile the
+    aggregates are saved at most every saveInterval seconds (from report()), when ended days are reported and after
+    the first observation of a new day. Days without observations are neither saved nor reported.
+    """
+    StateVersion = 1
+
+    def __init__(self, fields, stateFile = None, keepDays = 3, saveInterval = 600):
+        self.fields = dict((field.name, field) for field in fields)
+        self.stateFile = stateFile
+        self.keepDays = keepDays
+        self.saveInterval = saveInterval
+        self.current = None
+        self.ended = []
+        self.lastSave = None
+        self.dayEnded = False # save pending until the new day has an observation
+        self.load()
+
+    def day(self, timestamp):
+        """
+        Returns the aggregates of the day of timestamp, a new day ends the current one. Returns None for days that
+        ended and were already reported.
+        """
+        start = rmGetStartOfDay(timestamp)
+        if self.current is not None:
+            if start == self.current.day:
+                return self.current
+            if start < self.current.day:
+                for day in self.ended:
+                    if day.day == start:
+                        return day
+                return None
+            self.ended = (self.ended + [self.current])[-self.keepDays:]
+            self.dayEnded = True
+
+        self.current = RMDayAggregates(start, self.fields)
+        return self.current
+
+    def sample(self, timestamp):
+        """
+        Returns the aggregates of the day of timestamp for a new sample (a packet with several fields), None for days
+        already reported
+        """
+        day = self.day(timestamp)
+        if day is not None:
+            day.samples += 1
+            self.__observed(day, timestamp)
+        return day
+
+    def add(self, timestamp, name, *args):
+        day = self.day(timestamp)
+        if day is None:
+            return None
+        day.add(name, *args)
+        self.__observed(day, timestamp)
+        return day
+
+    def report(self):
+        """
+        Returns the ended days (only once) and the current day
+        """
+        days = [day for day in self.ended + [self.current] if day is not None and day.lastTimestamp is not None]
+        reportedEnded = len(days) > 0 and days[0] is not self.current
+        self.ended = []
+        # Reported days are removed from the saved state right away, a restart doesn't report them again
+        if reportedEnded or self.lastSave is None or time.time() - self.lastSave >= self.saveInterval:
+            self.save()
+        return days
+
+    def save(self):
+        if self.stateFile is None:
+            return
+        days = [day for day in self.ended + [self.current] if day is not None and day.lastTimestamp is not None]
+        state = {"version": RMDailyAggregator.StateVersion, "days": [day.state() for day in days]}
+        tempFile = self.stateFile + ".tmp"
+        try:
+            with open(tempFile, "w") as f:
+                json.dump(state, f)
+            os.rename(tempFile, self.stateFile)
+            self.lastSave = time.time()
+        except (IOError, OSError), e:
+            log.error("Cannot save observation aggregates to %s: %s" % (self.stateFile, e))
+
+    def load(self):
+        if self.stateFile is None or not os.path.exists(self.stateFile):
+            return
+        try:
+            with open(self.stateFile) as f:
+                state = json.load(f)
+            if state.get("version") != RMDailyAggregator.StateVersion:
+                return
+            days = [RMDayAggregates.fromState(day, self.fields) for day in state["days"]]
+        except (IOError, OSError, ValueError, KeyError, TypeError), e:
+            log.error("Cannot load observation aggregates from %s: %s" % (self.stateFile, e))
+            return
+
+        # Days older than keepDays aren't reported anymore
+        oldest = rmGetStartOfDay(time.time()) - self.keepDays * 86400
+        days = [day for day in days if day.day >= oldest and day.lastTimestamp is not None]
+        if days:
+            self.current = days[-1]
+            self.ended = days[:-1]
+        self.lastSave = time.time()
+
+    def __observed(self, day, timestamp):
+        if day.lastTimestamp is None or timestamp > day.lastTimestamp:
+            day.lastTimestamp = timestamp
+        if self.dayEnded and day is self.current:
+            self.dayEnded = False
+            self.save()
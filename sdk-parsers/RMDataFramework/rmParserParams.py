@@ -4,7 +4,16 @@
 #          Codrin Juravle <codrin.juravle@mini-box.com>
 
 from cStringIO import StringIO
-import pickle
+import pickle, json
+
+#-----------------------------------------------------------------------------------------------
+#
+# Parser params used to be stored as one pickled dict in parser.params. They contain only
+# builtin types so the unpickler doesn't load any class.
+#
+class RMParserParams_Unpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError("params: %s.%s is not allowed" % (module, name))
 
 def RMParserParams_adaptToSQLite(params):
     if params == None:
@@ -20,6 +29,51 @@ def RMParserParams_convertFromSQLite(data):
         return None
 
     inputStream = StringIO(data)
-    unpickler = pickle.Unpickler(inputStream)
+    unpickler = RMParserParams_Unpickler(inputStream)
     return unpickler.load()
 
+#-----------------------------------------------------------------------------------------------
+#
+# Typed encoding of one params value for the parserParams table: (valueType, value)
+#
+#   'n' None, 'b' bool, 'i' int/long, 'f' float (repr), 's' str, 'u' unicode (utf-8),
+#   'j' lists/dicts as JSON (strings are restored as str like the ones read from the database)
+#
+def RMParserParams_encodeValue(value):
+    if value is None:
+        return "n", ""
+    if isinstance(value, bool):
+        return "b", str(int(value))
+    if isinstance(value, (int, long)):
+        return "i", str(value)
+    if isinstance(value, float):
+        return "f", repr(value)
+    if isinstance(value, str):
+        return "s", value
+    if isinstance(value, unicode):
+        return "u", value.encode("utf-8")
+    return "j", json.dumps(value, sort_keys = True, separators = (",", ":"))
+
+def RMParserParams_decodeValue(valueType, value):
+    if valueType == "n":
+        return None
+    if valueType == "b":
+        return value == "1"
+    if valueType == "i":
+        return int(value)
+    if valueType == "f":
+        return float(value)
+    if valueType == "s":
+        return value
+    if valueType == "u":
+        return value.decode("utf-8")
+    return RMParserParams_toStr(json.loads(value))
+
+def RMParserParams_toStr(value):
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    if isinstance(value, list):
+        return [RMParserParams_toStr(item) for item in value]
+    if isinstance(value, dict):
+        return dict([(RMParserParams_toStr(key), RMParserParams_toStr(item)) for key, item in value.iteritems()])
+    return value
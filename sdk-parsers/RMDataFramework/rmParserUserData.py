@@ -5,7 +5,9 @@
 
 
 from cStringIO import StringIO
-import pickle
+import pickle, struct, sqlite3
+
+from RMUtilsFramework.rmLogging import log
 
 class RMParserUserDataTypeEntry:
     def __init__(self, id = None, name = None):
@@ -15,12 +17,51 @@ class RMParserUserDataTypeEntry:
     def __repr__(self):
         return "(" + `self.id` + ", " + `self.name` + ")"
 
+##-----------------------------------------------------------------------------------------------------
+##
+## User values of a parserData row, keyed by userDataType id. Values read from the database are kept
+## encoded and only decoded when data is first used, so readers that don't look at userData don't pay
+## for decoding.
+##
 class RMParserUserData(object):
     cachedIDs = {}      # id -> RMParserUserDataTypeEntry
     cachedNames = {}    # name -> RMParserUserDataTypeEntry
 
     def __init__(self):
-        self.data = {}
+        self._data = {}
+        self._encoded = None
+
+    @staticmethod
+    def fromEncoded(encoded):
+        userData = RMParserUserData.__new__(RMParserUserData)
+        userData._data = None
+        userData._encoded = encoded
+        return userData
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = RMUserData_decode(self._encoded)
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+        self._encoded = None
+
+    # Pickled (legacy) rows only carry the data dict
+    def __getstate__(self):
+        return {"data": self.data}
+
+    def __setstate__(self, state):
+        self._data = state.get("data", {})
+        self._encoded = None
+
+    def __eq__(self, other):
+        return isinstance(other, RMParserUserData) and self.data == other.data
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
 
     def __repr__(self):
         text = ""
@@ -33,6 +74,7 @@ class RMParserUserData(object):
     def setValue(self, key,  value):
         if key in RMParserUserData.cachedNames:
             self.data[RMParserUserData.cachedNames[key].id] = value
+            self._encoded = None
 
     def getValue(self, key):
         if key in RMParserUserData.cachedNames:
@@ -41,21 +83,111 @@ class RMParserUserData(object):
                 return self.data[key]
         return None
 
+##-----------------------------------------------------------------------------------------------------
+##
+## Binary format (little endian):
+##
+##  version (B) = 1, count (H), then for each value: userDataType id (I), type (c), value
+##      'd' float (d), 'q' integer (q), 'b' bool (B), 's' str (H length + bytes), 'u' unicode (H length + utf-8), 'n' None
+##
+## Rows written before version 1 hold a pickled RMParserUserData (text starting with 'c' or '('), they are
+## loaded with an unpickler that only accepts the RMParserUserData class.
+##
+RMUserData_EncodingVersion = 1
+
+_header = struct.Struct("<BH")
+_entry = struct.Struct("<Ic")
+_double = struct.Struct("<d")
+_integer = struct.Struct("<q")
+_bool = struct.Struct("<B")
+_length = struct.Struct("<H")
+
+def RMUserData_encode(data):
+    parts = [_header.pack(RMUserData_EncodingVersion, len(data))]
+    for key, value in data.iteritems():
+        if isinstance(value, bool):
+            parts.append(_entry.pack(key, "b"))
+            parts.append(_bool.pack(value))
+        elif isinstance(value, float):
+            parts.append(_entry.pack(key, "d"))
+            parts.append(_double.pack(value))
+        elif isinstance(value, (int, long)) and -2**63 <= value < 2**63:
+            parts.append(_entry.pack(key, "q"))
+            parts.append(_integer.pack(value))
+        elif value is None:
+            parts.append(_entry.pack(key, "n"))
+        else:
+            if isinstance(value, unicode):
+                valueType = "u"
+                value = value.encode("utf-8")
+            else:
+                if not isinstance(value, str):
+                    log.debug("userData value %r for key %s is stored as text" % (value, key))
+                    value = str(value)
+                valueType = "s"
+            parts.append(_entry.pack(key, valueType))
+            parts.append(_length.pack(len(value)))
+            parts.append(value)
+    return "".join(parts)
+
+def RMUserData_decode(encoded):
+    if not encoded:
+        return {}
+
+    if ord(encoded[0]) != RMUserData_EncodingVersion:
+        return RMUserData_unpickle(encoded).data
+
+    data = {}
+    version, count = _header.unpack_from(encoded, 0)
+    offset = _header.size
+    for i in xrange(count):
+        key, valueType = _entry.unpack_from(encoded, offset)
+        offset += _entry.size
+        if valueType == "d":
+            data[key] = _double.unpack_from(encoded, offset)[0]
+            offset += _double.size
+        elif valueType == "q":
+            data[key] = _integer.unpack_from(encoded, offset)[0]
+            offset += _integer.size
+        elif valueType == "b":
+            data[key] = _bool.unpack_from(encoded, offset)[0] != 0
+            offset += _bool.size
+        elif valueType == "n":
+            data[key] = None
+        else:
+            length = _length.unpack_from(encoded, offset)[0]
+            offset += _length.size
+            value = encoded[offset:offset + length]
+            offset += length
+            if valueType == "u":
+                value = value.decode("utf-8")
+            data[key] = value
+    return data
+
+class RMUserData_Unpickler(pickle.Unpickler):
+    allowed = [("RMDataFramework.rmParserUserData", "RMParserUserData"), ("copy_reg", "_reconstructor"), ("__builtin__", "object")]
+
+    def find_class(self, module, name):
+        if (module, name) not in RMUserData_Unpickler.allowed:
+            raise pickle.UnpicklingError("userData: %s.%s is not allowed" % (module, name))
+        return pickle.Unpickler.find_class(self, module, name)
+
+def RMUserData_unpickle(data):
+    inputStream = StringIO(data)
+    unpickler = RMUserData_Unpickler(inputStream)
+    return unpickler.load()
+
 def RMUserData_adaptToSQLite(userData):
     if userData == None:
         return None
 
-    outputStream = StringIO()
-    pickler = pickle.Pickler(outputStream)
-    pickler.dump(userData)
-    return outputStream.getvalue()
+    # Values loaded from the database and not changed are written back as they are
+    if userData._encoded is None or userData._data is not None:
+        userData._encoded = RMUserData_encode(userData.data)
+    return sqlite3.Binary(userData._encoded)
 
 def RMUserData_convertFromSQLite(data):
     if data == None:
         return None
 
-    inputStream = StringIO(data)
-    unpickler = pickle.Unpickler(inputStream)
-    return unpickler.load()
-
-
+    return RMParserUserData.fromEncoded(data)
@@ -109,6 +109,8 @@ class RMUserSettings:
         self.mixerHistorySize = 365
         self.simulatorHistorySize = 0
         self.waterLogHistorySize = 365
+        self.pastValuesHistorySize = 365
+        self.availableWaterHistorySize = 365
 
         self.doyDownloadUrl = "http://graphs.rainmachine.com"
 
@@ -0,0 +1,51 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+#
+# Version 17: secondary indexes for the retention deletes and the day/parser lookups that can't use the
+# composite primary keys (they don't start with timestamp/parserID/tokenTimestamp).
+# New databases get the same indexes from the table initialize() methods.
+#
+
+from RMUtilsFramework.rmLogging import log
+from RMDatabaseFramework.rmDatabaseManager import globalDbManager
+
+parserIndexes = [
+    ("parserData", "CREATE INDEX IF NOT EXISTS parserData_timestamp ON parserData(timestamp)"),
+    ("parserData", "CREATE INDEX IF NOT EXISTS parserData_parserID_timestamp ON parserData(parserID, timestamp, forecastID)"),
+]
+
+mixerIndexes = [
+    ("mixerData", "CREATE INDEX IF NOT EXISTS mixerData_timestamp_forecastID ON mixerData(timestamp, forecastID)"),
+    ("mixerData", "CREATE INDEX IF NOT EXISTS mixerData_forecastTimestamp ON mixerData(forecastTimestamp, timestamp)"),
+]
+
+mainIndexes = [
+    ("water_log", "CREATE INDEX IF NOT EXISTS water_log_tokenTimestamp ON water_log(tokenTimestamp, usersch_id, zid, user_sec, real_sec)"),
+    ("water_log_fake", "CREATE INDEX IF NOT EXISTS water_log_fake_tokenTimestamp ON water_log_fake(tokenTimestamp, usersch_id, zid, user_sec, real_sec)"),
+]
+
+#----------------------------------------------------------------------------------
+#
+# Tables that don't exist yet are skipped, they are created with their indexes.
+#
+def createIndexes(database, indexes):
+    if not database or not database.isOpen():
+        return False
+
+    for table, query in indexes:
+        row = database.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name=?", (table, )).fetchone()
+        if row and row[0] > 0:
+            log.info("... %s" % query)
+            database.execute(query)
+
+    database.commit()
+    return True
+
+def performUpdate():
+    success = createIndexes(globalDbManager.parserDatabase, parserIndexes)
+    success = createIndexes(globalDbManager.mixerDatabase, mixerIndexes) and success
+    success = createIndexes(globalDbManager.mainDatabase, mainIndexes) and success
+    return success
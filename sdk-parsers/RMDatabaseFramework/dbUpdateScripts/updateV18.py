@@ -0,0 +1,26 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+#
+# Version 18: mixerDataLatest table with the newest forecast row for each day, kept up to date by
+# triggers on mixerData. The table and triggers are created by RMMixerDataTable, the existing
+# mixerData rows are copied here.
+#
+
+from RMUtilsFramework.rmLogging import log
+from RMDatabaseFramework.rmDatabaseManager import globalDbManager
+from RMDatabaseFramework.rmMixerDataTable import RMMixerDataTable
+
+def performUpdate():
+    database = globalDbManager.mixerDatabase
+    if not database or not database.isOpen():
+        return False
+
+    mixerDataTable = RMMixerDataTable(database)
+    mixerDataTable.rebuildLatest()
+
+    row = database.execute("SELECT COUNT(*) FROM mixerDataLatest").fetchone()
+    log.info("... mixerDataLatest has %d days" % row[0])
+    return True
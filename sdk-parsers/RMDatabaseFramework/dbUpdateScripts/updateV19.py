@@ -0,0 +1,47 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+#
+# Version 19: parserData.userData is stored in the binary format from rmParserUserData instead of pickle.
+# Pickled values were written as text, binary ones are blobs, so only text rows are converted.
+#
+
+from RMUtilsFramework.rmLogging import log
+from RMDatabaseFramework.rmDatabaseManager import globalDbManager
+from RMDataFramework.rmParserUserData import RMUserData_unpickle, RMUserData_adaptToSQLite
+
+BatchSize = 500
+
+def performUpdate():
+    database = globalDbManager.parserDatabase
+    if not database or not database.isOpen():
+        return False
+
+    row = database.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name='parserData'").fetchone()
+    if not row or row[0] == 0:
+        return True
+
+    rowIDs = [row[0] for row in database.execute("SELECT rowid FROM parserData WHERE typeof(userData)='text'").fetchall()]
+
+    for start in xrange(0, len(rowIDs), BatchSize):
+        batch = rowIDs[start:start + BatchSize]
+
+        # CAST skips the RMUserData converter so the raw pickle is read
+        rows = database.execute("SELECT rowid, CAST(userData AS BLOB) FROM parserData WHERE rowid IN (%s)" % ",".join(["?"] * len(batch)), batch).fetchall()
+
+        values = []
+        for rowID, pickled in rows:
+            try:
+                userData = RMUserData_unpickle(str(pickled))
+                values.append((RMUserData_adaptToSQLite(userData), rowID))
+            except Exception, e:
+                log.error("... parserData row %d: can't convert userData (%s), value dropped" % (rowID, e))
+                values.append((None, rowID))
+
+        database.executeMany("UPDATE parserData SET userData=? WHERE rowid=?", values)
+
+    database.commit()
+    log.info("... converted userData of %d parserData rows" % len(rowIDs))
+    return True
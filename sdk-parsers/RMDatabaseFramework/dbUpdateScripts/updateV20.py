@@ -0,0 +1,41 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+#
+# Version 20: parser params are moved from the pickled parser.params column to the parserParams table,
+# one typed row per key. The column is kept (sqlite can't drop it) and set to NULL.
+#
+
+from RMUtilsFramework.rmLogging import log
+from RMDatabaseFramework.rmDatabaseManager import globalDbManager
+from RMDatabaseFramework.rmParserDataTable import RMParserParamsTable
+from RMDataFramework.rmParserParams import RMParserParams_convertFromSQLite
+
+def performUpdate():
+    database = globalDbManager.parserDatabase
+    if not database or not database.isOpen():
+        return False
+
+    row = database.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name='parser'").fetchone()
+    if not row or row[0] == 0:
+        return True
+
+    paramsTable = RMParserParamsTable(database)
+
+    # CAST skips the RMParaserParams converter so a bad pickle doesn't fail the whole query
+    rows = database.execute("SELECT ID, CAST(params AS BLOB) FROM parser WHERE params IS NOT NULL").fetchall()
+
+    for parserID, pickled in rows:
+        try:
+            params = RMParserParams_convertFromSQLite(str(pickled))
+            if isinstance(params, dict):
+                paramsTable.setParams(parserID, params, False)
+        except Exception, e:
+            log.error("... parser %d: can't convert params (%s), defaults will be used" % (parserID, e))
+
+    database.execute("UPDATE parser SET params=NULL")
+    database.commit()
+    log.info("... moved params of %d parsers to parserParams" % len(rows))
+    return True
@@ -0,0 +1,24 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+#
+# Version 21: water_log.tokenTimestampInt, an indexed integer copy of the text tokenTimestamp column used by
+# the daily retention sweep. RMWaterLogTable adds the column and fills it from tokenTimestamp.
+#
+
+from RMUtilsFramework.rmLogging import log
+from RMDatabaseFramework.rmDatabaseManager import globalDbManager
+from RMDatabaseFramework.rmMainDataTable import RMWaterLogTable
+
+def performUpdate():
+    database = globalDbManager.mainDatabase
+    if not database or not database.isOpen():
+        return False
+
+    for fake in (False, True):
+        waterLogTable = RMWaterLogTable(database, fake)
+        log.info("... %s: tokenTimestampInt added" % waterLogTable._tableName)
+
+    return True
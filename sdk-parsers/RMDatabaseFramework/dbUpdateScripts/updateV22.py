@@ -0,0 +1,24 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+#
+# Version 22: water_log_daily/water_log_fake_daily, durations per day, program and zone maintained by triggers
+# and read by RMWaterLogTable.getRecordsEx(). RMWaterLogTable creates them and fills them from the log.
+#
+
+from RMUtilsFramework.rmLogging import log
+from RMDatabaseFramework.rmDatabaseManager import globalDbManager
+from RMDatabaseFramework.rmMainDataTable import RMWaterLogTable
+
+def performUpdate():
+    database = globalDbManager.mainDatabase
+    if not database or not database.isOpen():
+        return False
+
+    for fake in (False, True):
+        waterLogTable = RMWaterLogTable(database, fake)
+        log.info("... %s_daily created" % waterLogTable._tableName)
+
+    return True
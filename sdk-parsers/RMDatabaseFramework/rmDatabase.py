@@ -56,7 +56,7 @@ class RMTable(object):
 ##
 class RMVersionTable(RMTable):
 
-    CurrentVersion = 16
+    CurrentVersion = 22
 
     def initialize(self):
         if self.database.isOpen():
@@ -88,6 +88,9 @@ class RMVersionTable(RMTable):
 ##
 ##
 class RMDatabase:
+
+    FetchBatchSize = 1024 # rows per fetchmany() in fetchBatches()
+
     def __init__(self, fileName):
         self.createIfNotExists = True
         self.fileName = fileName
@@ -169,6 +172,44 @@ class RMDatabase:
             elif(paramCount == 2):
                 self.cursor.executemany(args[0], args[1])
 
+    #-----------------------------------------------------------------------------------------------
+    #
+    # Generator over the rows of a query in lists of at most batchSize rows. Rows are fetched on a
+    # private cursor so other queries can run between batches. Each batch is fetched on the command
+    # thread, the rows are consumed on the caller's thread.
+    #
+    def fetchBatches(self, query, params = (), batchSize = None):
+        if batchSize is None:
+            batchSize = RMDatabase.FetchBatchSize
+
+        cursor = self.__executeOnCommandThread("rmDatabaseFetchOpen", self.__openCursor, query, params)
+        if cursor is None:
+            return
+
+        try:
+            while True:
+                rows = self.__executeOnCommandThread("rmDatabaseFetch", cursor.fetchmany, batchSize)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            self.__executeOnCommandThread("rmDatabaseFetchClose", cursor.close)
+
+    def __openCursor(self, query, params):
+        if(self.connection):
+            cursor = self.connection.cursor()
+            cursor.execute(query, params)
+            return cursor
+        return None
+
+    def __executeOnCommandThread(self, name, command, *args):
+        if not USE_COMMAND_THREAD__ or RMCommandThread.instance.runsOnThisThread():
+            return command(*args)
+        cmd = RMCommand(name, True)
+        cmd.command = command
+        cmd.args = args
+        return RMCommandThread.instance.executeCommand(cmd)
+
     def commit(self):
         if not USE_COMMAND_THREAD__ or RMCommandThread.instance.runsOnThisThread():
             self.__commit()
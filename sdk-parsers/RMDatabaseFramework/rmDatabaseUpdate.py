@@ -87,4 +87,11 @@ class RMDatabaseUpdate:
                 log.error(e)
                 return False
 
+            if not success:
+                log.error("... database upgrade %s failed" % scriptPath)
+                return False
+
+            # Record each applied step so a failed upgrade resumes from there
+            globalDbManager.mainDatabase.versionTable.setVersion(version)
+
         return True
@@ -0,0 +1,111 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+import os
+
+from RMUtilsFramework.rmLogging import log
+from rmDatabase import RMDatabase
+
+##-----------------------------------------------------------------------------------------------------
+##
+## Copies a history table (water_log, pastValues, availableWater) from another database, usually the one
+## of a Sprinkler V1 device. Source rows are read in chunks ordered by rowid and each chunk is inserted
+## with executemany and committed together with the import position (historyImport table), so memory
+## doesn't grow with the history and an interrupted import continues where it stopped the next time it
+## is started. The destination table is emptied when an import starts, not when it resumes.
+##
+class RMHistoryImport:
+
+    ChunkSize = 2000
+
+    def __init__(self, database, tableName, columns, sourceColumns = None, transform = None, chunkSize = None):
+        self.database = database
+        self.tableName = tableName
+        self.columns = columns
+        self.sourceColumns = sourceColumns or columns
+        self.transform = transform  # source row (without rowid) -> values for columns
+        self.chunkSize = chunkSize or RMHistoryImport.ChunkSize
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    # progress(imported, total) is called after each committed chunk. Returns True when all rows
+    # were imported, False if the source can't be read or the import stopped (it can be resumed).
+    #
+    def run(self, filePath, progress = None):
+        if not self.database.isOpen():
+            return False
+
+        source = os.path.abspath(filePath)
+        sourceDB = RMDatabase(filePath)
+        sourceDB.createIfNotExists = False
+        if not sourceDB.open():
+            return False
+
+        try:
+            position = self.__start(source, sourceDB)
+            if position is None:
+                log.info("Import %s from %s: no rows" % (self.tableName, source))
+                return False
+
+            lastRowID, imported, total = position
+            if lastRowID > 0:
+                log.info("Import %s from %s: resuming after %d of %d rows" % (self.tableName, source, imported, total))
+
+            query = "SELECT rowid, %s FROM %s WHERE rowid>? ORDER BY rowid" % (", ".join(self.sourceColumns), self.tableName)
+            insert = "INSERT INTO %s(%s) VALUES(%s)" % (self.tableName, ", ".join(self.columns), ", ".join(["?"] * len(self.columns)))
+
+            for rows in sourceDB.fetchBatches(query, (lastRowID, ), self.chunkSize):
+                rows = [tuple(row) for row in rows]
+                if self.transform:
+                    values = [self.transform(row[1:]) for row in rows]
+                else:
+                    values = [tuple(row[1:]) for row in rows]
+
+                lastRowID = rows[-1][0]
+                imported += len(rows)
+
+                self.database.executeMany(insert, values)
+                self.database.execute("UPDATE historyImport SET lastRowID=?, imported=? WHERE source=? AND tableName=?",
+                                      (lastRowID, imported, source, self.tableName))
+                self.database.commit()
+
+                log.debug("Import %s from %s: %d of %d rows" % (self.tableName, source, imported, total))
+                if progress:
+                    progress(imported, total)
+
+            self.database.execute("DELETE FROM historyImport WHERE source=? AND tableName=?", (source, self.tableName))
+            self.database.commit()
+            log.info("Import %s from %s: %d rows imported" % (self.tableName, source, imported))
+            return True
+        except Exception, e:
+            log.error("Import %s from %s stopped, it will resume on the next import" % (self.tableName, source))
+            log.exception(e)
+            self.database.connection.rollback()
+            return False
+        finally:
+            sourceDB.close()
+
+    def __start(self, source, sourceDB):
+        self.database.execute("CREATE TABLE IF NOT EXISTS historyImport ("\
+                                "source TEXT NOT NULL, "\
+                                "tableName TEXT NOT NULL, "\
+                                "lastRowID INTEGER NOT NULL DEFAULT 0, "\
+                                "imported INTEGER NOT NULL DEFAULT 0, "\
+                                "total INTEGER NOT NULL DEFAULT 0, "\
+                                "PRIMARY KEY(source, tableName)"\
+                                ")")
+
+        row = self.database.execute("SELECT lastRowID, imported, total FROM historyImport WHERE source=? AND tableName=?", (source, self.tableName)).fetchone()
+        if row:
+            return row[0], row[1], row[2]
+
+        total = sourceDB.execute("SELECT COUNT(*) FROM %s" % self.tableName).fetchone()[0]
+        if total == 0:
+            return None
+
+        self.database.execute("DELETE FROM %s" % self.tableName)
+        self.database.execute("INSERT INTO historyImport(source, tableName, total) VALUES(?, ?, ?)", (source, self.tableName, total))
+        self.database.commit()
+        return 0, 0, total
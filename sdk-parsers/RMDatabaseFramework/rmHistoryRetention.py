@@ -0,0 +1,60 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+from RMUtilsFramework.rmLogging import log
+from RMUtilsFramework.rmTimeUtils import rmCurrentDayTimestamp
+from RMDataFramework.rmUserSettings import globalSettings
+
+##-----------------------------------------------------------------------------------------------------
+##
+## History retention for the tables that grow by day. Instead of deleting old rows on every insert each
+## table asks for a sweep when it is written and the sweep only runs the first time on each day. The
+## number of days kept comes from the *HistorySize settings, a negative value disables the sweep.
+##
+class RMHistoryRetention:
+
+    Policy = {
+        "water_log":            "waterLogHistorySize",
+        "water_log_fake":       "waterLogHistorySize",
+        "parserData":           "parserHistorySize",
+        "mixerData":            "mixerHistorySize",
+        "pastValues":           "pastValuesHistorySize",
+        "pastValues_fake":      "pastValuesHistorySize",
+        "availableWater":       "availableWaterHistorySize",
+        "availableWater_fake":  "availableWaterHistorySize",
+    }
+
+    def __init__(self):
+        self.__lastSweeps = {} # (database file, table, key) -> day timestamp of the last sweep
+
+    def historySize(self, tableName):
+        settingName = RMHistoryRetention.Policy.get(tableName, None)
+        if settingName is None:
+            return None
+        return getattr(globalSettings, settingName, None)
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    # Calls delete(dayTimestamp) with the first day to keep if tableName (and key, for tables swept in
+    # parts like parserData by parser) wasn't swept today. Returns True if the sweep was done.
+    #
+    def sweep(self, database, tableName, delete, key = None):
+        dayTimestamp = rmCurrentDayTimestamp()
+        sweepKey = (database.fileName, tableName, key)
+        if self.__lastSweeps.get(sweepKey, None) == dayTimestamp:
+            return False
+
+        historySize = self.historySize(tableName)
+        if historySize is not None and historySize >= 0:
+            log.debug("Retention: sweeping %s %s older than %d days" % (tableName, "" if key is None else key, historySize))
+            delete(dayTimestamp - historySize * 86400)
+
+        self.__lastSweeps[sweepKey] = dayTimestamp
+        return True
+
+    def reset(self):
+        self.__lastSweeps.clear()
+
+globalHistoryRetention = RMHistoryRetention()
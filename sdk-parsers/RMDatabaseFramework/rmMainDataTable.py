@@ -6,7 +6,9 @@
 import uuid
 
 from collections import OrderedDict
-from rmDatabase import RMTable, RMDatabase
+from rmDatabase import RMTable
+from rmHistoryRetention import globalHistoryRetention
+from rmHistoryImport import RMHistoryImport
 from RMUtilsFramework.rmLogging import log
 from RMUtilsFramework.rmTimeUtils import rmCurrentTimestamp, rmGetStartOfDay, rmTimestampToDateAsString
 from RMDataFramework.rmMainDataRecords import RMPastValues, RMAvailableWaterValues
@@ -460,17 +462,87 @@ class RMWaterLogTable(RMTable):
                                     "flag INTEGER NOT NULL  DEFAULT 0, "\
                                     "token VARCHAR(32) NOT NULL, "\
                                     "tokenTimestamp VARCHAR(32) NOT NULL, "\
+                                    "tokenTimestampInt INTEGER NOT NULL DEFAULT 0, "\
                                     "PRIMARY KEY(ts_started, usersch_id, zid)"\
                             ")" % self._tableName)
+
+        # tokenTimestamp is text so comparing it with a timestamp is a string comparison, retention uses
+        # the integer copy (database version 21)
+        columns = [row[1] for row in self.database.execute("PRAGMA table_info(%s)" % self._tableName)]
+        if "tokenTimestampInt" not in columns:
+            self.database.execute("ALTER TABLE %s ADD COLUMN tokenTimestampInt INTEGER NOT NULL DEFAULT 0" % self._tableName)
+            self.database.execute("UPDATE %s SET tokenTimestampInt=CAST(tokenTimestamp AS INTEGER)" % self._tableName)
+
+        # Range reads ordered by tokenTimestamp and daily sums (database version 17)
+        self.database.execute("CREATE INDEX IF NOT EXISTS %s_tokenTimestamp ON %s(tokenTimestamp, usersch_id, zid, user_sec, real_sec)" % (self._tableName, self._tableName))
+        self.database.execute("CREATE INDEX IF NOT EXISTS %s_tokenTimestampInt ON %s(tokenTimestampInt)" % (self._tableName, self._tableName))
+
+        self.__createDailyTable()
         self.database.commit()
 
+    #-----------------------------------------------------------------------------------------------
+    #
+    # <table>_daily holds the durations and number of cycles per day (start of the local day of
+    # tokenTimestamp), program and zone. It is maintained by triggers on every insert, update and
+    # delete so the retention sweeps and the V1 import keep it right too. (database version 22)
+    #
+    def __createDailyTable(self):
+        dailyTableName = self._tableName + "_daily"
+        exists = self.database.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name=?", (dailyTableName, )).fetchone()[0]
+
+        self.database.execute("CREATE TABLE IF NOT EXISTS %s ("\
+                                    "day INTEGER NOT NULL, "\
+                                    "usersch_id INTEGER NOT NULL, "\
+                                    "zid INTEGER NOT NULL, "\
+                                    "user_sec INTEGER NOT NULL DEFAULT 0, "\
+                                    "real_sec INTEGER NOT NULL DEFAULT 0, "\
+                                    "cycles INTEGER NOT NULL DEFAULT 0, "\
+                                    "PRIMARY KEY(day, usersch_id, zid)"\
+                            ")" % dailyTableName)
+
+        # Same day as rmGetStartOfDay(), both use the local time zone of the process
+        day = "CAST(strftime('%%s', date(%s.tokenTimestampInt, 'unixepoch', 'localtime'), 'utc') AS INTEGER)"
+        keys = {}
+        for row in ("NEW", "OLD"):
+            keys[row] = "day=%s AND usersch_id=%s.usersch_id AND zid=%s.zid" % (day % row, row, row)
+
+        # No OR IGNORE here, an INSERT OR REPLACE on the log would turn it into a REPLACE of the day row
+        addNew = "INSERT INTO %s(day, usersch_id, zid) SELECT %s, NEW.usersch_id, NEW.zid WHERE NOT EXISTS (SELECT NULL FROM %s WHERE %s); "\
+                 "UPDATE %s SET user_sec=user_sec+NEW.user_sec, real_sec=real_sec+NEW.real_sec, cycles=cycles+1 WHERE %s; " \
+                 % (dailyTableName, day % "NEW", dailyTableName, keys["NEW"], dailyTableName, keys["NEW"])
+
+        removeOld = "UPDATE %s SET user_sec=user_sec-OLD.user_sec, real_sec=real_sec-OLD.real_sec, cycles=cycles-1 WHERE %s; "\
+                    "DELETE FROM %s WHERE %s AND cycles<=0; " \
+                    % (dailyTableName, keys["OLD"], dailyTableName, keys["OLD"])
+
+        self.database.execute("CREATE TRIGGER IF NOT EXISTS %s_insert AFTER INSERT ON %s BEGIN %s END" % (dailyTableName, self._tableName, addNew))
+        self.database.execute("CREATE TRIGGER IF NOT EXISTS %s_delete AFTER DELETE ON %s BEGIN %s END" % (dailyTableName, self._tableName, removeOld))
+        self.database.execute("CREATE TRIGGER IF NOT EXISTS %s_update AFTER UPDATE OF usersch_id, zid, user_sec, real_sec, tokenTimestampInt ON %s "\
+                              "BEGIN %s%s END" % (dailyTableName, self._tableName, removeOld, addNew))
+
+        if not exists:
+            self.rebuildDaily(False)
+
+    def rebuildDaily(self, commit = True):
+        if(self.database.isOpen()):
+            dailyTableName = self._tableName + "_daily"
+            self.database.execute("DELETE FROM %s" % dailyTableName)
+            self.database.execute("INSERT INTO %s(day, usersch_id, zid, user_sec, real_sec, cycles) "\
+                                  "SELECT CAST(strftime('%%s', date(tokenTimestampInt, 'unixepoch', 'localtime'), 'utc') AS INTEGER) dayTs, usersch_id, zid, "\
+                                  "SUM(user_sec), SUM(real_sec), COUNT(*) FROM %s GROUP BY dayTs, usersch_id, zid" % (dailyTableName, self._tableName))
+            if commit:
+                self.database.commit()
+
     def addRecord(self, startTime, pid, zid, userDuration, machineDuration, realDuration, flag, token, tokenTimestamp):
         if(self.database.isOpen()):
 
-            self.deleteRecordsByHistory(False)
+            globalHistoryRetention.sweep(self.database, self._tableName, lambda dayTimestamp: self.deleteRecordsByDayThreshold(dayTimestamp, False))
 
-            self.database.execute("INSERT OR REPLACE INTO %s VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?)" % self._tableName,
-                                (startTime, pid, zid, userDuration, machineDuration, realDuration, flag, token, tokenTimestamp))
+            # REPLACE doesn't run the delete trigger for the replaced row, remove it first so the daily sums stay right
+            self.database.execute("DELETE FROM %s WHERE ts_started=? AND usersch_id=? AND zid=?" % self._tableName, (startTime, pid, zid))
+            self.database.execute("INSERT OR REPLACE INTO %s(ts_started, usersch_id, zid, user_sec, machine_sec, real_sec, flag, token, tokenTimestamp, tokenTimestampInt) "\
+                                  "VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, CAST(? AS INTEGER))" % self._tableName,
+                                (startTime, pid, zid, userDuration, machineDuration, realDuration, flag, token, tokenTimestamp, tokenTimestamp))
             self.database.commit()
             return True
         return False
@@ -484,9 +556,11 @@ class RMWaterLogTable(RMTable):
         return False
 
     def deleteRecordsByHistory(self, commit = True):
+        self.deleteRecordsByDayThreshold(rmCurrentDayTimestamp() - globalSettings.waterLogHistorySize * 86400, commit)
+
+    def deleteRecordsByDayThreshold(self, dayTimestamp, commit = True):
         if(self.database.isOpen()):
-            threshold = rmCurrentDayTimestamp() - globalSettings.waterLogHistorySize * 86400
-            self.database.execute("DELETE FROM %s WHERE tokenTimestamp < ?" % self._tableName, (threshold, ))
+            self.database.execute("DELETE FROM %s WHERE tokenTimestampInt < ?" % self._tableName, (dayTimestamp, ))
             if commit:
                 self.database.commit()
 
@@ -587,6 +661,10 @@ class RMWaterLogTable(RMTable):
     def getRecordsEx(self, minTimestamp, maxTimestamp, withManualPrograms = False):
         if(self.database.isOpen()):
 
+            # Whole days are read from the daily table, one row per day
+            if (not minTimestamp or rmGetStartOfDay(minTimestamp) == minTimestamp) and (not maxTimestamp or rmGetStartOfDay(maxTimestamp) == maxTimestamp):
+                return self.__getDailyRecords(minTimestamp, maxTimestamp, withManualPrograms)
+
             #if withManualPrograms:
             #    sqlCondition = " AND usersch_id != 0 "
             #    sqlConditionForced = " WHERE usersch_id != 0"
@@ -649,6 +727,36 @@ class RMWaterLogTable(RMTable):
 
         return None
 
+    def __getDailyRecords(self, minTimestamp, maxTimestamp, withManualPrograms):
+        conditions = []
+        params = []
+        if minTimestamp:
+            conditions.append("?<=day")
+            params.append(minTimestamp)
+        if maxTimestamp:
+            conditions.append("day<?")
+            params.append(maxTimestamp)
+        if not withManualPrograms:
+            conditions.append("usersch_id!=0")
+
+        where = ""
+        if conditions:
+            where = "WHERE " + " AND ".join(conditions) + " "
+
+        records = self.database.execute("SELECT day, SUM(real_sec), SUM(user_sec) FROM %s_daily %s"\
+                                        "GROUP BY day ORDER BY day" % (self._tableName, where), params)
+
+        results = {"days": []}
+        for row in records:
+            results["days"].append({
+                "dayTimestamp": row[0],
+                "date": rmTimestampToDateAsString(row[0], "%Y-%m-%d"),
+                "realDuration": row[1],
+                "userDuration": row[2]
+            })
+
+        return results
+
     def getZoneRealWateringTime(self, programID, zoneID, minTimestamp, maxTimestamp):
         if(self.database.isOpen()):
             if programID is None:
@@ -682,44 +790,26 @@ class RMWaterLogTable(RMTable):
         return None
 
 
-    def importFromSprinklerV1Db(self, filePath):
-        if(self.database.isOpen()):
-            v1DB = RMDatabase(filePath)
-            if not v1DB.open():
-                return False
+    #-----------------------------------------------------------------------------------------------
+    #
+    # Imports the log of a Sprinkler V1 database in chunks, an interrupted import resumes on the next
+    # call. The cycles of each day are grouped under one token, the same one on every resume.
+    #
+    def importFromSprinklerV1Db(self, filePath, progress = None):
+        days = {} # day timestamp -> token, one entry per day of log
 
-            result = False
-            try:
-                data = OrderedDict()
-                valuesToInsert = []
-
-                rows = v1DB.execute("SELECT ts_started, usersch_id, zid, user_sec, machine_sec, real_sec, flag FROM %s ORDER BY ts_started, zid" % self._tableName)
-                for row in rows:
-                    dayTimestamp = rmGetStartOfDay(int(row[0]))
-
-                    dayData = data.get(dayTimestamp, None)
-                    if dayData is None:
-                        dayData = {
-                            "token": uuid.uuid4().hex,
-                            "tokenTimestamp": dayTimestamp
-                        }
-                        data[dayTimestamp] = dayData
-
-                    valuesToInsert.append([row[0], row[1], row[2], row[3], row[4], row[5], row[6], dayData["token"], dayData["tokenTimestamp"]])
-
-                if valuesToInsert:
-                    self.database.execute("DELETE FROM %s" % self._tableName)
-                    self.database.executeMany("INSERT INTO %s(ts_started, usersch_id, zid, user_sec, machine_sec, real_sec, flag, token, tokenTimestamp) "\
-                                              "VALUES(?,?,?,?,?,?,?,?,?)" % self._tableName, valuesToInsert)
-                    self.database.commit()
-                    result = True
-            except Exception, e:
-                log.exception(e)
-
-            v1DB.close()
-            return result
+        def transform(row):
+            dayTimestamp = rmGetStartOfDay(int(row[0]))
+            token = days.get(dayTimestamp, None)
+            if token is None:
+                token = days[dayTimestamp] = uuid.uuid5(uuid.NAMESPACE_OID, "%s-%d" % (self._tableName, dayTimestamp)).hex
+            return row + (token, dayTimestamp, dayTimestamp)
 
-        return False
+        importer = RMHistoryImport(self.database, self._tableName,
+                                   ["ts_started", "usersch_id", "zid", "user_sec", "machine_sec", "real_sec", "flag", "token", "tokenTimestamp", "tokenTimestampInt"],
+                                   ["ts_started", "usersch_id", "zid", "user_sec", "machine_sec", "real_sec", "flag"],
+                                   transform)
+        return importer.run(filePath, progress)
 
 ##-----------------------------------------------------------------------------------------------------
 ##
@@ -741,6 +831,8 @@ class RMAvailableWaterTable(RMTable):
 
     def addRecord(self, dayTimestamp, programID, zoneID, availableWater, commit = True):
         if(self.database.isOpen()):
+            globalHistoryRetention.sweep(self.database, self._tableName, lambda dayTimestamp: self.deleteRecordsByDayThreshold(dayTimestamp, False))
+
             self.database.execute("DELETE FROM %s WHERE day=? AND pid=? AND zid=?" % self._tableName, (dayTimestamp, programID, zoneID))
             self.database.execute("INSERT OR REPLACE INTO %s VALUES(?, ?, ?, ?)" % self._tableName, (dayTimestamp, programID, zoneID, availableWater))
             if commit:
@@ -748,6 +840,16 @@ class RMAvailableWaterTable(RMTable):
             return True
         return False
 
+    def deleteRecordsByDayThreshold(self, dayTimestamp, commit = True):
+        if(self.database.isOpen()):
+            self.database.execute("DELETE FROM %s WHERE day<?" % self._tableName, (dayTimestamp, ))
+            if commit:
+                self.database.commit()
+
+    def importFromSprinklerV1Db(self, filePath, progress = None):
+        importer = RMHistoryImport(self.database, self._tableName, ["day", "pid", "zid", "aw"])
+        return importer.run(filePath, progress)
+
     def getLastRecord(self, dayTimestamp, programID, zoneID):
         if(self.database.isOpen()):
             row = self.database.execute("SELECT aw FROM %s WHERE day=? AND pid=? AND zid=? ORDER BY ROWID DESC LIMIT 1" % self._tableName,
@@ -853,6 +955,8 @@ class RMPastValuesTable(RMTable):
             else:
                 used = 0
 
+            globalHistoryRetention.sweep(self.database, self._tableName, self.deleteRecordsByDayThreshold)
+
             record = self.database.execute("SELECT used FROM %s WHERE used=1 AND pid=? AND timestamp=?" %self._tableName, (programId, timestamp)).fetchone()
             if not record:
 
@@ -860,6 +964,16 @@ class RMPastValuesTable(RMTable):
                                   (programId, timestamp, used, et0, qpf))
                 self.database.commit()
 
+    def deleteRecordsByDayThreshold(self, dayTimestamp, commit = True):
+        if self.database.isOpen():
+            self.database.execute("DELETE FROM %s WHERE timestamp<?" % self._tableName, (dayTimestamp, ))
+            if commit:
+                self.database.commit()
+
+    def importFromSprinklerV1Db(self, filePath, progress = None):
+        importer = RMHistoryImport(self.database, self._tableName, ["pid", "timestamp", "used", "et0", "qpf"])
+        return importer.run(filePath, progress)
+
     def markRecordsAsUsed(self, programId, timestamp):
         if self.database.isOpen():
             self.database.execute("UPDATE %s SET used=1 WHERE pid=? AND timestamp=?" % self._tableName, (programId, timestamp))
@@ -10,8 +10,15 @@ from RMUtilsFramework.rmTimeUtils import rmTimestampToDateAsString
 from RMDataFramework.rmForecastInfo import RMForecastInfo
 from RMDataFramework.rmMixerData import RMMixerData
 from rmDatabase import RMTable
+from rmHistoryRetention import globalHistoryRetention
+from rmRowMapper import RMRowMapper
 from RMUtilsFramework.rmLogging import log
 
+mixerDataMapper = RMRowMapper(RMMixerData, ["timestamp", "temperature", "rh", "wind", "solarRad", "skyCover", "rain", "et0", "pop", "qpf",
+                                            "condition", "pressure", "dewPoint", "minTemp", "maxTemp", "minRH", "maxRH", "et0calc", "et0final"])
+
+mixerDataColumns = ["forecastID", "forecastTimestamp"] + mixerDataMapper.columnNames
+
 ##-----------------------------------------------------------------------------------------------------
 ##
 ##
@@ -42,10 +49,85 @@ class RMMixerDataTable(RMTable):
                                             #"FOREIGN KEY(forecastID) REFERENCES forecast(ID), "\
                                             "PRIMARY KEY(forecastID, timestamp)"\
                                             ")")
+        # Day lookups and latest forecast per day, history cleanup by forecast day (database version 17)
+        self.database.execute("CREATE INDEX IF NOT EXISTS mixerData_timestamp_forecastID ON mixerData(timestamp, forecastID)")
+        self.database.execute("CREATE INDEX IF NOT EXISTS mixerData_forecastTimestamp ON mixerData(forecastTimestamp, timestamp)")
         self.database.commit()
 
+        self.__createLatestTable()
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    # mixerDataLatest keeps the mixerData row of the newest forecast (MAX(forecastID)) for each day
+    # timestamp. It is maintained by triggers on every insert/delete on mixerData so addRecords(),
+    # deleteOlderDataByTimestampCollision() and the history deletes don't need to know about it.
+    # When the newest row of a day is deleted the next newest one takes its place.
+    # (database version 18)
+    #
+    def __createLatestTable(self):
+        exists = self.database.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name='mixerDataLatest'").fetchone()[0]
+
+        self.database.execute("CREATE TABLE IF NOT EXISTS mixerDataLatest ("\
+                                            "forecastID INTEGER NOT NULL, "\
+                                            "forecastTimestamp INTEGER NOT NULL, "\
+                                            "timestamp NUMERIC NOT NULL, "\
+                                            "temperature DECIMAL DEFAULT NULL, "\
+                                            "rh DECIMAL DEFAULT NULL, "\
+                                            "wind DECIMAL DEFAULT NULL, "\
+                                            "solarRad DECIMAL DEFAULT NULL, "\
+                                            "skyCover DECIMAL DEFAULT NULL, "\
+                                            "rain DECIMAL DEFAULT NULL, "\
+                                            "et0 DECIMAL DEFAULT NULL, "\
+                                            "pop DECIMAL DEFAULT NULL, "\
+                                            "qpf DECIMAL DEFAULT NULL, "\
+                                            "condition INTEGER DEFAULT NULL, "\
+                                            "pressure DECIMAL DEFAULT NULL, "\
+                                            "dewPoint DECIMAL DEFAULT NULL, "\
+                                            "minTemp DECIMAL DEFAULT NULL, "\
+                                            "maxTemp DECIMAL DEFAULT NULL, "\
+                                            "minRH DECIMAL DEFAULT NULL, "\
+                                            "maxRH DECIMAL DEFAULT NULL, "\
+                                            "et0calc DECIMAL DEFAULT NULL, "\
+                                            "et0final DECIMAL DEFAULT NULL, "\
+                                            "PRIMARY KEY(timestamp)"\
+                                            ")")
+
+        columns = ", ".join(mixerDataColumns)
+        newColumns = ", ".join(["NEW." + column for column in mixerDataColumns])
+
+        self.database.execute("CREATE TRIGGER IF NOT EXISTS mixerDataLatest_insert AFTER INSERT ON mixerData "\
+                                "WHEN NOT EXISTS (SELECT NULL FROM mixerDataLatest WHERE timestamp=NEW.timestamp AND forecastID>NEW.forecastID) "\
+                                "BEGIN "\
+                                    "INSERT OR REPLACE INTO mixerDataLatest(" + columns + ") VALUES(" + newColumns + "); "\
+                                "END")
+
+        self.database.execute("CREATE TRIGGER IF NOT EXISTS mixerDataLatest_delete AFTER DELETE ON mixerData "\
+                                "WHEN EXISTS (SELECT NULL FROM mixerDataLatest WHERE timestamp=OLD.timestamp AND forecastID=OLD.forecastID) "\
+                                "BEGIN "\
+                                    "DELETE FROM mixerDataLatest WHERE timestamp=OLD.timestamp; "\
+                                    "INSERT INTO mixerDataLatest(" + columns + ") "\
+                                        "SELECT " + columns + " FROM mixerData WHERE timestamp=OLD.timestamp ORDER BY forecastID DESC LIMIT 1; "\
+                                "END")
+
+        if not exists:
+            self.rebuildLatest(False)
+
+        self.database.commit()
+
+    def rebuildLatest(self, commit = True):
+        if(self.database.isOpen()):
+            columns = ", ".join(mixerDataColumns)
+            self.database.execute("DELETE FROM mixerDataLatest")
+            self.database.execute("INSERT INTO mixerDataLatest(" + columns + ") "\
+                                    "SELECT " + columns + " FROM mixerData m "\
+                                    "WHERE m.forecastID=(SELECT MAX(forecastID) FROM mixerData WHERE timestamp=m.timestamp)")
+            if commit:
+                self.database.commit()
+
     def addRecords(self, forecastID, forecastTimestamp, values):
         if(self.database.isOpen()):
+            globalHistoryRetention.sweep(self.database, "mixerData", lambda dayTimestamp: self.deleteRecordsByDayThreshold(dayTimestamp, False))
+
             valuesToInsert = [(forecastID,
                                forecastTimestamp,
                                value.timestamp,
@@ -92,36 +174,17 @@ class RMMixerDataTable(RMTable):
             if not orderAsc:
                 order = "DESC"
 
+            columns = mixerDataMapper.columns()
+
             if(minTimestamp == None and maxTimestamp == None):
-                cursor = self.database.execute("SELECT * FROM mixerData ORDER BY timestamp " + order)
+                cursor = self.database.execute("SELECT " + columns + " FROM mixerData ORDER BY timestamp " + order)
             if(maxTimestamp == None):
-                cursor = self.database.execute("SELECT * FROM mixerData WHERE timestamp=? ORDER BY timestamp " + order, (minTimestamp, ))
+                cursor = self.database.execute("SELECT " + columns + " FROM mixerData WHERE timestamp=? ORDER BY timestamp " + order, (minTimestamp, ))
             else:
-                cursor = self.database.execute("SELECT * FROM mixerData WHERE ?<=timestamp AND timestamp<? ORDER BY timestamp " + order,
+                cursor = self.database.execute("SELECT " + columns + " FROM mixerData WHERE ?<=timestamp AND timestamp<? ORDER BY timestamp " + order,
                                     (minTimestamp, maxTimestamp, ))
 
-            for row in cursor:
-                mixerData = RMMixerData(row[2])
-                mixerData.temperature = row[3]
-                mixerData.rh = row[4]
-                mixerData.wind = row[5]
-                mixerData.solarRad = row[6]
-                mixerData.skyCover = row[7]
-                mixerData.rain = row[8]
-                mixerData.et0 = row[9]
-                mixerData.pop = row[10]
-                mixerData.qpf = row[11]
-                mixerData.condition = row[12]
-                mixerData.pressure = row[13]
-                mixerData.dewPoint = row[14]
-                mixerData.minTemp = row[15]
-                mixerData.maxTemp = row[16]
-                mixerData.minRH = row[17]
-                mixerData.maxRH = row[18]
-                mixerData.et0calc = row[19]
-                mixerData.et0final = row[20]
-
-                result.append(mixerData)
+            result = mixerDataMapper.records(cursor)
 
         return result
 
@@ -142,115 +205,79 @@ class RMMixerDataTable(RMTable):
             if noOfRecords:
                 limit = " LIMIT %d" % noOfRecords
 
+            # mixerDataLatest has the row with MAX(forecastID) for each timestamp
+            select = "SELECT forecastID, " + mixerDataMapper.columns() + " FROM mixerDataLatest "
+
             if minTimestamp is None and maxTimestamp is None:
-                cursor = self.database.execute("SELECT MAX(forecastID), * FROM mixerData GROUP BY timestamp ORDER BY timestamp " + order + limit)
+                cursor = self.database.execute(select + "ORDER BY timestamp " + order + limit)
             elif minTimestamp is None:
-                cursor = self.database.execute("SELECT MAX(forecastID), * FROM mixerData WHERE timestamp<=? GROUP BY timestamp ORDER BY timestamp " + order + limit, (maxTimestamp, ))
+                cursor = self.database.execute(select + "WHERE timestamp<=? ORDER BY timestamp " + order + limit, (maxTimestamp, ))
             elif maxTimestamp is None:
-                cursor = self.database.execute("SELECT MAX(forecastID), * FROM mixerData WHERE ?<=timestamp GROUP BY timestamp ORDER BY timestamp " + order + limit, (minTimestamp, ))
+                cursor = self.database.execute(select + "WHERE ?<=timestamp ORDER BY timestamp " + order + limit, (minTimestamp, ))
             else:
-                cursor = self.database.execute("SELECT MAX(forecastID), * FROM mixerData WHERE ?<=timestamp AND timestamp<=? GROUP BY timestamp ORDER BY timestamp " + order + limit,
+                cursor = self.database.execute(select + "WHERE ?<=timestamp AND timestamp<=? ORDER BY timestamp " + order + limit,
                                     (minTimestamp, maxTimestamp, ))
 
-            for row in cursor:
-                mixerData = RMMixerData(row[3])
-                mixerData.temperature = row[4]
-                mixerData.rh = row[5]
-                mixerData.wind = row[6]
-                mixerData.solarRad = row[7]
-                mixerData.skyCover = row[8]
-                mixerData.rain = row[9]
-                mixerData.et0 = row[10]
-                mixerData.pop = row[11]
-                mixerData.qpf = row[12]
-                mixerData.condition = row[13]
-                mixerData.pressure = row[14]
-                mixerData.dewPoint = row[15]
-                mixerData.minTemp = row[16]
-                mixerData.maxTemp = row[17]
-                mixerData.minRH = row[18]
-                mixerData.maxRH = row[19]
-                mixerData.et0calc = row[20]
-                mixerData.et0final = row[21]
-
-                if asDict:
-                    result[row[3]] = mixerData
-                else:
-                    result.append(mixerData)
+            if asDict:
+                for row in cursor:
+                    mixerData = mixerDataMapper.record(row, 1)
+                    result[mixerData.timestamp] = mixerData
+            else:
+                result = mixerDataMapper.records(cursor, 1)
 
         return result
 
     def getRecordsByForecast(self, useInsertOrder = False):
         result = OrderedDict()
+        for forecastID, forecastTimestamp, values in self.iterateRecordsByForecast(useInsertOrder):
+            result[forecastID] = {"timestamp" : forecastTimestamp, "values": values}
+        return result
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    # Same data as getRecordsByForecast() but yields (forecastID, forecastTimestamp, values) one
+    # forecast at a time while streaming the rows, so only one forecast is kept in memory.
+    #
+    def iterateRecordsByForecast(self, useInsertOrder = False):
         if(self.database.isOpen()):
-            cursor = None
+            select = "SELECT forecastID, forecastTimestamp, " + mixerDataMapper.columns() + " FROM mixerData "
             if useInsertOrder:
-                cursor = self.database.execute("SELECT * FROM mixerData ORDER BY forecastID ASC, timestamp ASC")
+                batches = self.database.fetchBatches(select + "ORDER BY forecastID ASC, timestamp ASC")
             else:
-                cursor = self.database.execute("SELECT * FROM mixerData ORDER BY forecastID DESC, timestamp ASC")
+                batches = self.database.fetchBatches(select + "ORDER BY forecastID DESC, timestamp ASC")
 
-            for row in cursor:
-                forecastID = row[0]
-                forecastTimestamp = row[1]
-
-                mixerData = RMMixerData(row[2])
-                mixerData.temperature = row[3]
-                mixerData.rh = row[4]
-                mixerData.wind = row[5]
-                mixerData.solarRad = row[6]
-                mixerData.skyCover = row[7]
-                mixerData.rain = row[8]
-                mixerData.et0 = row[9]
-                mixerData.pop = row[10]
-                mixerData.qpf = row[11]
-                mixerData.condition = row[12]
-                mixerData.pressure = row[13]
-                mixerData.dewPoint = row[14]
-                mixerData.minTemp = row[15]
-                mixerData.maxTemp = row[16]
-                mixerData.minRH = row[17]
-                mixerData.maxRH = row[18]
-                mixerData.et0calc = row[19]
-                mixerData.et0final = row[20]
-
-                if forecastID in result:
-                    result[forecastID]["values"].append(mixerData)
-                else:
-                    result[forecastID] = {"timestamp" : forecastTimestamp, "values": [mixerData, ]}
-        return result
+            record = mixerDataMapper.record
+            forecastID = None
+            forecastTimestamp = None
+            values = None
+
+            for rows in batches:
+                for row in rows:
+                    if row[0] != forecastID:
+                        if values:
+                            yield forecastID, forecastTimestamp, values
+                        forecastID = row[0]
+                        forecastTimestamp = row[1]
+                        values = []
+
+                    values.append(record(row, 2))
+
+            if values:
+                yield forecastID, forecastTimestamp, values
 
     def getRecordsForLastForecast(self):
         forecast = None
         values = None
         if(self.database.isOpen()):
 
-            cursor = self.database.execute("SELECT * FROM mixerData WHERE forecastID=(SELECT MAX(forecastID) from mixerData) ORDER BY timestamp ASC")
+            cursor = self.database.execute("SELECT forecastID, forecastTimestamp, " + mixerDataMapper.columns() + " FROM mixerData "\
+                                           "WHERE forecastID=(SELECT MAX(forecastID) from mixerData) ORDER BY timestamp ASC")
 
-            for row in cursor:
+            for row, mixerData in mixerDataMapper.iterate(cursor, 2):
                 if not forecast:
                     forecast = RMForecastInfo(row[0], row[1])
                     values = []
 
-                mixerData = RMMixerData(row[2])
-                mixerData.temperature = row[3]
-                mixerData.rh = row[4]
-                mixerData.wind = row[5]
-                mixerData.solarRad = row[6]
-                mixerData.skyCover = row[7]
-                mixerData.rain = row[8]
-                mixerData.et0 = row[9]
-                mixerData.pop = row[10]
-                mixerData.qpf = row[11]
-                mixerData.condition = row[12]
-                mixerData.pressure = row[13]
-                mixerData.dewPoint = row[14]
-                mixerData.minTemp = row[15]
-                mixerData.maxTemp = row[16]
-                mixerData.minRH = row[17]
-                mixerData.maxRH = row[18]
-                mixerData.et0calc = row[19]
-                mixerData.et0final = row[20]
-
                 values.append(mixerData)
 
         return forecast, values
@@ -262,32 +289,15 @@ class RMMixerDataTable(RMTable):
             minTimestamp = dayTimestamp
             maxTimestamp = dayTimestamp + 86400
 
-            row = self.database.execute("SELECT * FROM mixerData WHERE ?<=timestamp AND timestamp<? GROUP BY timestamp ORDER BY forecastID DESC LIMIT 1",
+            row = self.database.execute("SELECT forecastID, forecastTimestamp, " + mixerDataMapper.columns() + " FROM mixerDataLatest "\
+                                        "WHERE ?<=timestamp AND timestamp<? ORDER BY forecastID DESC LIMIT 1",
                                 (minTimestamp, maxTimestamp, )).fetchone()
 
             if row:
-                mixerData = RMMixerData(row[2])
-                mixerData.temperature = row[3]
-                mixerData.rh = row[4]
-                mixerData.wind = row[5]
-                mixerData.solarRad = row[6]
-                mixerData.skyCover = row[7]
-                mixerData.rain = row[8]
-                mixerData.et0 = row[9]
-                mixerData.pop = row[10]
-                mixerData.qpf = row[11]
-                mixerData.condition = row[12]
-                mixerData.pressure = row[13]
-                mixerData.dewPoint = row[14]
-                mixerData.minTemp = row[15]
-                mixerData.maxTemp = row[16]
-                mixerData.minRH = row[17]
-                mixerData.maxRH = row[18]
-                mixerData.et0calc = row[19]
-                mixerData.et0final = row[20]
+                mixerData = mixerDataMapper.record(row, 2)
 
                 mixerDataDict = {
-                    row[2]: mixerData
+                    mixerData.timestamp: mixerData
                 }
 
                 result = {
@@ -303,6 +313,13 @@ class RMMixerDataTable(RMTable):
             minTimestamp = dayTimestamp
             maxTimestamp = dayTimestamp + 86400
 
+            # Newest forecast for the day, older forecasts are only searched when it has no condition
+            row = self.database.execute("SELECT condition FROM mixerDataLatest WHERE ?<=timestamp AND timestamp<? ORDER BY forecastID DESC, forecastTimestamp DESC LIMIT 1",
+                                (minTimestamp, maxTimestamp, )).fetchone()
+
+            if row and row[0] is not None:
+                return row[0]
+
             row = self.database.execute("SELECT condition FROM mixerData WHERE ?<=timestamp AND timestamp<? AND condition IS NOT NULL ORDER BY forecastID DESC, forecastTimestamp DESC LIMIT 1",
                                 (minTimestamp, maxTimestamp, )).fetchone()
 
@@ -9,11 +9,18 @@ from collections import OrderedDict
 from RMDataFramework.rmForecastInfo import RMForecastInfo
 from RMDataFramework.rmWeatherData import RMWeatherData
 from RMDataFramework.rmParserConfig import RMParserConfig
+from RMDataFramework.rmParserParams import RMParserParams_encodeValue, RMParserParams_decodeValue
 from RMDataFramework.rmUserSettings import globalSettings
 from RMUtilsFramework.rmTimeUtils import rmTimestampToDateAsString, rmGetStartOfDay, rmCurrentDayTimestamp, rmNormalizeTimestamp
 from rmDatabase import RMTable
+from rmHistoryRetention import globalHistoryRetention
+from rmRowMapper import RMRowMapper
 from RMUtilsFramework.rmLogging import log
 
+weatherDataMapper = RMRowMapper(RMWeatherData, ["timestamp", "temperature", "minTemperature", "maxTemperature", "rh", "minRh", "maxRh",
+                                                "wind", "solarRad", "skyCover", "rain", "et0", "pop", "qpf", "condition", "pressure",
+                                                "dewPoint", "userData"])
+
 ##-----------------------------------------------------------------------------------------------------
 ##
 ##
@@ -29,6 +36,9 @@ class RMParserTable(RMTable):
                             ")")
         self.database.commit()
 
+        # Params are kept in parserParams, the params column is only read by the version 20 upgrade
+        self.paramsTable = RMParserParamsTable(self.database)
+
     def addParser(self, fileName, name, enabled, params = None):
         if(self.database.isOpen()):
 
@@ -38,13 +48,17 @@ class RMParserTable(RMTable):
                 parserConfig = self.getParser(name)
             isNew = False
             if parserConfig is None:
-                self.database.execute("INSERT INTO parser (fileName, name, enabled, params) VALUES(?, ?, ?, ?)", (fileName, name, enabled, params, ))
+                self.database.execute("INSERT INTO parser (fileName, name, enabled) VALUES(?, ?, ?)", (fileName, name, enabled, ))
                 self.database.commit()
                 parserConfig = RMParserConfig(self.database.lastRowId(), fileName, name, enabled)
+                if params is not None:
+                    self.paramsTable.setParams(parserConfig.dbID, params)
                 isNew = True
             elif parserConfig.fileName != fileName:
-                self.database.execute("UPDATE parser SET fileName=?, name=?, enabled=?, params=? WHERE ID=?", (fileName, name, enabled, params, parserConfig.dbID, ))
+                self.database.execute("UPDATE parser SET fileName=?, name=?, enabled=? WHERE ID=?", (fileName, name, enabled, parserConfig.dbID, ))
                 self.database.commit()
+                if params is not None:
+                    self.paramsTable.setParams(parserConfig.dbID, params)
                 parserConfig.fileName = fileName
                 parserConfig.name = name
                 parserConfig.enabled = enabled
@@ -52,16 +66,10 @@ class RMParserTable(RMTable):
         return None, False
 
     def getParserParams(self, id):
-        if(self.database.isOpen()):
-            row = self.database.execute("SELECT params FROM parser WHERE ID=?", (id, )).fetchone()
-            if row:
-                return row[0]
-        return None
+        return self.paramsTable.getParams(id)
 
     def updateParserParams(self, id, params):
-        if(self.database.isOpen()):
-            self.database.execute("UPDATE parser SET params=? WHERE ID=?", (params, id, ))
-            self.database.commit()
+        self.paramsTable.setParams(id, params)
         return None
 
     def enableParser(self, id, enable):
@@ -106,6 +114,95 @@ class RMParserTable(RMTable):
             return results
         return None
 
+##-----------------------------------------------------------------------------------------------------
+##
+## Parser params, one typed row per key. Rows are cached in memory per database together with their
+## decoded value: getParams() is served from the cache after the first read and setParams() only
+## encodes and writes the keys whose value changed (and deletes the removed ones), so saving the
+## params after every parser run costs a dict comparison when the parser didn't change them.
+##
+class RMParserParamsTable(RMTable):
+
+    Caches = {} # database file -> parserID -> name -> (valueType, value, decoded value)
+
+    def initialize(self):
+        self.database.execute("CREATE TABLE IF NOT EXISTS parserParams ("\
+                            "parserID INTEGER NOT NULL, "\
+                            "name VARCHAR(64) NOT NULL, "\
+                            "valueType CHAR(1) NOT NULL, "\
+                            "value TEXT, "\
+                            "FOREIGN KEY(parserID) REFERENCES parser(ID), "\
+                            "PRIMARY KEY(parserID, name)"\
+                            ")")
+        self.database.commit()
+
+    def getParams(self, parserID):
+        if(self.database.isOpen()):
+            cached = self.__getCached(parserID)
+            if not cached:
+                return None
+
+            params = {}
+            for name, (valueType, value, decoded) in cached.iteritems():
+                if valueType == "j":
+                    # Lists and dicts are changed in place by the parsers, each caller gets its own copy
+                    decoded = RMParserParams_decodeValue(valueType, value)
+                params[name] = decoded
+            return params
+        return None
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    # Returns the number of keys written or deleted.
+    #
+    def setParams(self, parserID, params, commit = True):
+        if(self.database.isOpen()):
+            cached = self.__getCached(parserID)
+
+            changed = {}
+            for name, value in params.iteritems():
+                entry = cached.get(name)
+                if entry is not None and type(entry[2]) is type(value) and entry[2] == value:
+                    continue
+                try:
+                    valueType, encoded = RMParserParams_encodeValue(value)
+                except Exception, e:
+                    log.error("Parser %s: param %s not saved: %s" % (parserID, name, e))
+                    continue
+                if entry is None or entry[:2] != (valueType, encoded):
+                    changed[name] = (valueType, encoded, RMParserParams_decodeValue(valueType, encoded))
+
+            removed = [name for name in cached if name not in params]
+
+            if changed:
+                self.database.executeMany("INSERT OR REPLACE INTO parserParams(parserID, name, valueType, value) VALUES(?, ?, ?, ?)",
+                                          [(parserID, name, entry[0], entry[1]) for name, entry in changed.iteritems()])
+            if removed:
+                self.database.executeMany("DELETE FROM parserParams WHERE parserID=? AND name=?", [(parserID, name) for name in removed])
+            if commit and (changed or removed):
+                self.database.commit()
+
+            cached.update(changed)
+            for name in removed:
+                del cached[name]
+
+            return len(changed) + len(removed)
+        return 0
+
+    def __cache(self):
+        return RMParserParamsTable.Caches.setdefault(self.database.fileName, {})
+
+    def __getCached(self, parserID):
+        cache = self.__cache()
+        cached = cache.get(parserID)
+        if cached is None:
+            cached = {}
+            rows = self.database.execute("SELECT name, valueType, value FROM parserParams WHERE parserID=?", (parserID, ))
+            for name, valueType, value in rows:
+                cached[name] = (valueType, value, RMParserParams_decodeValue(valueType, value))
+            cache[parserID] = cached
+        return cached
+
 ##-----------------------------------------------------------------------------------------------------
 ##
 ##
@@ -173,6 +270,9 @@ class RMParserDataTable(RMTable):
                                             "FOREIGN KEY(parserID) REFERENCES parser(ID), "\
                                             "PRIMARY KEY(forecastID, parserID, timestamp)"\
                                             ")")
+        # Retention deletes by day and per parser history/min-max lookups (database version 17)
+        self.database.execute("CREATE INDEX IF NOT EXISTS parserData_timestamp ON parserData(timestamp)")
+        self.database.execute("CREATE INDEX IF NOT EXISTS parserData_parserID_timestamp ON parserData(parserID, timestamp, forecastID)")
         self.database.commit()
 
     def addRecords(self, forecastID, parserID, values):
@@ -240,12 +340,18 @@ class RMParserDataTable(RMTable):
 
 
 
+    #-----------------------------------------------------------------------------------------------
+    #
+    # Old days are deleted and past days reduced to the last forecast once a day for each parser, the
+    # first time its values are saved or cleared that day.
+    #
     def clearHistory(self, parserID, commit):
         if self.database.isOpen():
             if globalSettings.parserHistorySize > 0:
                 maxDayTimestamp = rmCurrentDayTimestamp()
-                minDayTimestamp = maxDayTimestamp - globalSettings.parserHistorySize * 86400
-                self.deleteRecordsHistoryByDayThreshold(parserID, minDayTimestamp, maxDayTimestamp, False)
+                globalHistoryRetention.sweep(self.database, "parserData",
+                                             lambda minDayTimestamp: self.deleteRecordsHistoryByDayThreshold(parserID, minDayTimestamp, maxDayTimestamp, False),
+                                             parserID)
             else:
                 self.database.execute("DELETE FROM parserData WHERE parserID=?", (parserID, ))
                 if commit:
@@ -417,65 +523,24 @@ class RMParserDataTable(RMTable):
     def getRecordsForKey(self, key, ignoreDisabledParser = False):
         ### key[0] is forecastID, key[1] is parserID
         if self.database.isOpen():
-            allRecords = []
-
             if ignoreDisabledParser:
-                records = self.database.execute("SELECT pd.* from parserData pd, parser p WHERE pd.forecastID=? AND pd.parserID=? AND pd.parserID=p.ID AND p.enabled<>0", (key[0], key[1], ))
+                records = self.database.execute("SELECT " + weatherDataMapper.columns("pd") + " from parserData pd, parser p "\
+                                                "WHERE pd.forecastID=? AND pd.parserID=? AND pd.parserID=p.ID AND p.enabled<>0", (key[0], key[1], ))
             else:
-                records = self.database.execute("SELECT * from parserData WHERE forecastID=? AND parserID=?", (key[0], key[1], ))
-            for row in records:
-                weatherData = RMWeatherData(row[2])
-                weatherData.temperature = row[3]
-                weatherData.minTemperature = row[4]
-                weatherData.maxTemperature = row[5]
-                weatherData.rh = row[6]
-                weatherData.minRh = row[7]
-                weatherData.maxRh = row[8]
-                weatherData.wind = row[9]
-                weatherData.solarRad = row[10]
-                weatherData.skyCover = row[11]
-                weatherData.rain = row[12]
-                weatherData.et0 = row[13]
-                weatherData.pop = row[14]
-                weatherData.qpf = row[15]
-                weatherData.condition = row[16]
-                weatherData.pressure = row[17]
-                weatherData.dewPoint = row[18]
-                weatherData.userData = row[19]
-
-                allRecords.append(weatherData)
-            return allRecords
+                records = self.database.execute("SELECT " + weatherDataMapper.columns() + " from parserData WHERE forecastID=? AND parserID=?", (key[0], key[1], ))
+            return weatherDataMapper.records(records)
         return None
 
     def getRecordsByParserName(self, parserName):
         results = OrderedDict()
         if self.database.isOpen():
             #SELECT f.timestamp, f.processed, pd.* FROM parser p, forecast f, parserData pd WHERE p.name='ForecastIO Parser' AND p.id == pd.parserID AND f.id == pd.forecastID ORDER BY f.id DESC, pd.timestamp DESC;
-            records = self.database.execute("SELECT f.timestamp, f.processed, pd.* FROM parser p, forecast f, parserData pd "\
+            records = self.database.execute("SELECT f.timestamp, f.processed, pd.forecastID, " + weatherDataMapper.columns("pd") + " FROM parser p, forecast f, parserData pd "\
                                             "WHERE p.name=? AND p.id == pd.parserID AND f.id == pd.forecastID "\
                                             "ORDER BY f.id DESC, pd.timestamp ASC", (parserName, ))
-            for row in records:
+            for row, weatherData in weatherDataMapper.iterate(records, 3):
                 forecast = RMForecastInfo(row[2], row[0], row[1])
 
-                weatherData = RMWeatherData(row[4])
-                weatherData.temperature = row[5]
-                weatherData.minTemperature = row[6]
-                weatherData.maxTemperature = row[7]
-                weatherData.rh = row[8]
-                weatherData.minRh = row[9]
-                weatherData.maxRh = row[10]
-                weatherData.wind = row[11]
-                weatherData.solarRad = row[12]
-                weatherData.skyCover = row[13]
-                weatherData.rain = row[14]
-                weatherData.et0 = row[15]
-                weatherData.pop = row[16]
-                weatherData.qpf = row[17]
-                weatherData.condition = row[18]
-                weatherData.pressure = row[19]
-                weatherData.dewPoint = row[20]
-                weatherData.userData = row[21]
-
                 dayTimestamp = rmGetStartOfDay(weatherData.timestamp)
 
                 forecastValues = None
@@ -498,65 +563,56 @@ class RMParserDataTable(RMTable):
 
     def getRecordsByParserID(self, parserID, minDayTimestamp = None, maxDayTimestamp = None):
         results = OrderedDict()
+        for forecast, forecastValues in self.iterateRecordsByParserID(parserID, minDayTimestamp, maxDayTimestamp):
+            results[forecast] = forecastValues
+        return results
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    # Same data as getRecordsByParserID() but yields (forecast, {dayTimestamp: [values]}) one forecast
+    # at a time while streaming the rows, so only one forecast is kept in memory.
+    #
+    def iterateRecordsByParserID(self, parserID, minDayTimestamp = None, maxDayTimestamp = None):
         if self.database.isOpen():
+            select = "SELECT f.timestamp, f.processed, pd.forecastID, " + weatherDataMapper.columns("pd") + " FROM forecast f, parserData pd "
             #SELECT f.timestamp, f.processed, pd.* FROM parser p, forecast f, parserData pd WHERE p.name='ForecastIO Parser' AND p.id == pd.parserID AND f.id == pd.forecastID ORDER BY f.id DESC, pd.timestamp DESC;
             if minDayTimestamp and minDayTimestamp:
-                records = self.database.execute("SELECT f.timestamp, f.processed, pd.* FROM forecast f, parserData pd "\
-                                                "WHERE pd.parserID==? AND f.id == pd.forecastID AND ?<=pd.timestamp AND pd.timestamp<? "\
+                batches = self.database.fetchBatches(select + "WHERE pd.parserID==? AND f.id == pd.forecastID AND ?<=pd.timestamp AND pd.timestamp<? "\
                                                 "ORDER BY f.id DESC, pd.timestamp ASC", (parserID, minDayTimestamp, maxDayTimestamp))
             elif minDayTimestamp:
-                records = self.database.execute("SELECT f.timestamp, f.processed, pd.* FROM forecast f, parserData pd "\
-                                                "WHERE pd.parserID==? AND f.id == pd.forecastID AND ?<=pd.timestamp "\
+                batches = self.database.fetchBatches(select + "WHERE pd.parserID==? AND f.id == pd.forecastID AND ?<=pd.timestamp "\
                                                 "ORDER BY f.id DESC, pd.timestamp ASC", (parserID, minDayTimestamp))
             elif maxDayTimestamp:
-                records = self.database.execute("SELECT f.timestamp, f.processed, pd.* FROM forecast f, parserData pd "\
-                                                "WHERE pd.parserID==? AND f.id == pd.forecastID AND pd.timestamp<? "\
+                batches = self.database.fetchBatches(select + "WHERE pd.parserID==? AND f.id == pd.forecastID AND pd.timestamp<? "\
                                                 "ORDER BY f.id DESC, pd.timestamp ASC", (parserID, maxDayTimestamp))
             else:
-                records = self.database.execute("SELECT f.timestamp, f.processed, pd.* FROM forecast f, parserData pd "\
-                                                "WHERE pd.parserID==? AND f.id == pd.forecastID "\
+                batches = self.database.fetchBatches(select + "WHERE pd.parserID==? AND f.id == pd.forecastID "\
                                                 "ORDER BY f.id DESC, pd.timestamp ASC", (parserID, ))
-            for row in records:
-                forecast = RMForecastInfo(row[2], row[0], row[1])
 
-                weatherData = RMWeatherData(row[4])
-                weatherData.temperature = row[5]
-                weatherData.minTemperature = row[6]
-                weatherData.maxTemperature = row[7]
-                weatherData.rh = row[8]
-                weatherData.minRh = row[9]
-                weatherData.maxRh = row[10]
-                weatherData.wind = row[11]
-                weatherData.solarRad = row[12]
-                weatherData.skyCover = row[13]
-                weatherData.rain = row[14]
-                weatherData.et0 = row[15]
-                weatherData.pop = row[16]
-                weatherData.qpf = row[17]
-                weatherData.condition = row[18]
-                weatherData.pressure = row[19]
-                weatherData.dewPoint = row[20]
-                weatherData.userData = row[21]
+            record = weatherDataMapper.record
+            forecast = None
+            forecastValues = None
 
-                dayTimestamp = rmGetStartOfDay(weatherData.timestamp)
+            for rows in batches:
+                for row in rows:
+                    if forecast is None or forecast.id != row[2]:
+                        if forecast is not None:
+                            yield forecast, forecastValues
+                        forecast = RMForecastInfo(row[2], row[0], row[1])
+                        forecastValues = OrderedDict()
 
-                forecastValues = None
-                if forecast in results:
-                    forecastValues = results[forecast]
-                else:
-                    forecastValues = OrderedDict()
-                    results[forecast] = forecastValues
+                    weatherData = record(row, 3)
+                    dayTimestamp = rmGetStartOfDay(weatherData.timestamp)
 
-                dailyValues = None
-                if dayTimestamp in forecastValues:
-                    dailyValues = forecastValues[dayTimestamp]
-                else:
-                    dailyValues = []
-                    forecastValues[dayTimestamp] = dailyValues
+                    dailyValues = forecastValues.get(dayTimestamp, None)
+                    if dailyValues is None:
+                        dailyValues = []
+                        forecastValues[dayTimestamp] = dailyValues
 
-                dailyValues.append(weatherData)
+                    dailyValues.append(weatherData)
 
-        return results
+            if forecast is not None:
+                yield forecast, forecastValues
 
     def getMinMax(self, parserID, dayTimestamp):
         ### Min and Max are computed only from the last forecast for that day.
@@ -0,0 +1,75 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+
+from itertools import izip, islice
+from types import ClassType, InstanceType
+
+##-----------------------------------------------------------------------------------------------------
+##
+## Maps query rows to data objects (RMWeatherData, RMMixerData, ...) by column name.
+##
+## The mapper owns the list of selected columns, so readers build their SELECT with columns() and the
+## row positions can't drift from the table schema. Objects are created in one step from the row values
+## and the remaining default attributes of the record class, without running its __init__.
+##
+class RMRowMapper:
+    def __init__(self, recordClass, columns):
+        self.recordClass = recordClass
+
+        # Each column is a name or a (column, attribute) tuple when the names differ
+        self.columnNames = []
+        self.attributes = []
+        for column in columns:
+            if isinstance(column, tuple):
+                self.columnNames.append(column[0])
+                self.attributes.append(column[1])
+            else:
+                self.columnNames.append(column)
+                self.attributes.append(column)
+
+        self.attributes = tuple(self.attributes)
+
+        # Attributes set by the record constructor that are not read from the row
+        self.defaults = dict([(key, value) for key, value in recordClass().__dict__.iteritems() if key not in self.attributes])
+
+        if isinstance(recordClass, ClassType):
+            self.__create = self.__createInstance
+        else:
+            self.__create = self.__createObject
+
+    def columns(self, alias = None):
+        if alias:
+            return ", ".join(["%s.%s" % (alias, name) for name in self.columnNames])
+        return ", ".join(self.columnNames)
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    # Mapped columns start at position offset, any columns before them are left to the caller.
+    #
+    def record(self, row, offset = 0):
+        values = self.defaults.copy()
+        if offset:
+            values.update(izip(self.attributes, islice(row, offset, None)))
+        else:
+            values.update(izip(self.attributes, row))
+        return self.__create(values)
+
+    def records(self, cursor, offset = 0):
+        record = self.record
+        return [record(row, offset) for row in cursor]
+
+    def iterate(self, cursor, offset = 0):
+        record = self.record
+        for row in cursor:
+            yield row, record(row, offset)
+
+    def __createInstance(self, values):
+        return InstanceType(self.recordClass, values)
+
+    def __createObject(self, values):
+        instance = self.recordClass.__new__(self.recordClass)
+        instance.__dict__ = values
+        return instance
@@ -36,6 +36,18 @@
 # 20201024
 #   - Cast observation value to float to perform the average calculations.
 #   - Remove unused import rmGetStartOfDayUtc.
+# 20261018
+#   - Keep a long lived session with the device in a background thread (GW1000Session), the TCP
+#       connection is reused between live data requests and is only opened again when the device drops it.
+#   - Cache the discovered IP and port in the parser params, discovery runs only when the device is not found there.
+#   - Keep per day running totals, minimums and maximums (GW1000DayAggregates), perform() only reports them.
+#   - Read the whole live data packet and check its checksum.
+#   - Live data is requested through the framework listener service (GW1000LiveDataHandler), one thread
+#       and select loop for all local network stations instead of a session thread for each parser.
+#   - The received packets are buffered by the service and added to the day aggregates in perform().
+#   - Day aggregates use the framework RMDailyAggregator, the current day is saved in the database folder
+#       every 10 minutes so it survives a restart.
+#   - Wind direction is kept with the wind speed for the wind vector mean.
 #
 # LICENSE: GNU General Public License v3.0
 # GitHub: https://github.com/pjpeartree/rainmachine-gw1000
@@ -45,12 +57,15 @@ import socket
 import struct
 import time
 import json
-from datetime import datetime
+import os
 from os import path
 
 from RMParserFramework.rmParser import RMParser
+from RMParserFramework.rmListenerService import globalListenerService, RMListenerHandler
+from RMDataFramework.rmObservationAggregator import RMDailyAggregator, RMAggregateField, RMStatsAggregate, \
+    RMRainAggregate, RMWindAggregate
+from RMDataFramework.rmUserSettings import globalSettings
 from RMUtilsFramework.rmLogging import log
-from RMUtilsFramework.rmTimeUtils import rmGetStartOfDay
 
 
 class GW1000(RMParser):
@@ -61,119 +76,161 @@ class GW1000(RMParser):
     parserEnabled = False
     parserDebug = False
     parserInterval = 60  # seconds
-    # Device network settings
+    # Device network settings, an invalid ip means auto discover
     ip = 'auto discover'
     port = 45000
-    # A collection of observations for the current day
-    observations = {RMParser.dataType.TEMPERATURE: None,
-                    RMParser.dataType.MAXTEMP: None,
-                    RMParser.dataType.MINTEMP: None,
-                    RMParser.dataType.RH: None,
-                    RMParser.dataType.MAXRH: None,
-                    RMParser.dataType.MINRH: None,
-                    RMParser.dataType.WIND: None,
-                    RMParser.dataType.SOLARRADIATION: None,
-                    RMParser.dataType.RAIN: None,
-                    RMParser.dataType.PRESSURE: None}
+    # Discovery settings (CMD_BROADCAST is sent from discover_listen_port to discover_address:discover_port)
+    discover_address = '255.255.255.255'
+    discover_port = 46000
+    discover_listen_port = 59387
+    # Seconds between live data requests made by the listener service
+    poll_interval = 20
+    # Seconds to wait for the first live data after connecting
+    first_sample_timeout = 30
+    # Failed connections after which the device is looked for again on the local network
+    max_failures = 3
     defaultParams = {}
-    params = {}
-    # Current execution start of day timestamp
-    currentTimestamp = 0
-    startOfDayTimestamp = 0
-    observation_counter = 0
-        
+    # The last discovered device address, kept between runs
+    params = {'_ip': None, '_port': None}
+    # Observations aggregated for each day and how they are reported
+    fields = [
+        RMAggregateField('temperature', RMStatsAggregate, mean=RMParser.dataType.TEMPERATURE,
+                         min=RMParser.dataType.MINTEMP, max=RMParser.dataType.MAXTEMP),
+        RMAggregateField('humidity', RMStatsAggregate, mean=RMParser.dataType.RH,
+                         min=RMParser.dataType.MINRH, max=RMParser.dataType.MAXRH),
+        RMAggregateField('pressure', RMStatsAggregate, mean=RMParser.dataType.PRESSURE),
+        RMAggregateField('wind', RMWindAggregate, speed=RMParser.dataType.WIND),
+        RMAggregateField('rain', RMRainAggregate, total=RMParser.dataType.RAIN),
+        RMAggregateField('solar_radiation', RMStatsAggregate, mean=RMParser.dataType.SOLARRADIATION)
+    ]
+    # Listener service subscription and the day aggregates
+    subscription = None
+    aggregator = None
+    aggregates = None
+    wind_direction = None
+
     # noinspection PyUnusedLocal
     def isEnabledForLocation(self, tz, lat, lon):
         return GW1000.parserEnabled
 
     def perform(self):
-        # Try to connect, and if it fail try to auto discover the device
-        if self._connect() or self._discover():
-            # Successfully connected to the GW1000 device, let's retrieve live data
-            live_data = self._get_live_data()
-            if self.startOfDayTimestamp == 0:
-                # First usage, initialization of the start of the day variable
-                self.startOfDayTimestamp = rmGetStartOfDay(self.currentTimestamp)
-            # Check if the live data is for a new day
-            elif rmGetStartOfDay(self.currentTimestamp) != self.startOfDayTimestamp:
-                # Report historical data of yesterday
-                self._report_observations()
-                # Reset the observations data for a new day
-                self._reset_observations()
-            # Parser live data and add observations
-            self._parse_live_data(live_data)
-            # A new observation, increment the observation counter
-            self.observation_counter += 1
-            self._report_observations()
-
-    # Connect to the GW1000 device on the local network
-    def _connect(self):
-        try:
-            # Check if the current ip is valid
-            socket.inet_aton(self.ip)
-        except socket.error:
-            # The current ip is invalid, we need to try to discover the device.
-            return False
-        try:
-            # Create a client to connect to the local network device
-            self.connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.connection.settimeout(10)
-            self.connection.connect((self.ip, self.port))
-            return True
-        except socket.error:
-            self._log_error('Error: unable to connect to the GW1000 local network device')
-            self.connection.close()
-            return False
+        if self.subscription is not None and self.subscription.failures >= self.max_failures:
+            # The device is not reachable on this address anymore
+            self._log_error(self.subscription.lastError)
+            self._unsubscribe()
+
+        if self.subscription is None:
+            self._subscribe(self._known_address())
+            if self.subscription is not None and not self._wait_first_sample():
+                # Not found on the known address, look for it on the local network
+                self._unsubscribe()
+            if self.subscription is None:
+                self._subscribe(self._discover())
+                if self.subscription is not None:
+                    self._wait_first_sample()
+
+        if self.subscription is None:
+            return
+
+        self._add_samples(self.subscription.observations.drain())
+
+        # Days that ended since the last run and the current day
+        for day in self.aggregator.report():
+            for key, value in day.observations().items():
+                self.addValue(key, day.day, value)
+            log.debug(day.observations())
 
-    # Discover the GW1000 device on the local network.
+        if not self.subscription.connected and self.subscription.lastError is not None:
+            self.lastKnownError = self.subscription.lastError
+
+    # Request live data from the device every poll_interval seconds, keep the address for the next restart
+    def _subscribe(self, address):
+        if address is None:
+            return
+        self.subscription = globalListenerService.connectTCP(address[0], address[1], GW1000LiveDataHandler(), self.poll_interval)
+        self.params['_ip'], self.params['_port'] = address
+
+    def _unsubscribe(self):
+        self.subscription.close()
+        self.subscription = None
+
+    # Wait for the first live data to report it in this run, returns False if the device can't be reached
+    def _wait_first_sample(self):
+        deadline = time.time() + self.first_sample_timeout
+        while time.time() < deadline:
+            if self.subscription.observations.wait(0.5):
+                return True
+            if self.subscription.failures:
+                return False
+        return False
+
+    # Add the received live data packets to the aggregates of their day
+    def _add_samples(self, samples):
+        if self.aggregator is None:
+            self.aggregator = RMDailyAggregator(self.fields, self._state_file())
+        for timestamp, packet in samples:
+            day = self.aggregator.day(timestamp)
+            if day is None:
+                continue
+            self._parse_live_data(packet, day)
+            self.aggregator.sample(timestamp)
+
+    # The day aggregates are kept with the parser databases, not saved when running outside of the framework
+    # noinspection PyMethodMayBeStatic
+    def _state_file(self):
+        if globalSettings.databasePath is None or not os.path.isdir(globalSettings.databasePath):
+            return None
+        return os.path.join(globalSettings.databasePath, 'gw1000-aggregates.json')
+
+    # Address of the device, the configured ip or the one discovered on a previous run
+    def _known_address(self):
+        for ip, port in ((self.ip, self.port), (self.params.get('_ip'), self.params.get('_port'))):
+            try:
+                socket.inet_aton(ip)
+                return ip, int(port)
+            except (socket.error, TypeError, ValueError):
+                continue
+        return None
+
+    # Discover the GW1000 device on the local network, returns the device (ip, port) or None
     def _discover(self):
         try:
             # Create a socket to send and receive the CMD_BROADCAST command.
             sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
             sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             sock.settimeout(2)
-            sock.bind(('', 59387))
+            sock.bind(('', self.discover_listen_port))
         except socket.error:
             self._log_error('Error: unable to listening for discover packet')
-            return False
+            return None
         # Packet Format: HEADER, CMD_BROADCAST, SIZE, CHECKSUM
-        packet = '\xff\xff\x12\x03\x15'
-        # Try to find the device within 5 retries
-        for n in range(5):
-            try:
-                # Sent a CMD_BROADCAST command
-                sock.sendto(packet, ('255.255.255.255', 46000))
-                packet = sock.recv(1024)
-                # Check device name to avoid detection of other local Ecowiit/Ambient consoles
-                device_name = packet[18:len(packet) - 1]
-                if device_name.startswith('GW'):
-                    self.ip = '%d.%d.%d.%d' % struct.unpack('>BBBB', packet[11:15])
-                    self.port = struct.unpack('>H', packet[15: 17])[0]
-                    return self._connect()
-                else:
-                    self.lastKnownError = 'Error: Unsupported local console: {}'.format(device_name)
-            except socket.error:
-                self.lastKnownError = 'Error: unable to find GW1000 device on local network'
-        self._log_error(self.lastKnownError)
-        return False
-
-    # Get current live conditions from the GW1000 device
-    def _get_live_data(self):
+        request = '\xff\xff\x12\x03\x15'
         try:
-            # Packet Format: HEADER, CMD_GW1000_LIVE_DATA, SIZE, CHECKSUM
-            packet = '\xFF\xFF\x27\x03\x2A'
-            # Send the command CMD_GW1000_LIVE_DATA to the local network device
-            self.connection.sendall(packet)
-            live_data = self.connection.recv(1024)
-            self.currentTimestamp = current_timestamp()
-            return live_data
-        except socket.error:
-            self._log_error('Error: unable to retrieve live data from the local network device')
+            # Try to find the device within 5 retries
+            for n in range(5):
+                try:
+                    # Sent a CMD_BROADCAST command
+                    sock.sendto(request, (self.discover_address, self.discover_port))
+                    packet = sock.recv(1024)
+                    # Check device name to avoid detection of other local Ecowiit/Ambient consoles
+                    device_name = packet[18:len(packet) - 1]
+                    if device_name.startswith('GW'):
+                        ip = '%d.%d.%d.%d' % struct.unpack('>BBBB', packet[11:15])
+                        port = struct.unpack('>H', packet[15: 17])[0]
+                        return ip, port
+                    else:
+                        self.lastKnownError = 'Error: Unsupported local console: {}'.format(device_name)
+                except socket.error:
+                    self.lastKnownError = 'Error: unable to find GW1000 device on local network'
         finally:
-            self.connection.close()
+            sock.close()
+        self._log_error(self.lastKnownError)
+        return None
 
-    # Parse Live Data packet by iterate over sensors
-    def _parse_live_data(self, packet):
+    # Parse Live Data packet by iterate over sensors into the day aggregates
+    def _parse_live_data(self, packet, aggregates):
+        self.aggregates = aggregates
         data = packet[5: len(packet) - 1]
         index = 0
         size = len(data)
@@ -191,7 +248,7 @@ class GW1000(RMParser):
             b'\x07': (self._outdoor_humidity, 1),  # Outdoor Humidity (%), size in bytes:1
             b'\x08': (self._ignore_sensor, 2),  # Absolutely Barometric (hpa), size in bytes:2
             b'\x09': (self._relative_barometric, 2),  # Relative Barometric (hpa), size in bytes:2
-            b'\x0A': (self._ignore_sensor, 2),  # Wind Direction (360), size in bytes:2
+            b'\x0A': (self._wind_direction, 2),  # Wind Direction (360), size in bytes:2
             b'\x0B': (self._wind_speed, 2),  # Wind Speed (m/s), size in bytes:2
             b'\x0C': (self._ignore_sensor, 2),  # Gust Speed (m/s), size in bytes:2
             b'\x0D': (self._ignore_sensor, 2),  # Rain Event (mm), size in bytes:2
@@ -287,36 +344,38 @@ class GW1000(RMParser):
 
     def _outdoor_temperature(self, data, index, size):
         outdoor_temperature = read_int(data[index + 1: index + 1 + size], False, size) / 10.0  # Sensor Unit: degC
-        self._observation_average(RMParser.dataType.TEMPERATURE, outdoor_temperature)  # RainMachine Unit: degC
-        # Check if the outdoor_temperature is a new maximum or minimum
-        self._observation_max_min(RMParser.dataType.MAXTEMP, RMParser.dataType.MINTEMP, outdoor_temperature)
+        # Average, minimum and maximum of the day
+        self.aggregates.add('temperature', outdoor_temperature)  # RainMachine Unit: degC
 
     def _outdoor_humidity(self, data, index, size):
         outdoor_humidity = read_int(data[index + 1: index + 1 + size], False, size)  # Sensor Unit: %
-        self._observation_average(RMParser.dataType.RH, outdoor_humidity)  # RainMachine Unit: %
-        # Check if the outdoor_humidity is a new maximum or minimum
-        self._observation_max_min(RMParser.dataType.MAXRH, RMParser.dataType.MINRH, outdoor_humidity)
+        # Average, minimum and maximum of the day
+        self.aggregates.add('humidity', outdoor_humidity)  # RainMachine Unit: %
 
     def _relative_barometric(self, data, index, size):
         relative_barometric = read_int(data[index + 1: index + 1 + size], False, size)  # Sensor Unit: dPa
         relative_barometric /= 100.0  # Conversion from dPa to kPa
-        self._observation_average(RMParser.dataType.PRESSURE, relative_barometric)  # RainMachine Unit: kPa
+        self.aggregates.add('pressure', relative_barometric)  # RainMachine Unit: kPa
 
     def _wind_speed(self, data, index, size):
         wind_speed = read_int(data[index + 1: index + 1 + size], False, size) / 10.0  # Sensor Unit: m/s
-        self._observation_average(RMParser.dataType.WIND, wind_speed)  # RainMachine Unit: m/s
+        # Wind direction comes before the speed in the packet
+        self.aggregates.add('wind', wind_speed, self.wind_direction)  # RainMachine Unit: m/s
+        self.wind_direction = None
+
+    def _wind_direction(self, data, index, size):
+        self.wind_direction = read_int(data[index + 1: index + 1 + size], True, size)  # Sensor Unit: degrees
 
     def _rain_day(self, data, index, size):
         rain_day = read_int(data[index + 1: index + 1 + size], False, size) / 10.0  # Sensor Unit: mm
         # Preventive check, the rain amount should be cumulative and always bigger that the previous value.
-        if self.observations[RMParser.dataType.RAIN] is None or rain_day > self.observations[RMParser.dataType.RAIN]:
-            self.observations[RMParser.dataType.RAIN] = rain_day  # RainMachine Unit: mm
+        self.aggregates['rain'].addDayTotal(rain_day)  # RainMachine Unit: mm
 
     def _light(self, data, index, size):
         light = read_int(data[index + 1: index + 1 + size], False, size) / 10.0  # Sensor Unit: lux
         solar_radiation = float(light) * 0.0079  # Convert lux into w/m2, 0.0079 is the ratio at sunlight spectrum
         solar_radiation *= 0.0036  # Convert w/m2 to MJ/m2/h, 1 W/m2 = 1 J/m2/Sec
-        self._observation_average(RMParser.dataType.SOLARRADIATION, solar_radiation)  # RainMachine Unit: MJ/m2/day
+        self.aggregates.add('solar_radiation', solar_radiation)  # RainMachine Unit: MJ/m2/day
 
     # noinspection PyMethodMayBeStatic,PyUnusedLocal
     def _ignore_sensor(self, data, index, size):
@@ -326,34 +385,6 @@ class GW1000(RMParser):
     def _unknown_sensor(self, data, index, size):
         log.debug('Unknown Sensor Id found: %02x' % ord(data[index]))
 
-    # Helper function to reset the observation data for a new day
-    def _reset_observations(self):
-        self.observations = dict.fromkeys(self.observations, None)
-        self.observation_counter = 0
-        self.startOfDayTimestamp = rmGetStartOfDay(self.currentTimestamp)
-
-    # Helper function to add observations
-    def _report_observations(self):
-        for key, value in self.observations.items():
-            if value is not None:
-                self.addValue(key, self.startOfDayTimestamp, value)
-        log.debug(self.observations)
-
-    # Helper function to calculate an observation average
-    def _observation_average(self, key, new_value):
-        total_value = 0.0 if self.observations[key] is None else float(self.observations[key]) * self.observation_counter
-        average = (total_value + float(new_value)) / (self.observation_counter + 1)
-        self.observations[key] = average
-
-    # Helper function to check the new maximum and minimum of a observation
-    def _observation_max_min(self, max_key, min_key, value):
-        # Check if the value is a new maximum
-        if self.observations[max_key] is None or value > self.observations[max_key]:
-            self.observations[max_key] = value
-        # Check if the value is a new minimum
-        if self.observations[min_key] is None or value < self.observations[min_key]:
-            self.observations[min_key] = value
-
     # Helper function to log errors
     def _log_error(self, message, packet=None):
         if packet is not None:
@@ -363,6 +394,31 @@ class GW1000(RMParser):
         log.error(self.lastKnownError)
 
 
+# Live data requests on the listener service connection, a valid packet is kept for perform()
+class GW1000LiveDataHandler(RMListenerHandler):
+    # Packet Format: HEADER, CMD_GW1000_LIVE_DATA, SIZE, CHECKSUM
+    request = '\xFF\xFF\x27\x03\x2A'
+
+    # Reply Format: HEADER, CMD_GW1000_LIVE_DATA, SIZE (2 bytes, from command to checksum), DATA, CHECKSUM
+    def frameLength(self, data):
+        if len(data) < 5:
+            return 0
+        length = struct.unpack('>H', data[3:5])[0] + 2
+        if len(data) < length:
+            return 0
+        return length
+
+    def decode(self, data, address):
+        if data[0:3] != '\xFF\xFF\x27' or checksum(data[2:-1]) != ord(data[-1]):
+            raise ValueError('invalid live data packet ' + ''.join('\\x%02X' % ord(b) for b in data))
+        return data
+
+
+# Helper function to return the checksum of a packet, the sum of the bytes from the command to the checksum
+def checksum(data):
+    return sum(ord(b) for b in data) & 0xFF
+
+
 # Helper function to return an Integer from a network packet as BigEndian with different sizes, signed or unsigned.
 def read_int(data, unsigned, size):
     if size == 1 and unsigned:
@@ -378,8 +434,3 @@ def read_int(data, unsigned, size):
     elif size == 4 and not unsigned:
         return struct.unpack('>i', data[0:size])[0]
 
-
-# Helper function to get the current timestamp with microseconds
-def current_timestamp():
-    now = datetime.now()
-    return time.mktime(now.timetuple()) + now.microsecond / 1e6
@@ -9,6 +9,17 @@
 #  - Correction: Wind_Tot counter was not being reset on new day.    
 #  - Update to send yesterday's end of day results only once.
 #
+# Version 1.3.0
+#  - Receive the hub broadcasts through the framework listener service (one thread and
+#      socket for all local network stations) instead of a thread of this parser.
+#  - Observations are buffered by the service and processed in perform(), the day change
+#      is taken from the observation time.
+#
+# Version 1.4.0
+#  - Daily averages, min/max and rain total are kept by the framework RMDailyAggregator,
+#      a few numbers per value whatever the number of observations.
+#  - Today's totals are saved in the database folder and survive a restart.
+#
 #
 # Permission is hereby granted, free of charge, to any person obtaining a
 # copy of this software and associated documentation files (the "Software"),
@@ -30,8 +41,9 @@
 
 # WeatherFlow Smart Weather Station data parser.
 #
-# Run a thread in the background that listens for the WeatherFlow hub data
-# broadcasts and collect the relevant data. The hub does a UDP broadcast
+# The framework listener service receives the WeatherFlow hub data broadcasts
+# and keeps the sensor observations until perform() collects the relevant
+# data. The hub does a UDP broadcast
 # for each sensor.  The body of the broadcast contains JSON formatted data
 # from the sensor.
 #
@@ -40,11 +52,14 @@
 # one Air and one Sky may be tracked.
 
 from RMParserFramework.rmParser import RMParser
+from RMParserFramework.rmListenerService import globalListenerService, RMListenerHandler
+from RMDataFramework.rmObservationAggregator import RMDailyAggregator, RMAggregateField, RMStatsAggregate, \
+    RMRainAggregate, RMWindAggregate
+from RMDataFramework.rmUserSettings import globalSettings
 from RMUtilsFramework.rmLogging import log
-from RMUtilsFramework.rmTimeUtils import rmGetStartOfDay
 
 from datetime import datetime
-import urllib2, json, time, ssl, socket, threading, math
+import urllib2, json, time, ssl, socket, math, os
 from urllib import urlencode
 import time as mod_time
 
@@ -62,9 +77,10 @@ class WeatherFlow(RMParser):
     #parserDebug = False
     parserDebug = True
     parserEnabled = True
-    parserData = []
-    started = False
-    newDay = 0
+    subscription = None
+    aggregator = None
+    port = 50222
+    bufferSize = 256            # observations kept between two runs, the hub sends 2-3 each minute
 
     # Users must supply the sensor serial numbers
     params = {
@@ -78,12 +94,24 @@ class WeatherFlow(RMParser):
         "TempestSerialNum": "ST-00000000"
     }
 
-    parserData = [dict() for x in range(2)]
+    # Daily aggregates of the observations and how they are reported
+    fields = [
+        RMAggregateField("temperature", RMStatsAggregate, mean = RMParser.dataType.TEMPERATURE,
+                         min = RMParser.dataType.MINTEMP, max = RMParser.dataType.MAXTEMP),
+        RMAggregateField("humidity", RMStatsAggregate, mean = RMParser.dataType.RH,
+                         min = RMParser.dataType.MINRH, max = RMParser.dataType.MAXRH),
+        RMAggregateField("pressure", RMStatsAggregate, mean = RMParser.dataType.PRESSURE),
+        RMAggregateField("dewpoint", RMStatsAggregate, mean = RMParser.dataType.DEWPOINT),
+        RMAggregateField("wind", RMWindAggregate, speed = RMParser.dataType.WIND),
+        RMAggregateField("srad", RMStatsAggregate, mean = RMParser.dataType.SOLARRADIATION),
+        RMAggregateField("rain", RMRainAggregate, total = RMParser.dataType.RAIN)
+    ]
 
     def __init__(self):
         RMParser.__init__(self)
-        self.started = False
-        log.info("Initializing WeatherFlow local UDP parser (ver 1.2.0)")
+        self.subscription = None
+        self.aggregator = None
+        log.info("Initializing WeatherFlow local UDP parser (ver 1.4.0)")
 
     def perform(self):                # The function that will be executed must have this name
 
@@ -118,219 +146,135 @@ class WeatherFlow(RMParser):
         #       }
         #  }
         #   
-        if self.started == False:
-            self.started = True
-            log.debug("Starting UPD Listener thread.")
-            # TODO: How do we stop the thread once it's started?
-            threading.Thread(target = self.wfUDPData).start()
-            return  None # First time, just start the thread, we have no data yet.
-
-            
-        for idx, rawdata in enumerate(self.parserData):
-            if 'report' in rawdata:
+        if self.aggregator is None:
+            self.aggregator = RMDailyAggregator(self.fields, self.stateFile())
+
+        if self.subscription is None:
+            log.debug("Start listening on port %d" % self.port)
+            try:
+                self.subscription = globalListenerService.listenUDP(self.port, WeatherFlowHandler(), self.bufferSize)
+            except socket.error, e:
+                self.lastKnownError = "Socket failure"
+                log.error("Socket failure: %s" % e)
+                return None
+            return  None # First time, just start listening, we have no data yet.
+
+        observations = self.subscription.observations
+        if observations.dropped:
+            log.info("%d observations dropped, buffer of %d is too small" % (observations.dropped, observations.size))
+            observations.dropped = 0
+
+        for ts, data in observations.drain():
+            self.wfProcess(ts, data)
+
+        # Yesterday's data is sent only once with the start of day timestamp, today's with the last observation
+        for day in self.aggregator.report():
+            if day is self.aggregator.current:
+                ts = day.lastTimestamp
                 logMsg = "Interval Summary:"
-                if idx == 1:               # if looking at yesterday data (0 = today, 1 = yesterday) ...
-                    if self.newDay :       # Check if need to send yesterday's data
-                        self.newDay = 0    # reset the flag and send yesterday's data   
-                        logMsg = "Yesterday's EoD Summary:" 
-                    else:                  # otherwise skip sending it, only want to send one time 
-                        continue
-
-                self.addValue(RMParser.dataType.TEMPERATURE, rawdata['ts'], rawdata['report']['temperature'])
-                self.addValue(RMParser.dataType.RH, rawdata['ts'], rawdata['report']['humidity'])
-                self.addValue(RMParser.dataType.PRESSURE, rawdata['ts'], rawdata['report']['pressure'])
-                self.addValue(RMParser.dataType.WIND, rawdata['ts'], rawdata['report']['wind'])
-                self.addValue(RMParser.dataType.SOLARRADIATION, rawdata['ts'], rawdata['report']['srad'])
-                self.addValue(RMParser.dataType.RAIN, rawdata['ts'], rawdata['report']['rain'])
-                self.addValue(RMParser.dataType.DEWPOINT, rawdata['ts'], rawdata['report']['dewpoint'])
-                if rawdata['report']['max_temp'] < 60:
-                    self.addValue(RMParser.dataType.MAXTEMP, rawdata['ts'], rawdata['report']['max_temp'])
-                if rawdata['report']['max_temp'] > -60:
-                    self.addValue(RMParser.dataType.MINTEMP, rawdata['ts'], rawdata['report']['min_temp'])
-                self.addValue(RMParser.dataType.MAXRH, rawdata['ts'], rawdata['report']['max_humid'])
-                self.addValue(RMParser.dataType.MINRH, rawdata['ts'], rawdata['report']['min_humid'])
-
-                
-                              
-                log.info("%s temp(C,F): %.2f / %.2f, wind(m/s,mph): %.2f / %.2f, rain_dayTot(mm,in): %.2f / %.2f" % (logMsg, 
-                        rawdata['report']["temperature"], ((rawdata['report']["temperature"] * 9 / 5) + 32), 
-                        rawdata['report']["wind"], (rawdata['report']["wind"] * 2.237), 
-                        rawdata['report']["rain"], (rawdata['report']["rain"] / 25.4) ))
-
-                log.debug("timestamp = %s" % datetime.fromtimestamp(rawdata['ts']))
-                log.debug("temperature = %f" % rawdata['report']["temperature"])
-                log.debug("humidity = %f" % rawdata['report']["humidity"])
-                log.debug("pressure = %f" % rawdata['report']["pressure"])
-                log.debug("wind speed = %f" % rawdata['report']["wind"])
-                log.debug("solar radiation = %f" % rawdata['report']["srad"])
-                log.debug("rain = %f" % rawdata['report']["rain"])
-                log.debug("dewpoint = %f" % rawdata['report']["dewpoint"])
-                log.debug("max temperature = %f" % rawdata['report']["max_temp"])
-                log.debug("min temperature = %f" % rawdata['report']["min_temp"])
-                log.debug("max humidity = %f" % rawdata['report']["max_humid"])
-                log.debug("min humidity = %f" % rawdata['report']["min_humid"])
-                log.debug("")
-
-               
-
-    # Listen for and process WeatherFlow data that is broadcast on UDP port 50222
-    def wfUDPData(self):
-        air_count = 0
-        sky_count = 0
-        temp_total = 0
-        humd_total = 0
-        pres_total = 0
-        wind_total = 0
-        srad_total = 0
-        rain_total = 0
-        dewp_total = 0
-        bufferSize = 1024 # whatever you need
-        port = 50222
-        day_of_year = 0
-
-        log.debug("Start listening on port %d" % port)
-        try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            s.bind(('0.0.0.0', port))
-        except:
-            log.Error("Socket failure")
-
-        log.debug("Start recieve loop")
-        while self.started:
-            hub = s.recvfrom(bufferSize)
-            data = json.loads(hub[0]) # hub is a truple (json, ip, port)
-
-            now = datetime.now()
-
-            # Check if this is a new day, if so 
-            if day_of_year != now.timetuple().tm_yday:
-                # clear counters
-                air_count = 0
-                sky_count = 0
-                temp_total = 0
-                humd_total = 0
-                pres_total = 0
-                wind_total = 0
-                srad_total = 0
-                rain_total = 0
-                dewp_total = 0
-                self.report = {
-                        'temperature': 0,
-                        'humidity': 0,
-                        'pressure': 0,
-                        'dewpoint': 0,
-                        'wind': 0,
-                        'srad': 0,
-                        'rain': 0,
-                        'max_temp': -100,
-                        'min_temp': 100,
-                        'max_humid': 0,
-                        'min_humid': 100
-                        }
-
-                day_of_year = now.timetuple().tm_yday
-                self.parserData[1] = self.parserData[0]
- 
-                self.newDay +=1            # signal that just rolled into a new day, need to send a yesterday summary onetime
-
-                # reset yesterday's timestamp to start of day
-                if 'ts' in self.parserData[1]:
-                    self.parserData[1]['ts'] = rmGetStartOfDay(self.parserData[1]['ts'])
-
-            #log.debug("type = %s broadcast s/n = %s  TEMPEST target: %s" % (data["type"], data["serial_number"], self.params["TempestSerialNum"]))
-
-            debugMsg = "Observation: "
-
-            if  (   ((data["type"] == "obs_air") and (data["serial_number"] == self.params["AirSerialNumber"])) or
-                    ((data["type"] == "obs_st") and (data["serial_number"] == self.params["TempestSerialNum"])) ):
-
-                if   data["type"] == "obs_air":                  
-                    pres_idx = 1                # UDP packet data indexes for Air device
-                    temp_idx = 2
-                    humd_idx = 3
-                else:
-                    pres_idx = 6                # UDP packet data indexes for TEMPEST device
-                    temp_idx = 7
-                    humd_idx = 8
-
-                air_count += 1
-
-                temp_total += data["obs"][0][temp_idx]
-                self.report["temperature"] = float(temp_total) / float(air_count)
-
-                humd_total += data["obs"][0][humd_idx]
-                self.report["humidity"] = float(humd_total) / float(air_count)
-
-                # report pressure in hpa so convert from mb to hpa
-                pres_total += (data["obs"][0][pres_idx] / 10.0)
-                self.report["pressure"] = float(pres_total) / float(air_count)
-
-                # Calculate dewpoint
-                b = (17.625 * data["obs"][0][temp_idx]) / (243.04 + data["obs"][0][temp_idx])
-                rh = float(data["obs"][0][humd_idx]) / 100.0
-                c = math.log(rh)
-                dewpoint = (243.04 * (c + b)) / (17.625 - c - b)
-                dewp_total += dewpoint
-                self.report["dewpoint"] = dewp_total / air_count
-
-                # Track Min/Max
-                if (data["obs"][0][temp_idx] > self.report["max_temp"]):
-                    self.report["max_temp"] = data["obs"][0][temp_idx]
-
-                if (data["obs"][0][temp_idx] < self.report["min_temp"]):
-                    self.report["min_temp"] = data["obs"][0][temp_idx]
-
-                if (data["obs"][0][humd_idx] > self.report["max_humid"]):
-                    self.report["max_humid"] = data["obs"][0][humd_idx]
-
-                if (data["obs"][0][humd_idx] < self.report["min_humid"]):
-                    self.report["min_humid"] = data["obs"][0][humd_idx]
-
-                
-                debugMsg += "Temp (dF)= %.2f, " % ((float(data["obs"][0][temp_idx]) * 9 / 5) + 32)    # convert degC to degF
-                debugMsg += "Humid  = %.2f, " % data["obs"][0][humd_idx]
-                debugMsg += "Press (inHg) = %.2f, " % (float(data["obs"][0][pres_idx]) /  33.8639 )
-
-        
-            if  (   ((data["type"] == "obs_sky") and (data["serial_number"] == self.params["SkySerialNumber"])) or
-                    ((data["type"] == "obs_st") and (data["serial_number"] == self.params["TempestSerialNum"])) ):
-
-                if   data["type"] == "obs_sky":                  
-                    wind_idx = 5                # UDP  Packet data indexes for Sky device
-                    srad_idx = 10
-                    rain_idx = 11
-                else:
-                    wind_idx = 2                # UDP packet data indexes for TEMPEST device
-                    srad_idx = 11
-                    rain_idx = 12
-
-
-                sky_count += 1
-
-                wind_total += data["obs"][0][wind_idx]
-                self.report["wind"] = float(wind_total) / float(sky_count)
-
-                srad_total += data["obs"][0][srad_idx]
-                self.report["srad"] = float(srad_total) / float(sky_count)
-
-                rain_total += data["obs"][0][rain_idx]
-                self.report["rain"] = rain_total
-
-
-                debugMsg += "Cumulative Rain (inch) = %.2f" % (rain_total / 25.4)
-                log.debug(debugMsg)
-           
- 
-            ts = mod_time.mktime(now.timetuple()) + now.microsecond / 1e6
-            self.parserData[0] = {
-                    'ts': ts,
-                    'report':self.report
-                    }
-
-        log.debug("Receive thread exiting")
-        s.close()
-        self.started = False
+            else:
+                ts = day.day
+                logMsg = "Yesterday's EoD Summary:"
+
+            report = day.observations()
+            for key, value in report.iteritems():
+                self.addValue(key, ts, value)
+
+            if RMParser.dataType.TEMPERATURE in report and RMParser.dataType.WIND in report:
+                log.info("%s temp(C,F): %.2f / %.2f, wind(m/s,mph): %.2f / %.2f, rain_dayTot(mm,in): %.2f / %.2f" % (logMsg,
+                        report[RMParser.dataType.TEMPERATURE], ((report[RMParser.dataType.TEMPERATURE] * 9 / 5) + 32),
+                        report[RMParser.dataType.WIND], (report[RMParser.dataType.WIND] * 2.237),
+                        report.get(RMParser.dataType.RAIN, 0), (report.get(RMParser.dataType.RAIN, 0) / 25.4) ))
+
+            log.debug("timestamp = %s" % datetime.fromtimestamp(ts))
+            for key in sorted(report):
+                log.debug("%s = %f" % (key, report[key]))
+            log.debug("")
+
+    # Day totals survive a restart when running in the framework (kept with the parser databases)
+    def stateFile(self):
+        if globalSettings.databasePath is None or not os.path.isdir(globalSettings.databasePath):
+            return None
+        return os.path.join(globalSettings.databasePath, "wf-aggregates.json")
+
+    # Process one WeatherFlow observation received at ts (the hub broadcasts on UDP port 50222)
+    def wfProcess(self, ts, data):
+        day = self.aggregator.day(ts)
+        if day is None:
+            return                          # day already reported
+
+        #log.debug("type = %s broadcast s/n = %s  TEMPEST target: %s" % (data["type"], data["serial_number"], self.params["TempestSerialNum"]))
+
+        debugMsg = "Observation: "
+        added = False
+
+        if  (   ((data["type"] == "obs_air") and (data["serial_number"] == self.params["AirSerialNumber"])) or
+                ((data["type"] == "obs_st") and (data["serial_number"] == self.params["TempestSerialNum"])) ):
+
+            if   data["type"] == "obs_air":
+                pres_idx = 1                # UDP packet data indexes for Air device
+                temp_idx = 2
+                humd_idx = 3
+            else:
+                pres_idx = 6                # UDP packet data indexes for TEMPEST device
+                temp_idx = 7
+                humd_idx = 8
+
+            day.add("temperature", data["obs"][0][temp_idx])
+            day.add("humidity", data["obs"][0][humd_idx])
+
+            # report pressure in hpa so convert from mb to hpa
+            day.add("pressure", data["obs"][0][pres_idx] / 10.0)
+
+            # Calculate dewpoint
+            b = (17.625 * data["obs"][0][temp_idx]) / (243.04 + data["obs"][0][temp_idx])
+            rh = float(data["obs"][0][humd_idx]) / 100.0
+            c = math.log(rh)
+            dewpoint = (243.04 * (c + b)) / (17.625 - c - b)
+            day.add("dewpoint", dewpoint)
+
+            debugMsg += "Temp (dF)= %.2f, " % ((float(data["obs"][0][temp_idx]) * 9 / 5) + 32)    # convert degC to degF
+            debugMsg += "Humid  = %.2f, " % data["obs"][0][humd_idx]
+            debugMsg += "Press (inHg) = %.2f, " % (float(data["obs"][0][pres_idx]) /  33.8639 )
+            added = True
+
+
+        if  (   ((data["type"] == "obs_sky") and (data["serial_number"] == self.params["SkySerialNumber"])) or
+                ((data["type"] == "obs_st") and (data["serial_number"] == self.params["TempestSerialNum"])) ):
+
+            if   data["type"] == "obs_sky":
+                wind_idx = 5                # UDP  Packet data indexes for Sky device
+                wdir_idx = 7
+                srad_idx = 10
+                rain_idx = 11
+            else:
+                wind_idx = 2                # UDP packet data indexes for TEMPEST device
+                wdir_idx = 4
+                srad_idx = 11
+                rain_idx = 12
+
+            day.add("wind", data["obs"][0][wind_idx], data["obs"][0][wdir_idx])
+            day.add("srad", data["obs"][0][srad_idx])
+            day.add("rain", data["obs"][0][rain_idx])   # rain of the observation interval
+
+            debugMsg += "Cumulative Rain (inch) = %.2f" % (day["rain"].total / 25.4)
+            log.debug(debugMsg)
+            added = True
+
+        # Packets of other devices don't count as observations of the day
+        if added:
+            self.aggregator.sample(ts)
+
+
+# Keeps the sensor observations of the hub broadcasts (rapid wind, events and status are dropped)
+class WeatherFlowHandler(RMListenerHandler):
+    observationTypes = ("obs_air", "obs_sky", "obs_st")
+
+    def decode(self, data, address):
+        data = json.loads(data)
+        if data.get("type") in self.observationTypes:
+            return data
+        return None
 
 
 # To run in pycharm uncomment the following lines
@@ -0,0 +1,442 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+import os, time, errno, select, socket, threading
+from collections import deque
+
+from RMUtilsFramework.rmLogging import log
+from RMUtilsFramework.rmTimeUtils import globalMonotonicTime
+
+#----------------------------------------------------------------------------------------
+#
+# Sockets of the local network weather stations (UDP broadcasts of WeatherFlow hubs, TCP polling
+# of GW1000 gateways, ...) are handled by a single thread with one select() loop. Each parser
+# registers a handler that decodes the packets of its station, the decoded observations are kept
+# in a bounded buffer of the subscription and the parser drains it in perform():
+#
+#   subscription = globalListenerService.listenUDP(50222, WFHandler())
+#   subscription = globalListenerService.connectTCP(ip, 45000, GW1000Handler(), interval = 20)
+#   for timestamp, observation in subscription.observations.drain(): ...
+#
+# A UDP port is bound once and every datagram is given to all the handlers registered on it. TCP
+# connections are opened in the background and reconnected with a backoff when they fail.
+#
+
+class RMObservationBuffer:
+    """
+    Ring buffer of (timestamp, observation), the oldest observation is dropped when it is full
+    """
+    def __init__(self, size):
+        self.size = size
+        self.received = 0
+        self.dropped = 0
+        self.__items = deque(maxlen = size)
+        self.__condition = threading.Condition()
+
+    def __len__(self):
+        return len(self.__items)
+
+    def put(self, timestamp, observation):
+        with self.__condition:
+            if len(self.__items) == self.size:
+                self.dropped += 1
+            self.__items.append((timestamp, observation))
+            self.received += 1
+            self.__condition.notify_all()
+
+    def drain(self):
+        """
+        Returns and removes the buffered observations, oldest first
+        """
+        with self.__condition:
+            items = list(self.__items)
+            self.__items.clear()
+            return items
+
+    def latest(self):
+        with self.__condition:
+            if not self.__items:
+                return None
+            return self.__items[-1]
+
+    def wait(self, timeout):
+        """
+        Waits at most timeout seconds for an observation, returns True if the buffer is not empty
+        """
+        with self.__condition:
+            if not self.__items:
+                self.__condition.wait(timeout)
+            return len(self.__items) > 0
+
+
+class RMListenerHandler:
+    """
+    Decodes the packets of a station. decode() returns an observation, a list of observations or None when the
+    packet has nothing to keep. On TCP the stream is split in packets by frameLength() and request (if set) is sent
+    after connecting and every interval seconds for the stations that must be polled.
+    """
+    request = None
+
+    def decode(self, data, address):
+        return data
+
+    def frameLength(self, data):
+        """
+        Length of the first complete packet of the received data, 0 when more data is needed
+        """
+        return len(data)
+
+
+class RMListenerSubscription:
+    UDP = "udp"
+    TCP = "tcp"
+
+    def __init__(self, service, protocol, address, handler, bufferSize, interval = None):
+        self.service = service
+        self.protocol = protocol
+        self.address = address
+        self.handler = handler
+        self.interval = interval
+        self.observations = RMObservationBuffer(bufferSize)
+
+        self.packets = 0
+        self.errors = 0         # packets that failed to decode
+        self.connections = 0    # TCP connections opened
+        self.failures = 0       # TCP connect or receive failures since the last received packet
+        self.connected = False
+        self.lastError = None
+
+    def close(self):
+        self.service.unsubscribe(self)
+
+    def _receive(self, data, address):
+        self.packets += 1
+        try:
+            observations = self.handler.decode(data, address)
+        except Exception, e:
+            self.errors += 1
+            self.lastError = "Cannot decode packet from %s: %s" % (address, e)
+            log.debug(self.lastError)
+            return
+
+        if observations is None:
+            return
+        if not isinstance(observations, list):
+            observations = [observations]
+
+        timestamp = time.time()
+        for observation in observations:
+            self.observations.put(timestamp, observation)
+
+    def __repr__(self):
+        return "RMListenerSubscription(%s, %s:%s)" % (self.protocol, self.address[0], self.address[1])
+
+
+class RMListenerConnection:
+    """
+    State of the TCP connection of a subscription
+    """
+    ConnectTimeout = 10
+    RetryInterval = 1
+    MaxRetryInterval = 300
+    MaxPacketSize = 64 * 1024
+
+    def __init__(self, subscription):
+        self.subscription = subscription
+        self.socket = None
+        self.connecting = False
+        self.data = ""
+        self.nextAttempt = 0
+        self.nextRequest = None
+        self.connectDeadline = None
+
+    def deadline(self):
+        if self.socket is None:
+            return self.nextAttempt
+        if self.connecting:
+            return self.connectDeadline
+        return self.nextRequest
+
+
+class RMListenerService:
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__udp = {} # key=(host, port), value=[socket, [subscriptions]]
+        self.__tcp = {} # key=subscription, value=RMListenerConnection
+        self.__thread = None
+        self.__running = False
+        self.__closing = [] # sockets and connections of removed subscriptions, closed by the listener thread
+        self.__wakeupRead, self.__wakeupWrite = os.pipe()
+
+    #----------------------------------------------------------------------------------------
+    #
+    #
+    #
+    def listenUDP(self, port, handler, bufferSize = 256, host = ""):
+        """
+        Gives the datagrams received on port to handler, raises socket.error when the port can't be bound
+        """
+        subscription = RMListenerSubscription(self, RMListenerSubscription.UDP, (host, port), handler, bufferSize)
+        with self.__lock:
+            entry = self.__udp.get((host, port), None)
+            if entry is None:
+                s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                try:
+                    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                    s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+                    s.bind((host, port))
+                    s.setblocking(0)
+                except socket.error:
+                    s.close()
+                    raise
+                entry = self.__udp[(host, port)] = [s, []]
+            entry[1].append(subscription)
+        self.__start()
+        return subscription
+
+    def connectTCP(self, host, port, handler, interval = None, bufferSize = 256):
+        """
+        Keeps a connection to host:port, handler.request is sent every interval seconds (or once after connect when
+        interval is None)
+        """
+        subscription = RMListenerSubscription(self, RMListenerSubscription.TCP, (host, port), handler, bufferSize, interval)
+        with self.__lock:
+            self.__tcp[subscription] = RMListenerConnection(subscription)
+        self.__start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.__lock:
+            if subscription.protocol == RMListenerSubscription.UDP:
+                entry = self.__udp.get(subscription.address, None)
+                if entry is not None and subscription in entry[1]:
+                    entry[1].remove(subscription)
+                    if not entry[1]:
+                        self.__closing.append(entry[0])
+                        del self.__udp[subscription.address]
+            else:
+                connection = self.__tcp.pop(subscription, None)
+                if connection is not None:
+                    self.__closing.append(connection)
+        self.__wakeup()
+        if self.__thread is None or not self.__thread.is_alive():
+            self.__closeRemoved()
+
+    def subscriptions(self):
+        with self.__lock:
+            result = self.__tcp.keys()
+            for s, subscriptions in self.__udp.itervalues():
+                result.extend(subscriptions)
+            return result
+
+    def stop(self):
+        self.__running = False
+        self.__wakeup()
+        if self.__thread is not None and self.__thread is not threading.current_thread():
+            self.__thread.join()
+        self.__thread = None
+
+    #----------------------------------------------------------------------------------------
+    #
+    #
+    #
+    def __start(self):
+        with self.__lock:
+            if self.__thread is None or not self.__thread.is_alive():
+                self.__running = True
+                self.__thread = threading.Thread(target = self.__run, name = "RMListenerService")
+                self.__thread.daemon = True
+                self.__thread.start()
+        self.__wakeup()
+
+    def __wakeup(self):
+        try:
+            os.write(self.__wakeupWrite, "x")
+        except OSError:
+            pass
+
+    def __run(self):
+        log.debug("Listener service started")
+        while self.__running:
+            try:
+                self.__loop()
+            except Exception, e:
+                log.exception(e)
+                time.sleep(1)
+        self.__closeRemoved()
+        log.debug("Listener service stopped")
+
+    def __closeRemoved(self):
+        with self.__lock:
+            closing = self.__closing
+            self.__closing = []
+        for item in closing:
+            if isinstance(item, RMListenerConnection):
+                self.__close(item)
+            else:
+                item.close()
+
+    def __loop(self):
+        self.__closeRemoved()
+
+        now = globalMonotonicTime.get(False)
+        readers = {self.__wakeupRead: None}
+        writers = {}
+        timeout = None
+
+        with self.__lock:
+            for s, subscriptions in self.__udp.itervalues():
+                readers[s.fileno()] = (s, subscriptions)
+            connections = self.__tcp.values()
+
+        for connection in connections:
+            self.__schedule(connection, now)
+            if connection.socket is not None:
+                if connection.connecting:
+                    writers[connection.socket.fileno()] = connection
+                else:
+                    readers[connection.socket.fileno()] = connection
+            deadline = connection.deadline()
+            if deadline is not None:
+                timeout = max(0, deadline - now) if timeout is None else min(timeout, max(0, deadline - now))
+
+        try:
+            readable, writable = select.select(readers.keys(), writers.keys(), [], timeout)[:2]
+        except select.error, e:
+            if e.args[0] == errno.EINTR:
+                return
+            raise
+
+        for fd in writable:
+            self.__connected(writers[fd])
+
+        for fd in readable:
+            if fd == self.__wakeupRead:
+                os.read(self.__wakeupRead, 512)
+                continue
+            entry = readers[fd]
+            if isinstance(entry, RMListenerConnection):
+                self.__receiveTCP(entry)
+            else:
+                self.__receiveUDP(entry[0], entry[1])
+
+    #----------------------------------------------------------------------------------------
+    #
+    #
+    #
+    def __receiveUDP(self, s, subscriptions):
+        while True:
+            try:
+                data, address = s.recvfrom(65535)
+            except socket.error, e:
+                if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR, errno.EBADF):
+                    log.error("Listener UDP receive error: %s" % e)
+                return
+            for subscription in list(subscriptions):
+                subscription._receive(data, address)
+
+    def __schedule(self, connection, now):
+        # Connects, sends the periodic request or times out the connection attempt when due
+        subscription = connection.subscription
+        if connection.socket is None:
+            if now >= connection.nextAttempt:
+                self.__connect(connection, now)
+        elif connection.connecting:
+            if now >= connection.connectDeadline:
+                self.__fail(connection, "Timeout connecting to %s:%s" % subscription.address, now)
+        elif connection.nextRequest is not None and now >= connection.nextRequest:
+            self.__request(connection, now)
+
+    def __connect(self, connection, now):
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.setblocking(0)
+        connection.socket = s
+        connection.connecting = True
+        connection.connectDeadline = now + RMListenerConnection.ConnectTimeout
+        connection.data = ""
+        result = s.connect_ex(connection.subscription.address)
+        if result not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            self.__fail(connection, "Cannot connect to %s:%s: %s" % (connection.subscription.address + (os.strerror(result),)), now)
+
+    def __connected(self, connection):
+        now = globalMonotonicTime.get(False)
+        subscription = connection.subscription
+        if connection.socket is None:
+            return
+        result = connection.socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if result != 0:
+            self.__fail(connection, "Cannot connect to %s:%s: %s" % (subscription.address + (os.strerror(result),)), now)
+            return
+
+        connection.connecting = False
+        subscription.connected = True
+        subscription.connections += 1
+        log.debug("Listener connected to %s:%s" % subscription.address)
+        if subscription.handler.request is not None:
+            self.__request(connection, now)
+
+    def __request(self, connection, now):
+        subscription = connection.subscription
+        try:
+            connection.socket.send(subscription.handler.request)
+        except socket.error, e:
+            self.__fail(connection, "Cannot send request to %s:%s: %s" % (subscription.address + (e,)), now)
+            return
+        connection.nextRequest = None if subscription.interval is None else now + subscription.interval
+
+    def __receiveTCP(self, connection):
+        now = globalMonotonicTime.get(False)
+        subscription = connection.subscription
+        try:
+            data = connection.socket.recv(4096)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            self.__fail(connection, "Cannot receive from %s:%s: %s" % (subscription.address + (e,)), now)
+            return
+
+        if not data:
+            # Closed by the station, polled stations reconnect on their next request
+            log.debug("Listener connection to %s:%s closed" % subscription.address)
+            nextRequest = connection.nextRequest
+            self.__close(connection)
+            connection.nextAttempt = now + RMListenerConnection.RetryInterval if nextRequest is None else nextRequest
+            return
+
+        connection.data += data
+        while connection.data:
+            length = subscription.handler.frameLength(connection.data)
+            if length <= 0:
+                break
+            packet, connection.data = connection.data[:length], connection.data[length:]
+            subscription.failures = 0
+            subscription._receive(packet, subscription.address)
+
+        if len(connection.data) > RMListenerConnection.MaxPacketSize:
+            subscription.errors += 1
+            subscription.lastError = "Packet too large from %s:%s" % subscription.address
+            log.error(subscription.lastError)
+            connection.data = ""
+
+    def __fail(self, connection, message, now):
+        subscription = connection.subscription
+        subscription.failures += 1
+        subscription.lastError = message
+        log.error(message)
+        self.__close(connection)
+        retry = RMListenerConnection.RetryInterval * 2 ** min(subscription.failures - 1, 16)
+        connection.nextAttempt = now + min(retry, RMListenerConnection.MaxRetryInterval)
+
+    def __close(self, connection):
+        if connection.socket is not None:
+            connection.socket.close()
+        connection.socket = None
+        connection.connecting = False
+        connection.nextRequest = None
+        connection.data = ""
+        connection.subscription.connected = False
+
+
+globalListenerService = RMListenerService()
@@ -150,6 +150,9 @@ class RMParserManager:
                     if len(parser.lastKnownError) == 0:
                         parser.lastKnownError = 'Error: Failed to run'
 
+                # Parsers keep state between runs in params (_lastTS, _observations ...), only changed keys are written
+                self.parserTable.updateParserParams(parserConfig.dbID, parser.params)
+
                 if not parser.hasValues():
                     parserConfig.failCounter += 1
                     parserConfig.lastFailTimestamp = newForecast.timestamp
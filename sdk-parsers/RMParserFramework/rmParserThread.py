@@ -155,14 +155,9 @@ class RMParserThread(Thread):
             if forecast is None and mixerDataValues is None:
                 pass
 
-            mixerData = self.__mixerDataTable.getRecordsByForecast(True)
-            if mixerData:
-                for forecastID in mixerData:
-                    forecastData = mixerData[forecastID]
-                    forecastTimestamp = forecastData["timestamp"]
-                    mixerDataValues = forecastData["values"]
-
-                    self.__simulate(forecastID, forecastTimestamp, mixerDataValues)
+            # One forecast at a time, the whole mixer history is not loaded in memory
+            for forecastID, forecastTimestamp, mixerDataValues in self.__mixerDataTable.iterateRecordsByForecast(True):
+                self.__simulate(forecastID, forecastTimestamp, mixerDataValues)
         elif forecast:
             self.__simulate(forecast.id, forecast.timestamp, mixerDataValues)
 
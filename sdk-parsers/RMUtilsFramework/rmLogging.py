@@ -9,14 +9,21 @@ import os
 import gzip
 import time
 import shutil
+import threading
+import Queue
 
 class RMLogger:
 
     ENABLE_COMPRESSION = True
     ROTATE_FILE_SIZE = 500000
 
+    ENABLE_ASYNC = True         # file writes and compressed rotation are done by a background thread
+    ASYNC_QUEUE_SIZE = 5000     # records waiting to be written, new records are dropped when full
+
     def __init__(self, name="RainMachine"):
         self._logFileName = None
+        self.fileHandler = None
+        self.asyncHandler = None
 
         self.stdoutHandler = logging.StreamHandler()
         self.format = logging.Formatter(fmt='%(asctime)s - %(levelname)-5s - %(module)s:%(lineno)s - %(message)s')
@@ -29,6 +36,8 @@ class RMLogger:
         self.logger.addHandler(self.stdoutHandler)
         self.logger.enableFileLogging = self.enableFileLogging
         self.logger.setConsoleLogLevel = self.setConsoleLogLevel
+        self.logger.shutdown = self.shutdown
+        self.logger.getStats = self.getStats
 
     def setGlobalDebugLevel(self, level = logging.DEBUG):
         self.logger.setLevel(level)
@@ -36,6 +45,14 @@ class RMLogger:
     def setModuleDebugLevel(self, name, level = logging.DEBUG):
         self.filter.modulesLevel[name] = level
 
+    def setModuleSampling(self, name, every, level = logging.DEBUG, lineno = None):
+        ### Keeps one of every `every` records up to `level` from each call site of the module (or only from line `lineno`)
+        self.filter.addSampler(name, lineno, RMLogger.RMLoggerSampler(every = every, level = level))
+
+    def setModuleRateLimit(self, name, rate, burst = 1, level = logging.DEBUG, lineno = None):
+        ### Keeps at most `rate` records per second (`burst` at once) up to `level` from each call site of the module (or line `lineno`)
+        self.filter.addSampler(name, lineno, RMLogger.RMLoggerSampler(rate = rate, burst = burst, level = level))
+
     def enableFileLogging(self, fileName = "log/rainmachine.log"):
         self._logFileName = fileName
         self.__checkAndCreateLogDir()
@@ -47,11 +64,35 @@ class RMLogger:
                 fileHandler = logging.handlers.RotatingFileHandler(fileName, maxBytes=RMLogger.ROTATE_FILE_SIZE, backupCount=1)
 
             fileHandler.setFormatter(self.format)
+
+            if RMLogger.ENABLE_ASYNC:
+                fileHandler = self.asyncHandler = RMLogger.AsyncHandler(fileHandler, RMLogger.ASYNC_QUEUE_SIZE)
+
+            self.fileHandler = fileHandler
             self.logger.addHandler(fileHandler)
 
         except Exception, e:
             self.logger.error("Cannot enable file logging to %s: %s" % (fileName, e))
 
+    def shutdown(self):
+        ### Writes the queued records and stops the background thread. File logging continues synchronously.
+        handler = self.asyncHandler
+        if handler is not None and handler is self.fileHandler:
+            handler.stop()
+            self.logger.removeHandler(handler)
+            self.logger.addHandler(handler.handler)
+            self.fileHandler = handler.handler
+            handler.handler.flush()
+
+    def getStats(self):
+        ### Counters of the asynchronous file logging (kept after shutdown)
+        stats = {"async": False, "written": None, "queued": 0, "dropped": 0, "droppedByLevel": {}}
+        if self.asyncHandler is not None:
+            stats.update(self.asyncHandler.getStats())
+            stats["async"] = self.asyncHandler is self.fileHandler
+        stats["suppressed"] = self.filter.getSuppressed()
+        return stats
+
     def setConsoleLogLevel(self, level = logging.ERROR):
         self.stdoutHandler.setLevel(logging.ERROR)   # Send only errors to console
 
@@ -71,11 +112,83 @@ class RMLogger:
         def __init__(self):
             logging.Filter.__init__(self)
             self.modulesLevel = {}
+            self.samplers = {}          # key=(module, lineno or None), value=RMLoggerSampler
+            self.sampledModules = set()
+            self.lock = threading.Lock()
+
+        def addSampler(self, name, lineno, sampler):
+            with self.lock:
+                self.samplers[(name, lineno)] = sampler
+                self.sampledModules.add(name)
+
+        def getSuppressed(self):
+            with self.lock:
+                suppressed = {}
+                for (name, lineno), sampler in self.samplers.iteritems():
+                    suppressed[name if lineno is None else "%s:%d" % (name, lineno)] = sampler.suppressed
+                return suppressed
+
         def filter(self, record):
             moduleLevel = self.modulesLevel.get(record.module)
-            if moduleLevel == None or record.levelno >= moduleLevel:
+            if moduleLevel != None and record.levelno < moduleLevel:
+                return False
+
+            if record.module not in self.sampledModules:
                 return True
-            return False
+
+            sampler = self.samplers.get((record.module, record.lineno))
+            if sampler is None:
+                sampler = self.samplers.get((record.module, None))
+            if sampler is None or record.levelno > sampler.level:
+                return True
+
+            with self.lock:
+                suppressed = sampler.allow(record.lineno, time.time())
+
+            if suppressed is None:
+                return False
+            if suppressed > 0:
+                record.msg = "%s (%d similar messages suppressed)" % (record.getMessage(), suppressed)
+                record.args = None
+            return True
+
+    #----------------------------------------------------------------------------------------
+    #
+    # Sampling/rate limit of the records logged from a call site (module line). The first record of a call
+    # site is always kept, the next kept record tells how many were suppressed in between.
+    #
+    class RMLoggerSampler:
+        def __init__(self, every = None, rate = None, burst = 1, level = logging.DEBUG):
+            self.every = every
+            self.rate = rate
+            self.burst = burst
+            self.level = level
+            self.sites = {}         # key=lineno, value=[records, tokens, last timestamp, suppressed since last kept record]
+            self.suppressed = 0
+
+        def allow(self, lineno, timestamp):
+            ### Returns None if the record is suppressed, otherwise the number of records suppressed before it
+            site = self.sites.get(lineno)
+            if site is None:
+                site = self.sites[lineno] = [0, float(self.burst), timestamp, 0]
+
+            site[0] += 1
+            allowed = not self.every or (site[0] - 1) % self.every == 0
+
+            if allowed and self.rate:
+                tokens = min(self.burst, site[1] + max(0, timestamp - site[2]) * self.rate)
+                site[2] = timestamp
+                allowed = tokens >= 1
+                site[1] = tokens - 1 if allowed else tokens
+
+            if not allowed:
+                site[3] += 1
+                self.suppressed += 1
+                return None
+
+            suppressed = site[3]
+            site[3] = 0
+            return suppressed
 
     #----------------------------------------------------------------------------------------
     #
@@ -96,6 +209,86 @@ class RMLogger:
 
             os.remove(oldLog)
 
+    #----------------------------------------------------------------------------------------
+    #
+    # Puts the records in a bounded queue and lets a background thread format and write them to the
+    # wrapped handler (including the rotation and its compression). The logging thread never waits for
+    # the file: when the queue is full the record is dropped and counted, and the number of dropped records
+    # is written to the log when the thread catches up. The message arguments and exception are formatted
+    # in the logging thread so later changes to the objects don't show up in the log.
+    #
+    class AsyncHandler(logging.Handler):
+
+        def __init__(self, handler, queueSize):
+            logging.Handler.__init__(self)
+            self.handler = handler
+            self.queue = Queue.Queue(queueSize)
+
+            self.written = 0
+            self.dropped = 0
+            self.droppedByLevel = {}
+            self.__reportedDropped = 0
+
+            self.__thread = threading.Thread(target = self.__run, name = "RMLoggerAsync")
+            self.__thread.daemon = True
+            self.__thread.start()
+
+        def emit(self, record):
+            try:
+                if record.args:
+                    record.msg = record.getMessage()
+                    record.args = None
+                if record.exc_info:
+                    record.exc_text = logging._defaultFormatter.formatException(record.exc_info)
+                    record.exc_info = None
+
+                self.queue.put_nowait(record)
+            except Queue.Full:
+                self.dropped += 1
+                self.droppedByLevel[record.levelname] = self.droppedByLevel.get(record.levelname, 0) + 1
+            except Exception:
+                self.handleError(record)
+
+        def flush(self):
+            if self.__thread.isAlive():
+                self.queue.join()
+            self.handler.flush()
+
+        def stop(self):
+            if self.__thread.isAlive():
+                self.queue.put(None)
+                self.__thread.join()
+
+        def close(self):
+            self.stop()
+            self.handler.close()
+            logging.Handler.close(self)
+
+        def getStats(self):
+            return {"async": True, "written": self.written, "queued": self.queue.qsize(), "dropped": self.dropped,
+                    "droppedByLevel": dict(self.droppedByLevel)}
+
+        def __run(self):
+            while True:
+                record = self.queue.get()
+                try:
+                    if record is None:
+                        break
+
+                    self.handler.handle(record)
+                    self.written += 1
+
+                    dropped = self.dropped
+                    if dropped != self.__reportedDropped:
+                        self.handler.handle(logging.LogRecord(record.name, logging.WARNING, __file__, 0,
+                                                              "Log queue full, %d messages dropped (%d since start)" % \
+                                                              (dropped - self.__reportedDropped, dropped), None, None))
+                        self.__reportedDropped = dropped
+                except Exception:
+                    self.handleError(record)
+                finally:
+                    self.queue.task_done()
+
 
 
 # A class for log files that output on /tmp (which should be tmpfs) it will rotate when older than interval
@@ -172,6 +365,10 @@ globalLogger.setModuleDebugLevel('rmParserThread', logging.INFO)
 globalLogger.setModuleDebugLevel('rmCommandThread', logging.WARNING)
 globalLogger.setModuleDebugLevel('rmGPIOGenericLinux', logging.INFO)
 
+# Parsers that log every observation
+globalLogger.setModuleSampling('gw1000-parser', 10)             # debug: one of 10 runs (parserInterval 60)
+globalLogger.setModuleRateLimit('wf-parser', 1.0 / 300)         # debug: one message every 5 minutes per line
+
 #globalLogger.setModuleDebugLevel('rmMixer', logging.INFO)
 #globalLogger.setModuleDebugLevel('rmParser', logging.INFO)
 #globalLogger.setModuleDebugLevel('rmParserManager', logging.INFO)
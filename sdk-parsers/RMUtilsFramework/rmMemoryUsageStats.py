@@ -18,7 +18,7 @@ class RMMemoryUsageStats():
 
     def getFromProc(self):
         status = None
-        result = {'peak': 0, 'rss': 0}
+        result = {'peak': 0, 'rss': 0, 'hwm': 0}
         try:
             status = open(self.statpath)
             for line in status:
@@ -4,15 +4,24 @@
 #          Codrin Juravle <codrin.juravle@mini-box.com>
 
 
-import thread, time, sys, os
+import thread, time, sys, os, select, struct, heapq
 from threading import Thread, Lock, current_thread
 import ctypes
-from fcntl import ioctl
+from fcntl import ioctl, fcntl, F_GETFL, F_SETFL
 
 from RMUtilsFramework.rmLogging import log
-from RMUtilsFramework.rmTimeUtils import rmCurrentTimestamp, rmTimestampToDateAsString
+from RMUtilsFramework.rmTimeUtils import rmCurrentTimestamp, rmTimestampToDateAsString, globalMonotonicTime
 from RMUtilsFramework.rmUtils import rmRebootMachineOrApp
 
+#----------------------------------------------------------------------------------------
+#
+# Thread deadlines are kept in a heap of (deadline, threadId) ordered by the monotonic time at which
+# the thread is considered stuck. updateThread() pushes a new deadline and the previous one is left in
+# the heap, it is dropped when it reaches the top and doesn't match the thread entry anymore.
+# The watcher sleeps until the earliest deadline (at most __systemTimeCheckInterval, used to detect
+# system time changes) and is woken up through a pipe when an earlier deadline is added, on
+# pause/resume/stop and by inotify when /tmp/factory-reset is created.
+#
 class RMThreadWatcher(Thread):
 
     #----------------------------------------------------------------------------------------
@@ -35,12 +44,23 @@ class RMThreadWatcher(Thread):
     NameHintKey = 1
     TimeoutHintKey = 2
     LastUpdateKey = 3
+    DeadlineKey = 4
+
+    FactoryResetFile = "/tmp/factory-reset"
+
+    # <sys/inotify.h>
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+
+    InotifyEvent = struct.Struct("iIII") # wd, mask, cookie, len
 
     def __init__(self):
         Thread.__init__(self)
         self.__running = False
         self.__lock = Lock()
-        self.__data = {} # key=threadId, value={timeoutHint: timestamp, lastUpdate: timestamp}
+        self.__data = {} # key=threadId, value={timeoutHint: seconds, lastUpdate: monotonic time, deadline: monotonic time}
+        self.__deadlines = [] # heap of (deadline, threadId)
 
         self.__watchDogFile = "/dev/watchdog"
         self.__watchDogDescriptor = None
@@ -48,12 +68,21 @@ class RMThreadWatcher(Thread):
 
         self.__lastWatchdogTimestamp = None
         self.__lastCheckTimestamp = None
+        self.__lastCheckMonotonic = None
         self.__lastNoneIpTimestamp = None
         self.__pause = False
 
         self.__wifiRefreshTimeout = 60 * 2
         self.__wifiNoneIpTimeout = 60 * 1
         self.__systemTimeChangeThreshold = 60 * 10 # on which system time change(ntpd) threshold we should reset
+        self.__systemTimeCheckInterval = 60 # longest sleep, system time changes are detected between two checks
+        self.__factoryResetPollInterval = 2 # when inotify is not available
+
+        self.__inotifyFd = None
+        self.__factoryResetPending = True
+        self.__wakeupRead, self.__wakeupWrite = os.pipe()
+        for fd in (self.__wakeupRead, self.__wakeupWrite):
+            fcntl(fd, F_SETFL, fcntl(fd, F_GETFL) | os.O_NONBLOCK)
 
         self.__mainManager = None
 
@@ -64,9 +93,11 @@ class RMThreadWatcher(Thread):
     def registerThread(self, nameHint, timeoutHint):
         ### Call this method from the thread you want to register.
         with self.__lock:
-            entry = self.__getThreadEntry(thread.get_ident(), True)
+            threadId = thread.get_ident()
+            entry = self.__getThreadEntry(threadId, True)
             entry[RMThreadWatcher.NameHintKey] = nameHint
             entry[RMThreadWatcher.TimeoutHintKey] = timeoutHint
+            self.__scheduleThread(threadId, entry)
 
     def unregisterThread(self):
         ### Call this method from the thread you want to unregister.
@@ -82,8 +113,10 @@ class RMThreadWatcher(Thread):
     def updateThread(self):
         ### Call this method from the thread you want to update.
         with self.__lock:
-            entry = self.__getThreadEntry(thread.get_ident(), True)
-            entry[RMThreadWatcher.LastUpdateKey] = rmCurrentTimestamp()
+            threadId = thread.get_ident()
+            entry = self.__getThreadEntry(threadId, True)
+            entry[RMThreadWatcher.LastUpdateKey] = self.__now()
+            self.__scheduleThread(threadId, entry)
 
     #----------------------------------------------------------------------------------------
     #
@@ -103,39 +136,53 @@ class RMThreadWatcher(Thread):
 
     def pause(self):
         self.__pause = True
+        self.__wakeup()
 
     def resume(self):
         if self.__pause:
             self.__lastWatchdogTimestamp = None
             self.__lastCheckTimestamp = None
+            self.__lastCheckMonotonic = None
+            self.__factoryResetPending = True
             self.__pause = False
+            self.__wakeup()
 
     def stop(self):
         self.__running = False
+        self.__wakeup()
 
     def run(self):
 
         restartApp = False
 
+        self.__startFactoryResetWatch()
+
         while self.__running:
             #if RMOSPlatform().AUTODETECTED != RMOSPlatform.SIMULATED:
             #    self.__refreshWatchDog()
 
-            if not self.__pause and self.__lock.acquire(False):
+            timeout = None # paused, sleep until resume() or stop()
+
+            if not self.__pause:
                 try:
-                    if self.__checkFactoryReset():
-                        break
+                    if self.__factoryResetPending or self.__inotifyFd is None:
+                        self.__factoryResetPending = False
+                        if self.__checkFactoryReset():
+                            break
 
-                    if not self.__checkThreads():
-                        restartApp = True
-                        break
+                    with self.__lock:
+                        if not self.__checkThreads():
+                            restartApp = True
+                            break
+                        timeout = self.__nextTimeout()
 
                 except Exception, e:
                     log.error(e)
-                finally:
-                    self.__lock.release()
+                    timeout = self.__factoryResetPollInterval
 
-            time.sleep(2)
+            self.__wait(timeout)
+
+        self.__stopFactoryResetWatch()
 
         if restartApp:
             self.__restartApp()
@@ -151,23 +198,141 @@ class RMThreadWatcher(Thread):
     #
     #
     #
+    def __now(self):
+        return globalMonotonicTime.get(False)
+
+    def __wakeup(self):
+        try:
+            os.write(self.__wakeupWrite, "w")
+        except OSError:
+            pass # pipe full, the watcher has a wakeup pending anyway
+
+    def __wait(self, timeout):
+        descriptors = [self.__wakeupRead]
+        if self.__inotifyFd is not None:
+            descriptors.append(self.__inotifyFd)
+
+        try:
+            readable = select.select(descriptors, [], [], timeout)[0]
+        except select.error, e:
+            log.debug(e) # EINTR
+            return
+
+        if self.__wakeupRead in readable:
+            try:
+                os.read(self.__wakeupRead, 512)
+            except OSError:
+                pass
+
+        if self.__inotifyFd is not None and self.__inotifyFd in readable:
+            self.__readFactoryResetEvents()
+
+    def __nextTimeout(self):
+        timeout = self.__systemTimeCheckInterval
+        if self.__inotifyFd is None:
+            timeout = min(timeout, self.__factoryResetPollInterval)
+        if self.__deadlines:
+            timeout = min(timeout, max(0, self.__deadlines[0][0] - self.__now()))
+        return timeout
+
+    #----------------------------------------------------------------------------------------
+    #
+    # /tmp/factory-reset is watched with inotify (IN_CREATE/IN_MOVED_TO on its folder). When inotify
+    # is not available the file is checked every __factoryResetPollInterval seconds.
+    #
+    def __startFactoryResetWatch(self):
+        folder = os.path.dirname(RMThreadWatcher.FactoryResetFile)
+        try:
+            libc = ctypes.CDLL(None, use_errno = True)
+            fd = libc.inotify_init()
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+
+            if libc.inotify_add_watch(fd, folder, RMThreadWatcher.IN_CREATE | RMThreadWatcher.IN_MOVED_TO) < 0:
+                errno_ = ctypes.get_errno()
+                os.close(fd)
+                raise OSError(errno_, os.strerror(errno_))
+
+            fcntl(fd, F_SETFL, fcntl(fd, F_GETFL) | os.O_NONBLOCK)
+            self.__inotifyFd = fd
+            log.debug("Watching %s with inotify" % RMThreadWatcher.FactoryResetFile)
+        except Exception, e:
+            self.__inotifyFd = None
+            log.info("Cannot watch %s with inotify (%s), checking it every %d seconds" % (folder, e, self.__factoryResetPollInterval))
+
+    def __stopFactoryResetWatch(self):
+        if self.__inotifyFd is not None:
+            os.close(self.__inotifyFd)
+            self.__inotifyFd = None
+
+    def __readFactoryResetEvents(self):
+        try:
+            data = os.read(self.__inotifyFd, 4096)
+        except OSError:
+            return
+
+        fileName = os.path.basename(RMThreadWatcher.FactoryResetFile)
+        offset = 0
+        while offset + RMThreadWatcher.InotifyEvent.size <= len(data):
+            wd, mask, cookie, length = RMThreadWatcher.InotifyEvent.unpack_from(data, offset)
+            offset += RMThreadWatcher.InotifyEvent.size
+            name = data[offset:offset + length].rstrip("\0")
+            offset += length
+
+            if mask & RMThreadWatcher.IN_Q_OVERFLOW or name == fileName:
+                self.__factoryResetPending = True
+
     def __checkFactoryReset(self):
-        factoryReset = os.path.exists("/tmp/factory-reset")
+        factoryReset = os.path.exists(RMThreadWatcher.FactoryResetFile)
         if factoryReset and self.__mainManager:
             try:
-                os.remove("/tmp/factory-reset")
+                os.remove(RMThreadWatcher.FactoryResetFile)
             except Exception, e:
                 log.error(e)
             self.__mainManager.factoryReset()
         return factoryReset
 
+    #----------------------------------------------------------------------------------------
+    #
+    #
+    #
+    def __scheduleThread(self, threadId, entry):
+        timeoutHint = entry[RMThreadWatcher.TimeoutHintKey]
+        lastUpdate = entry[RMThreadWatcher.LastUpdateKey]
+
+        if timeoutHint is None or lastUpdate is None:
+            entry[RMThreadWatcher.DeadlineKey] = None
+            return
+
+        deadline = lastUpdate + timeoutHint
+        entry[RMThreadWatcher.DeadlineKey] = deadline
+
+        earliest = not self.__deadlines or deadline < self.__deadlines[0][0]
+        heapq.heappush(self.__deadlines, (deadline, threadId))
+
+        # Drop the deadlines replaced by updates before they reach the top of the heap
+        if len(self.__deadlines) > 2 * len(self.__data) + 16:
+            self.__deadlines = [(details[RMThreadWatcher.DeadlineKey], key) for key, details in self.__data.iteritems() \
+                                if details[RMThreadWatcher.DeadlineKey] is not None]
+            heapq.heapify(self.__deadlines)
+
+        if earliest:
+            self.__wakeup()
+
     def __checkThreads(self):
 
         timestamp = rmCurrentTimestamp()
-
-        # Work around for a system date change
-        resetWatcher = not self.__lastCheckTimestamp is None and \
-                       abs(timestamp - self.__lastCheckTimestamp) >= self.__systemTimeChangeThreshold
+        now = self.__now()
+
+        # Work around for a system date change: compare the system time elapsed since the last check with the
+        # monotonic one. Without a monotonic clock (time.time() fallback) the checks are at most
+        # __systemTimeCheckInterval apart so a bigger difference is a time change.
+        resetWatcher = False
+        if self.__lastCheckTimestamp is not None and self.__lastCheckMonotonic is not None:
+            elapsed = 0
+            if globalMonotonicTime.clock_gettime is not None:
+                elapsed = now - self.__lastCheckMonotonic
+            resetWatcher = abs(timestamp - self.__lastCheckTimestamp - elapsed) >= self.__systemTimeChangeThreshold
 
         everythingOk = True
 
@@ -181,33 +346,36 @@ class RMThreadWatcher(Thread):
             for threadId in self.__data:
                 details = self.__getThreadEntry(threadId)
                 details[RMThreadWatcher.LastUpdateKey] = None
+                details[RMThreadWatcher.DeadlineKey] = None
+            self.__deadlines = []
 
             if self.__mainManager:
                 self.__mainManager.systemDateTimeChanged()
         else:
 
-            for threadId in self.__data:
-                details = self.__getThreadEntry(threadId)
+            while self.__deadlines and self.__deadlines[0][0] <= now:
+                deadline, threadId = heapq.heappop(self.__deadlines)
+                details = self.__data.get(threadId, None)
 
-                timeoutHint = details[RMThreadWatcher.TimeoutHintKey]
-                lastUpdate = details[RMThreadWatcher.LastUpdateKey]
+                # Unregistered or updated since this deadline was added
+                if details is None or details[RMThreadWatcher.DeadlineKey] != deadline:
+                    continue
 
-                if timeoutHint is None:
-                    log.debug("Thread %d (%s) has no timeout hint!" % (threadId, details[RMThreadWatcher.NameHintKey]))
-                elif lastUpdate is None:
-                    log.debug("Thread %d (%s) is not started yet!" % (threadId, details[RMThreadWatcher.NameHintKey]))
-                elif timeoutHint < (timestamp - lastUpdate):
-                    everythingOk = False
-                    log.debug("Thread %d (%s) didn't responde since [%s] (timeoutHint=%d, timeout=%d)!" % \
-                              (threadId, details[RMThreadWatcher.NameHintKey], rmTimestampToDateAsString(lastUpdate), timeoutHint, (timestamp - lastUpdate)))
+                everythingOk = False
+                lastUpdate = details[RMThreadWatcher.LastUpdateKey]
+                log.debug("Thread %d (%s) didn't responde since [%s] (timeoutHint=%d, timeout=%d)!" % \
+                          (threadId, details[RMThreadWatcher.NameHintKey], rmTimestampToDateAsString(timestamp - (now - lastUpdate)),
+                           details[RMThreadWatcher.TimeoutHintKey], (now - lastUpdate)))
 
         self.__lastCheckTimestamp = timestamp
+        self.__lastCheckMonotonic = now
         return everythingOk
 
     def __getThreadEntry(self, threadId, createIfNotExists = False):
         entry = self.__data.get(threadId, None)
         if entry is None and createIfNotExists:
-            entry = {RMThreadWatcher.TimeoutHintKey: None, RMThreadWatcher.LastUpdateKey: None}
+            entry = {RMThreadWatcher.NameHintKey: None, RMThreadWatcher.TimeoutHintKey: None, RMThreadWatcher.LastUpdateKey: None,
+                     RMThreadWatcher.DeadlineKey: None}
             self.__data[threadId] = entry
         return entry
 
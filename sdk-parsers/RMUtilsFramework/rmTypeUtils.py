@@ -29,4 +29,16 @@ def rmTextToDict(text):
             elif(len(chunks) == 2):
                 result[chunks[0].strip()] = chunks[1].strip()
 
-    return result
\ No newline at end of file
+    return result
+
+def toInt(value):
+    try:
+        return int(value)
+    except:
+        return None
+
+def toFloat(value):
+    try:
+        return float(value)
+    except:
+        return None
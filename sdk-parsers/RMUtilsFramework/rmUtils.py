@@ -9,6 +9,7 @@ import re
 from math import cos, sqrt, sin, acos, asin, log
 from RMUtilsFramework.rmTimeUtils import rmGetStartOfDayUtc , rmCurrentTimestamp
 from RMUtilsFramework.rmLogging import log
+from RMUtilsFramework.rmTypeUtils import toFloat, toInt
 
 #-----------------------------------------------------------------------------------------------------------
 #
@@ -177,6 +178,22 @@ def convertInchesToMM(value):
 
     return value
 
+def convertToFloat(value):
+    if isinstance(value, list):
+        value = [(v[0], toFloat(v[1])) for v in value]
+    else:
+        value = toFloat(value)
+
+    return value
+
+def convertToInt(value):
+    if isinstance(value, list):
+        value = [(v[0], toInt(v[1])) for v in value]
+    else:
+        value = toInt(value)
+
+    return value
+
 #Calculate wind to 10 meters from 2 meters (default in RainMachine). This is a precalculated version.
 def convertWindFrom2mTo10m(wind2):
     try:
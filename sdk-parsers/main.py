@@ -10,6 +10,8 @@ sys.path.insert(0, os.path.dirname(__file__))
 
 from RMDataFramework.rmUserSettings import globalSettings
 from RMDatabaseFramework.rmDatabaseManager import globalDbManager
+from RMDatabaseFramework.rmDatabaseUpdate import RMDatabaseUpdate
+from RMDatabaseFramework.rmDatabase import RMVersionTable
 from RMCore.rmMainManager import RMMainManager
 from RMUtilsFramework.rmCommandThread import RMCommandThread
 from RMUtilsFramework.rmLogging import log, logvolatile
@@ -61,6 +63,9 @@ globalSettings.firstRun = not os.path.isfile(os.path.join(globalSettings.databas
 ##
 globalDbManager.initialize(globalSettings.databasePath)
 
+if not RMDatabaseUpdate.update():
+    log.error("Error updating databases to version %d" % RMVersionTable.CurrentVersion)
+
 ##------------------------------------------------------------------------
 
 if not RMMainManager.createInstance():
@@ -89,3 +94,6 @@ RMCommandThread.instance.join()
 ##
 ## Show memory stats before restart/reboot
 RMMemoryUsageStats().dump()
+
+## Write the queued log messages before exit
+log.shutdown()
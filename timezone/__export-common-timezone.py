@@ -3,6 +3,7 @@
 import os
 import json
 from pytz import common_timezones
+from rmTimeZoneTable import rmWriteTimeZoneTable
 
 timezone = {}
 of = open("rmTimeZoneDB.py", "w")
@@ -21,6 +22,7 @@ for i in common_timezones:
 of.write("}\n")
 
 json.dump(timezone, open("rmTimeZoneDB.json", "w"), indent=4, sort_keys=True)
+rmWriteTimeZoneTable(timezone, "rmTimeZoneDB.bin")
 
 
 
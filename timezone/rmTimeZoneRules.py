@@ -0,0 +1,268 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+import re
+import calendar
+import datetime
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+
+from rmTimeZoneTable import rmLookupTimeZone
+
+#-----------------------------------------------------------------------------------------------
+#
+# POSIX TZ rules (the TZ env var strings of rmTimeZoneDB) compiled to UTC transition tables, so local
+# time of any zone can be computed without changing the process timezone:
+#
+#   std offset [dst [offset] [,start[/time],end[/time]]]
+#
+#   "EST5EDT,M3.2.0,M11.1.0", "CET-1CEST,M3.5.0,M10.5.0/3", "<+0330>-3:30", "UTC0"
+#
+# Offsets are hours west of UTC, dst defaults to one hour ahead of std. Dates are Mm.w.d (day d of
+# week w of month m, week 5 is the last one), Jn (1-365, February 29 is never counted) or n (0-365),
+# the time of the transition defaults to 02:00 local time and can be negative or over 24 hours.
+#
+
+NAME = r"(?:[A-Za-z]{3,}|<[A-Za-z0-9+-]+>)"
+OFFSET = r"[+-]?\d{1,3}(?::\d{1,2}){0,2}"
+RULE_PATTERN = re.compile(r"^(?P<std>%s)(?P<stdOffset>%s)(?:(?P<dst>%s)(?P<dstOffset>%s)?(?:,(?P<start>[^,]+),(?P<end>[^,]+))?)?$" % (NAME, OFFSET, NAME, OFFSET))
+DATE_PATTERN = re.compile(r"^(?:M(?P<month>\d{1,2})\.(?P<week>\d)\.(?P<weekday>\d)|J(?P<julian>\d{1,3})|(?P<day>\d{1,3}))(?:/(?P<time>%s))?$" % OFFSET)
+
+DEFAULT_RULES = ("M3.2.0", "M11.1.0") # used by glibc when a dst name has no rules
+CACHE_SIZE = 256
+
+def rmParseTimeZoneOffset(value):
+    sign = -1 if value.startswith("-") else 1
+    parts = [int(part) for part in value.lstrip("+-").split(":")]
+    parts += [0] * (3 - len(parts))
+    return sign * (parts[0] * 3600 + parts[1] * 60 + parts[2])
+
+
+class RMTimeZoneLRU(object):
+    def __init__(self, maxSize = CACHE_SIZE):
+        self.maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key, factory):
+        with self.__lock:
+            value = self.__entries.pop(key, None)
+            if value is not None:
+                self.__entries[key] = value
+                self.hits += 1
+                return value
+            self.misses += 1
+
+        value = factory()
+        with self.__lock:
+            self.__entries[key] = value
+            while len(self.__entries) > self.maxSize:
+                self.__entries.popitem(False)
+        return value
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+
+    def __len__(self):
+        return len(self.__entries)
+
+
+class RMTimeZoneTransition(object):
+    """
+    Start or end date of the daylight saving time: Mm.w.d, Jn or n with /time in local seconds
+    """
+    def __init__(self, rule):
+        match = DATE_PATTERN.match(rule)
+        if match is None:
+            raise ValueError("Invalid timezone transition %s" % rule)
+
+        self.rule = rule
+        self.month = self.week = self.weekday = self.julian = self.day = None
+        if match.group("month") is not None:
+            self.month = int(match.group("month"))
+            self.week = int(match.group("week"))
+            self.weekday = int(match.group("weekday"))
+            if not 1 <= self.month <= 12 or not 1 <= self.week <= 5 or self.weekday > 6:
+                raise ValueError("Invalid timezone transition %s" % rule)
+        elif match.group("julian") is not None:
+            self.julian = int(match.group("julian"))
+            if not 1 <= self.julian <= 365:
+                raise ValueError("Invalid timezone transition %s" % rule)
+        else:
+            self.day = int(match.group("day"))
+            if self.day > 365:
+                raise ValueError("Invalid timezone transition %s" % rule)
+
+        self.time = 7200 if match.group("time") is None else rmParseTimeZoneOffset(match.group("time"))
+
+    def localTimestamp(self, year):
+        """
+        Returns the transition in the given year as seconds since epoch of the local time
+        """
+        if self.month is not None:
+            firstWeekday = (calendar.weekday(year, self.month, 1) + 1) % 7 # 0 is Sunday
+            day = 1 + (self.weekday - firstWeekday) % 7 + (self.week - 1) * 7
+            if day > calendar.monthrange(year, self.month)[1]:
+                day -= 7
+            start = calendar.timegm((year, self.month, day, 0, 0, 0))
+        elif self.julian is not None:
+            dayOfYear = self.julian - 1
+            if calendar.isleap(year) and self.julian >= 60:
+                dayOfYear += 1
+            start = calendar.timegm((year, 1, 1, 0, 0, 0)) + dayOfYear * 86400
+        else:
+            start = calendar.timegm((year, 1, 1, 0, 0, 0)) + self.day * 86400
+        return start + self.time
+
+
+class RMTimeZoneRule(object):
+    """
+    Parsed POSIX TZ string. Offsets are in seconds east of UTC (the opposite sign of the TZ string).
+    """
+    def __init__(self, tz):
+        match = RULE_PATTERN.match(tz.strip())
+        if match is None:
+            raise ValueError("Invalid timezone rule %s" % tz)
+
+        self.tz = tz
+        self.stdName = match.group("std").strip("<>")
+        self.stdOffset = -rmParseTimeZoneOffset(match.group("stdOffset"))
+        self.dstName = None
+        self.dstOffset = self.stdOffset
+        self.start = self.end = None
+
+        if match.group("dst") is not None:
+            self.dstName = match.group("dst").strip("<>")
+            if match.group("dstOffset") is not None:
+                self.dstOffset = -rmParseTimeZoneOffset(match.group("dstOffset"))
+            else:
+                self.dstOffset = self.stdOffset + 3600
+            rules = DEFAULT_RULES if match.group("start") is None else (match.group("start"), match.group("end"))
+            self.start = RMTimeZoneTransition(rules[0])
+            self.end = RMTimeZoneTransition(rules[1])
+
+    @property
+    def hasDst(self):
+        return self.dstName is not None
+
+    def transitions(self, year):
+        """
+        Returns the [(utcTimestamp, offset after it, isDst)] of a year in time order
+        """
+        if not self.hasDst:
+            return []
+        start = self.start.localTimestamp(year) - self.stdOffset # start time is given in standard time
+        end = self.end.localTimestamp(year) - self.dstOffset     # end time is given in daylight saving time
+        return sorted([(start, self.dstOffset, True), (end, self.stdOffset, False)])
+
+
+class RMTimeZoneYear(object):
+    """
+    Transition table of one UTC year, with the transitions of the neighbouring years so the offset
+    before the first transition of the year is known.
+    """
+    def __init__(self, rule, year):
+        self.year = year
+        self.startTimestamp = calendar.timegm((year, 1, 1, 0, 0, 0))
+        self.endTimestamp = calendar.timegm((year + 1, 1, 1, 0, 0, 0))
+
+        transitions = rule.transitions(year - 1) + rule.transitions(year) + rule.transitions(year + 1)
+        self.timestamps = [transition[0] for transition in transitions]
+        self.offsets = [transition[1] for transition in transitions]
+        self.dst = [transition[2] for transition in transitions]
+        if not transitions:
+            self.timestamps = [self.startTimestamp]
+            self.offsets = [rule.stdOffset]
+            self.dst = [False]
+
+    def index(self, timestamp):
+        return max(0, bisect_right(self.timestamps, timestamp) - 1)
+
+
+class RMTimeZone(object):
+    """
+    Local time of a zone (a name from rmTimeZoneDB or a POSIX TZ string), independent of the process timezone.
+    Year tables are shared by all zones with the same rule and kept in a LRU cache.
+    """
+    yearCache = RMTimeZoneLRU(CACHE_SIZE)
+
+    def __init__(self, name, rule):
+        self.name = name
+        self.rule = rule
+
+    def yearTable(self, year):
+        return RMTimeZone.yearCache.get((self.rule.tz, year), lambda: RMTimeZoneYear(self.rule, year))
+
+    def utcOffset(self, timestamp):
+        table = self.yearTable(self.__utcYear(timestamp))
+        return table.offsets[table.index(timestamp)]
+
+    def isDst(self, timestamp):
+        table = self.yearTable(self.__utcYear(timestamp))
+        return table.dst[table.index(timestamp)]
+
+    def utcOffsets(self, timestamps):
+        """
+        Returns the offset of each timestamp. The year table is kept while consecutive timestamps are in the same year
+        so sorted (or mostly sorted) input costs one bisect per timestamp.
+        """
+        return [offset for timestamp, offset, since, previousOffset in self.__offsets(timestamps)]
+
+    def localTimestamp(self, timestamp):
+        """
+        Returns the local time as seconds since epoch (use datetime.utcfromtimestamp() on it)
+        """
+        return timestamp + self.utcOffset(timestamp)
+
+    def localDayTimestamps(self, timestamps):
+        """
+        Returns the local day of each timestamp as the UTC timestamp of its first instant: local midnight, the first
+        one when the clock was set back over midnight or the transition when midnight was skipped.
+        """
+        days = []
+        for timestamp, offset, since, previousOffset in self.__offsets(timestamps):
+            local = timestamp + offset
+            day = local - local % 86400
+            if day - previousOffset < since:
+                days.append(day - previousOffset)   # midnight was before the last transition
+            elif day - offset >= since:
+                days.append(day - offset)
+            else:
+                days.append(since)                  # midnight skipped by the transition
+        return days
+
+    def localDayTimestamp(self, timestamp):
+        return self.localDayTimestamps([timestamp])[0]
+
+    def __offsets(self, timestamps):
+        # (timestamp, offset, time of the transition to this offset, offset before it) for each timestamp
+        table = None
+        for timestamp in timestamps:
+            if table is None or not table.startTimestamp <= timestamp < table.endTimestamp:
+                table = self.yearTable(self.__utcYear(timestamp))
+            index = table.index(timestamp)
+            yield timestamp, table.offsets[index], table.timestamps[index], table.offsets[max(0, index - 1)]
+
+    def __utcYear(self, timestamp):
+        return datetime.datetime.utcfromtimestamp(timestamp).year
+
+    def __repr__(self):
+        return "RMTimeZone(%s, %s)" % (self.name, self.rule.tz)
+
+
+ruleCache = RMTimeZoneLRU(CACHE_SIZE)
+
+def rmGetTimeZone(name):
+    """
+    Returns the RMTimeZone of a rmTimeZoneDB zone name or POSIX TZ string, raises ValueError if unknown or invalid
+    """
+    tz = rmLookupTimeZone(name, name)
+    if not tz:
+        raise ValueError("Timezone %s has no POSIX rule" % name) # zoneinfo without a TZ footer (Asia/Tehran)
+    return RMTimeZone(name, ruleCache.get(tz, lambda: RMTimeZoneRule(tz)))
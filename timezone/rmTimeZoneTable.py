@@ -0,0 +1,182 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+import os
+import mmap
+import struct
+import threading
+
+#-----------------------------------------------------------------------------------------------
+#
+# Binary version of rmTimeZoneDB written by __export-common-timezone.py. The file is memory mapped
+# and a zone is found by binary search on the sorted zone records, nothing is parsed at import.
+#
+#   header  "RMTZ", version, zone count, rule count
+#   zones   name offset, name length, rule index          (sorted by name)
+#   rules   rule offset, rule length, flags, std offset, dst offset (seconds east of UTC)
+#   strings zone names and rule strings (each rule is stored once)
+#
+# All numbers are little endian.
+#
+
+TABLE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rmTimeZoneDB.bin")
+TABLE_MAGIC = "RMTZ"
+TABLE_VERSION = 1
+
+HEADER = struct.Struct("<4sHHII")   # magic, version, reserved, zones, rules
+ZONE = struct.Struct("<IHH")        # name offset, name length, rule index
+RULE = struct.Struct("<IHBxii")     # rule offset, rule length, flags, std offset, dst offset
+
+RULE_HAS_DST = 0x1
+RULE_INVALID = 0x2 # zone without a POSIX rule (Asia/Tehran)
+
+
+def rmWriteTimeZoneTable(timezones, fileName):
+    """
+    Writes the {zone name: POSIX TZ string} dict as a binary table
+    """
+    from rmTimeZoneRules import RMTimeZoneRule
+
+    ruleStrings = sorted(set(timezones.itervalues()))
+    ruleIndexes = dict((rule, index) for index, rule in enumerate(ruleStrings))
+    names = sorted(timezones)
+
+    stringsOffset = HEADER.size + ZONE.size * len(names) + RULE.size * len(ruleStrings)
+    strings = []
+    stringsSize = [0]
+
+    def addString(value):
+        offset = stringsOffset + stringsSize[0]
+        strings.append(value)
+        stringsSize[0] += len(value)
+        return offset
+
+    zoneRecords = []
+    for name in names:
+        zoneRecords.append(ZONE.pack(addString(name), len(name), ruleIndexes[timezones[name]]))
+
+    ruleRecords = []
+    for rule in ruleStrings:
+        flags = 0
+        stdOffset = dstOffset = 0
+        try:
+            parsed = RMTimeZoneRule(rule)
+            stdOffset, dstOffset = parsed.stdOffset, parsed.dstOffset
+            if parsed.hasDst:
+                flags |= RULE_HAS_DST
+        except ValueError:
+            flags |= RULE_INVALID
+        ruleRecords.append(RULE.pack(addString(rule), len(rule), flags, stdOffset, dstOffset))
+
+    tempFile = fileName + ".tmp"
+    with open(tempFile, "wb") as f:
+        f.write(HEADER.pack(TABLE_MAGIC, TABLE_VERSION, 0, len(names), len(ruleStrings)))
+        f.write("".join(zoneRecords))
+        f.write("".join(ruleRecords))
+        f.write("".join(strings))
+    os.rename(tempFile, fileName)
+
+
+class RMTimeZoneTable(object):
+    def __init__(self, fileName = TABLE_FILE):
+        self.fileName = fileName
+        with open(fileName, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+
+        magic, version, reserved, self.zoneCount, self.ruleCount = HEADER.unpack_from(self.data, 0)
+        if magic != TABLE_MAGIC or version != TABLE_VERSION:
+            self.data.close()
+            raise ValueError("%s is not a timezone table (version %d)" % (fileName, TABLE_VERSION))
+
+        self.zonesOffset = HEADER.size
+        self.rulesOffset = self.zonesOffset + ZONE.size * self.zoneCount
+
+    def __len__(self):
+        return self.zoneCount
+
+    def __contains__(self, name):
+        return self.__find(name) is not None
+
+    def lookup(self, name, default = None):
+        """
+        Returns the POSIX TZ string of a zone ("" for zones without a rule) or default if the zone is unknown
+        """
+        ruleIndex = self.__find(name)
+        if ruleIndex is None:
+            return default
+        ruleOffset, ruleLength = RULE.unpack_from(self.data, self.rulesOffset + RULE.size * ruleIndex)[:2]
+        return self.data[ruleOffset:ruleOffset + ruleLength]
+
+    def offsets(self, name):
+        """
+        Returns (std offset, dst offset, has dst) in seconds east of UTC without parsing the rule, None if the zone is
+        unknown or has no rule
+        """
+        ruleIndex = self.__find(name)
+        if ruleIndex is None:
+            return None
+        ruleOffset, ruleLength, flags, stdOffset, dstOffset = RULE.unpack_from(self.data, self.rulesOffset + RULE.size * ruleIndex)
+        if flags & RULE_INVALID:
+            return None
+        return stdOffset, dstOffset, bool(flags & RULE_HAS_DST)
+
+    def names(self):
+        for index in xrange(self.zoneCount):
+            yield self.__name(index)
+
+    def close(self):
+        self.data.close()
+
+    def __name(self, index):
+        nameOffset, nameLength, ruleIndex = ZONE.unpack_from(self.data, self.zonesOffset + ZONE.size * index)
+        return self.data[nameOffset:nameOffset + nameLength]
+
+    def __find(self, name):
+        if isinstance(name, unicode):
+            name = name.encode("utf-8")
+        low, high = 0, self.zoneCount
+        while low < high:
+            middle = (low + high) // 2
+            nameOffset, nameLength, ruleIndex = ZONE.unpack_from(self.data, self.zonesOffset + ZONE.size * middle)
+            current = self.data[nameOffset:nameOffset + nameLength]
+            if current < name:
+                low = middle + 1
+            elif current > name:
+                high = middle
+            else:
+                return ruleIndex
+        return None
+
+
+globalTimeZoneTable = None
+globalTimeZoneTableLock = threading.Lock()
+
+def rmGetTimeZoneTable():
+    """
+    Returns the shared table of rmTimeZoneDB.bin, None if the file wasn't generated
+    """
+    global globalTimeZoneTable
+    with globalTimeZoneTableLock:
+        if globalTimeZoneTable is None and os.path.exists(TABLE_FILE):
+            globalTimeZoneTable = RMTimeZoneTable(TABLE_FILE)
+        return globalTimeZoneTable
+
+def rmLookupTimeZone(name, default = None):
+    """
+    POSIX TZ string of a zone from the binary table, or from the rmTimeZoneDB dict when the table is missing
+    """
+    table = rmGetTimeZoneTable()
+    if table is not None:
+        return table.lookup(name, default)
+
+    from rmTimeZoneDB import rmTimeZoneDB
+    return rmTimeZoneDB.get(name, default)
+
+
+# Builds the table from rmTimeZoneDB.py when the zoneinfo files used by __export-common-timezone.py aren't available
+if __name__ == "__main__":
+    from rmTimeZoneDB import rmTimeZoneDB
+    rmWriteTimeZoneTable(rmTimeZoneDB, TABLE_FILE)
+    print "Wrote %d zones to %s" % (len(rmTimeZoneDB), TABLE_FILE)